@@ -0,0 +1,419 @@
+"""
+Online anomaly detection for incoming sensor readings.
+
+Each device owns one row of a preallocated state table (numpy arrays of
+shape (devices, 7)), updated in O(1) per reading.  At most ``max_devices``
+are tracked; past that the least recently seen device's row is reset and
+reused.  Devices are keyed by workspace and device id (``state_key``), and
+only readings of authenticated devices are tracked, so a caller without the
+device's key cannot skew its statistics.  A row holds:
+
+* Welford running mean / variance over the device's whole history;
+* an exponentially weighted mean / variance (EWMA, ``alpha``) that follows
+  slow drift;
+* a run length of consecutive identical values.
+
+A reading is flagged as a ``spike`` on a sensor whose value is more than
+``z_threshold`` EWMA standard deviations from the EWMA mean, and as
+``stuck`` once a sensor in ``stuck_features`` has repeated the exact same
+value ``stuck_readings`` times (a frozen probe).  Nothing is flagged until a
+device has ``min_samples`` readings.
+
+Flags are stored on the reading and pushed to the workspace's dashboard
+group as alerts, at most once per ``alert_interval`` seconds per device,
+sensor and kind.
+
+State is per process: devices that always reach the same worker (e.g. over
+the device WebSocket) get the most consistent statistics.  Nothing is loaded
+or started at import; on the first reading a process loads the saved state
+and starts checkpointing, so management commands never touch it.  Each
+process checkpoints to its own file next to ANOMALY_STATE_PATH
+(``anomaly_state.<pid>.npz``) every ANOMALY_CHECKPOINT_INTERVAL seconds and
+at exit, only when the table has changed.  On start the saved files are
+merged, keeping for each device the row with the most readings; files of
+processes that are no longer running are deleted once the merged state has
+been saved.
+"""
+import atexit
+import glob
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.utils import timezone
+
+from .live_stream import group_name
+from .readings import FEATURES
+
+logger = logging.getLogger(__name__)
+
+STATE_ARRAYS = ('count', 'mean', 'm2', 'ewma', 'ewvar', 'last', 'run')
+
+
+class AnomalyDetector:
+    def __init__(self, alpha=0.05, z_threshold=4.0, min_samples=30, stuck_readings=20,
+                 stuck_features=('temperature', 'moisture', 'pH', 'conductivity'), capacity=256,
+                 max_devices=10000, state_path=None, checkpoint_interval=60):
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.min_samples = min_samples
+        self.stuck_readings = stuck_readings
+        self.stuck_mask = np.array([name in stuck_features for name in FEATURES])
+        self.max_devices = max_devices
+        self.state_path = state_path
+        self.checkpoint_interval = checkpoint_interval
+
+        self.devices = OrderedDict()  # device_id -> row, least recently seen first
+        self.dirty = False  # changed since the last save
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._started = False
+        self._stale_paths = []
+        self._allocate(capacity)
+
+        self.checked = 0
+        self.evicted = 0
+        self.flagged = {'spike': 0, 'stuck': 0}
+
+    def _allocate(self, capacity):
+        width = len(FEATURES)
+        self.count = np.zeros(capacity, dtype=np.int64)
+        self.mean = np.zeros((capacity, width))
+        self.m2 = np.zeros((capacity, width))
+        self.ewma = np.zeros((capacity, width))
+        self.ewvar = np.zeros((capacity, width))
+        self.last = np.full((capacity, width), np.nan)
+        self.run = np.zeros((capacity, width), dtype=np.int64)
+
+    def _grow(self):
+        old = {name: getattr(self, name) for name in STATE_ARRAYS}
+        self._allocate(min(2 * len(self.count), self.max_devices))
+        for name, array in old.items():
+            getattr(self, name)[:len(array)] = array
+
+    def _reset(self, row):
+        for name in STATE_ARRAYS:
+            getattr(self, name)[row] = np.nan if name == 'last' else 0
+
+    def _row(self, device_id):
+        row = self.devices.get(device_id)
+        if row is not None:
+            self.devices.move_to_end(device_id)
+            return row
+        if len(self.devices) >= self.max_devices:
+            # Full: the least recently seen device gives up its row
+            _, row = self.devices.popitem(last=False)
+            self._reset(row)
+            self.evicted += 1
+        else:
+            row = len(self.devices)
+            if row == len(self.count):
+                self._grow()
+        self.devices[device_id] = row
+        return row
+
+    def update(self, device_id, values):
+        """
+        Fold one (7,) reading into the device's state.  Returns
+        ``[(sensor, kind), ...]`` for every sensor flagged on this reading.
+        """
+        return self.update_many(device_id, [values])[0]
+
+    def update_many(self, device_id, rows):
+        """
+        Fold a device's (n, 7) readings into its state in order, under one
+        lock.  Returns the flags of each reading, as ``update`` does.
+        """
+        self._start()
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, len(FEATURES))
+        with self._lock:
+            i = self._row(device_id)
+            self.checked += len(rows)
+            self.dirty = True
+            flags = [self._fold(i, x) for x in rows]
+
+        for row_flags in flags:
+            for _, kind in row_flags:
+                self.flagged[kind] += 1
+        return flags
+
+    def _fold(self, i, x):
+        flags = []
+
+        if self.count[i] >= self.min_samples:
+            sigma = np.sqrt(self.ewvar[i])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                spikes = (sigma > 0) & (np.abs(x - self.ewma[i]) > self.z_threshold * sigma)
+            for j in np.flatnonzero(spikes):
+                flags.append((FEATURES[j], 'spike'))
+
+        same = x == self.last[i]
+        self.run[i] = np.where(same, self.run[i] + 1, 0)
+        self.last[i] = x
+        if self.count[i] >= self.min_samples:
+            # Flag a stuck sensor once, when its run reaches the limit
+            for j in np.flatnonzero(self.stuck_mask & (self.run[i] == self.stuck_readings - 1)):
+                flags.append((FEATURES[j], 'stuck'))
+
+        # Welford
+        self.count[i] += 1
+        delta = x - self.mean[i]
+        self.mean[i] += delta / self.count[i]
+        self.m2[i] += delta * (x - self.mean[i])
+
+        # EWMA mean / variance (the first reading seeds the mean)
+        if self.count[i] == 1:
+            self.ewma[i] = x
+        else:
+            diff = x - self.ewma[i]
+            increment = self.alpha * diff
+            self.ewma[i] += increment
+            self.ewvar[i] = (1 - self.alpha) * (self.ewvar[i] + diff * increment)
+
+        return flags
+
+    def stats(self, device_id):
+        """Long-run mean / std and EWMA mean of a device, or None if it is unknown."""
+        row = self.devices.get(device_id)
+        if row is None:
+            return None
+        n = self.count[row]
+        std = np.sqrt(self.m2[row] / (n - 1)) if n > 1 else np.zeros(len(FEATURES))
+        return {'count': int(n), 'mean': self.mean[row].tolist(), 'std': std.tolist(),
+                'ewma': self.ewma[row].tolist()}
+
+    def save(self, path):
+        """
+        Write the state table atomically (a temporary file renamed over
+        ``path``).  Returns False without writing when nothing changed.
+        """
+        with self._lock:
+            if not self.dirty:
+                return False
+            # Saved in LRU order, so a reload that has to drop devices keeps the recent ones
+            rows = np.fromiter(self.devices.values(), dtype=np.int64, count=len(self.devices))
+            arrays = {name: getattr(self, name)[rows] for name in STATE_ARRAYS}
+            device_ids = np.array(list(self.devices), dtype=str)
+            self.dirty = False
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                np.savez(f, device_ids=device_ids, **arrays)
+            os.replace(tmp, path)
+        except OSError:
+            self.dirty = True
+            raise
+        return True
+
+    def load(self, *paths):
+        """
+        Load the state saved in ``paths``; a device found in several keeps the
+        row with the most readings.
+        """
+        rows = {}  # device_id -> (path index, row)
+        tables = []
+        for path in paths:
+            with np.load(path) as data:
+                table = {name: data[name] for name in ('device_ids', *STATE_ARRAYS)}
+            for row, device_id in enumerate(table['device_ids'].tolist()):
+                best = rows.get(device_id)
+                if best is None or table['count'][row] > tables[best[0]]['count'][best[1]]:
+                    rows[device_id] = (len(tables), row)
+            tables.append(table)
+        rows = dict(list(rows.items())[-self.max_devices:])
+        with self._lock:
+            capacity = max(len(self.count), 1)
+            while capacity < len(rows):
+                capacity *= 2
+            self._allocate(capacity)
+            for i, (t, row) in enumerate(rows.values()):
+                for name in STATE_ARRAYS:
+                    getattr(self, name)[i] = tables[t][name][row]
+            self.devices = OrderedDict((device_id, i) for i, device_id in enumerate(rows))
+        logger.info("Loaded anomaly state for %d devices from %d file(s)", len(rows), len(paths))
+
+    def _process_path(self, pid):
+        stem, ext = os.path.splitext(self.state_path)
+        return f'{stem}.{pid}{ext}'
+
+    def _saved_paths(self):
+        """The shared state file (if any) and every per-process one, with the pid each belongs to."""
+        stem, ext = os.path.splitext(self.state_path)
+        paths = [(None, self.state_path)] if os.path.exists(self.state_path) else []
+        for path in glob.glob(f'{glob.escape(stem)}.*{ext}'):
+            pid = path[len(stem) + 1:len(path) - len(ext)]
+            if pid.isdigit():
+                paths.append((int(pid), path))
+        return paths
+
+    def _start(self):
+        # Started on first use so management commands importing the views neither
+        # load the state nor spawn the checkpoint thread
+        if self._started or not self.state_path:
+            return
+        with self._start_lock:
+            if self._started:
+                return
+            saved = self._saved_paths()
+            if saved:
+                try:
+                    self.load(*(path for _, path in saved))
+                except (OSError, ValueError, KeyError):
+                    logger.exception("Could not load anomaly state from %s; starting cold", self.state_path)
+                else:
+                    # Merged into this process's state: deleted after its first save
+                    self._stale_paths = [path for pid, path in saved
+                                         if pid is None or (pid != os.getpid() and not _running(pid))]
+            threading.Thread(target=self._checkpoint_loop, name='anomaly-checkpoint', daemon=True).start()
+            atexit.register(self.checkpoint)
+            self._started = True
+
+    def checkpoint(self):
+        """Save to this process's state file if anything changed."""
+        try:
+            if not self.save(self._process_path(os.getpid())):
+                return
+        except OSError:
+            logger.exception("Anomaly state checkpoint failed")
+            return
+        stale, self._stale_paths = self._stale_paths, []
+        for path in stale:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _checkpoint_loop(self):
+        while True:
+            time.sleep(self.checkpoint_interval)
+            self.checkpoint()
+
+    def metric_counters(self):
+        return [
+            ('soilution_anomaly_readings_total', 'counter', 'Readings checked for anomalies.', self.checked),
+            ('soilution_anomaly_devices', 'gauge', 'Devices with anomaly state in this process.',
+             len(self.devices)),
+            ('soilution_anomaly_devices_evicted_total', 'counter', 'Devices whose state was dropped at the cap.',
+             self.evicted),
+            ('soilution_anomalies_total{kind="spike"}', 'counter', 'Sensors flagged as anomalous.',
+             self.flagged['spike']),
+            ('soilution_anomalies_total{kind="stuck"}', 'counter', 'Sensors flagged as anomalous.',
+             self.flagged['stuck']),
+        ]
+
+
+class AlertPublisher:
+    """Pushes flagged readings to the workspace group, throttled per device, sensor and kind."""
+
+    def __init__(self, interval=60.0, max_entries=100000):
+        self.interval = interval
+        self.max_entries = max_entries
+        self._last_sent = OrderedDict()  # oldest send first
+        self.sent = 0
+
+    async def publish(self, workspace_id, device_id, flags, values):
+        now = time.monotonic()
+        # Sends older than the interval no longer throttle anything
+        last_sent = self._last_sent
+        while last_sent and (len(last_sent) > self.max_entries
+                             or now - next(iter(last_sent.values())) >= self.interval):
+            last_sent.popitem(last=False)
+        fresh = []
+        for sensor, kind in flags:
+            key = (workspace_id, device_id, sensor, kind)
+            if key not in last_sent:
+                last_sent[key] = now
+                fresh.append({'sensor': sensor, 'kind': kind,
+                              'value': round(float(values[FEATURES.index(sensor)]), 3)})
+        if not fresh:
+            return
+        self.sent += 1
+        await get_channel_layer().group_send(group_name(workspace_id), {
+            "type": "workspace.alert",
+            "device_id": device_id,
+            "anomalies": fresh,
+            "timestamp": timezone.now().isoformat(),
+        })
+
+    def metric_counters(self):
+        return [
+            ('soilution_anomaly_alerts_total', 'counter', 'Anomaly alerts pushed to workspace dashboards.',
+             self.sent),
+        ]
+
+
+def _running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def format_flags(flags):
+    """Flags as stored on SensorReading.anomalies, e.g. 'pH:stuck,conductivity:spike'."""
+    return ','.join(f'{sensor}:{kind}' for sensor, kind in flags)
+
+
+def build_detector():
+    """The detector configured in settings, or None when ANOMALY_DETECTION is off."""
+    if not getattr(settings, 'ANOMALY_DETECTION', True):
+        return None
+    return AnomalyDetector(
+        alpha=getattr(settings, 'ANOMALY_EWMA_ALPHA', 0.05),
+        z_threshold=getattr(settings, 'ANOMALY_Z_THRESHOLD', 4.0),
+        min_samples=getattr(settings, 'ANOMALY_MIN_SAMPLES', 30),
+        stuck_readings=getattr(settings, 'ANOMALY_STUCK_READINGS', 20),
+        max_devices=getattr(settings, 'ANOMALY_MAX_DEVICES', 10000),
+        state_path=getattr(settings, 'ANOMALY_STATE_PATH', None) or None,
+        checkpoint_interval=getattr(settings, 'ANOMALY_CHECKPOINT_INTERVAL', 60),
+    )
+
+
+detector = build_detector()
+alerts = AlertPublisher(getattr(settings, 'ANOMALY_ALERT_INTERVAL', 60))
+
+
+def state_key(workspace_id, device_id):
+    """Detector key of a device: the same device id in two workspaces is two devices."""
+    return f'{workspace_id}:{device_id}'
+
+
+async def check(workspace_id, device_id, values):
+    """
+    Run one reading through the detector and alert its workspace; returns the
+    flags.  Only readings of authenticated devices (a workspace_id, see
+    views.reading_origin) are tracked, so nobody can skew another device's
+    statistics by posting under its id.
+    """
+    if detector is None or workspace_id is None or not device_id:
+        return []
+    flags = detector.update(state_key(workspace_id, device_id), values)
+    if flags:
+        await alerts.publish(workspace_id, device_id, flags, values)
+    return flags
+
+
+async def check_many(workspace_id, device_id, rows):
+    """
+    ``check`` for a device's (n, 7) readings, in order; returns the flags of
+    each.  The rows are folded on a worker thread, so a large batch does not
+    hold up the event loop.
+    """
+    if detector is None or workspace_id is None or not device_id:
+        return [[] for _ in range(len(rows))]
+    key = state_key(workspace_id, device_id)
+    flags = await sync_to_async(detector.update_many, thread_sensitive=False)(key, rows)
+    for row_flags, values in zip(flags, rows):
+        if row_flags:
+            await alerts.publish(workspace_id, device_id, row_flags, values)
+    return flags
@@ -6,4 +6,5 @@ class DetectorConfig(AppConfig):
     name = 'detector'
 
     def ready(self):
+        import detector.checks
         import detector.signals
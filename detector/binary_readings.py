@@ -0,0 +1,98 @@
+"""
+Fixed-layout binary readings for ESP32 devices.
+
+Sent with ``Content-Type: application/vnd.soilution.readings`` to either ESP32
+endpoint.  A body is one 28-byte little-endian header followed by ``count``
+32-byte records::
+
+    struct header {            struct record {
+        char     magic[4];         uint32_t seq;
+        uint8_t  version;          float    nitrogen, phosphorus, potassium;
+        uint8_t  flags;            float    temperature, moisture, pH;
+        uint16_t count;            float    conductivity;
+        char     device_id[16];  };
+        uint32_t workspace_id;
+    };
+
+``magic`` is ``b'SRDG'``, ``version`` is FORMAT_VERSION and ``flags`` is 0 or
+FLAG_SEQ.  Only with FLAG_SEQ are the records' ``seq`` fields device-assigned
+sequence numbers, used to recognise retransmissions (see dedup); without it
+they are ignored and should be 0.  ``device_id`` is ASCII, NUL-padded;
+``workspace_id`` 0 means "not named".
+Readings are only stored with a device key (see devices), and a device or
+workspace named here must be the key's.  Both structs are packed and
+naturally aligned, so firmware can fill them in place and send the bytes.
+
+Decoding never copies the readings: the (n, 7) float32 matrix and the (n,)
+sequence numbers (None without FLAG_SEQ) are strided views over the request
+body.
+"""
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+from .readings import FEATURES, ReadingError, invalid_rows
+
+CONTENT_TYPE = 'application/vnd.soilution.readings'
+
+MAGIC = b'SRDG'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sBBH16sI')
+DEVICE_ID_BYTES = 16
+
+# Header flags
+FLAG_SEQ = 0x01
+
+# seq + one float32 per feature, all 4 bytes wide
+RECORD_WORDS = 1 + len(FEATURES)
+RECORD_BYTES = RECORD_WORDS * 4
+
+BinaryBatch = namedtuple('BinaryBatch', 'device_id workspace_id seq matrix errors')
+
+
+def decode(body):
+    """
+    Decode a binary body into a BinaryBatch.  ``errors`` maps the index of
+    every record holding a NaN or infinite value to a message, as
+    ``readings.parse_readings`` does for JSON.
+    """
+    if len(body) < HEADER.size:
+        raise ReadingError(f'Binary body shorter than its {HEADER.size}-byte header.')
+    magic, version, flags, count, device_id, workspace_id = HEADER.unpack_from(body)
+    if magic != MAGIC:
+        raise ReadingError(f'Bad magic {magic!r}, expected {MAGIC!r}.')
+    if version != FORMAT_VERSION:
+        raise ReadingError(f'Unsupported binary format version {version}, expected {FORMAT_VERSION}.')
+    if flags & ~FLAG_SEQ:
+        raise ReadingError(f'Unknown flags 0x{flags & ~FLAG_SEQ:02x}.')
+    expected = HEADER.size + count * RECORD_BYTES
+    if len(body) != expected:
+        raise ReadingError(f'Header announces {count} records ({expected} bytes), body has {len(body)} bytes.')
+
+    words = np.frombuffer(body, dtype='<u4', count=count * RECORD_WORDS, offset=HEADER.size)
+    words = words.reshape(count, RECORD_WORDS)
+    seq = words[:, 0] if flags & FLAG_SEQ else None
+    matrix = words.view('<f4')[:, 1:]
+    try:
+        device_id = device_id.rstrip(b'\0').decode('ascii')
+    except UnicodeDecodeError:
+        raise ReadingError('device_id must be ASCII.')
+    return BinaryBatch(device_id, workspace_id or None, seq, matrix, invalid_rows(matrix))
+
+
+def encode(rows, seq=None, device_id='', workspace_id=0):
+    """
+    Reference encoder: pack a (n, 7) matrix in FEATURES order into a binary
+    body.  FLAG_SEQ is set only when per-row sequence numbers are given.
+    """
+    rows = np.asarray(rows, dtype='<f4').reshape(-1, len(FEATURES))
+    count = len(rows)
+    if count > 0xFFFF:
+        raise ValueError(f'At most 65535 records per body, got {count}.')
+    records = np.empty((count, RECORD_WORDS), dtype='<u4')
+    records[:, 0] = 0 if seq is None else seq
+    records.view('<f4')[:, 1:] = rows
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, 0 if seq is None else FLAG_SEQ, count,
+                         device_id.encode('ascii')[:DEVICE_ID_BYTES], workspace_id)
+    return header + records.tobytes()
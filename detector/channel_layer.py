@@ -0,0 +1,339 @@
+"""
+A channel layer shared by every worker process through the database.
+
+Messages are ChannelMessage rows and group memberships ChannelGroupMembership
+rows, so a ``group_send`` from one worker reaches sockets held by any other.
+A receiver claims the oldest live message of its channel with one
+``DELETE ... RETURNING`` (``FOR UPDATE SKIP LOCKED`` on Postgres), so no
+message is delivered twice.
+
+On Postgres every send also NOTIFYs the channel name.  Each process LISTENs
+on one extra connection per event loop (psycopg2) and wakes the matching
+receiver at once.  Other databases (SQLite) poll, every ``poll_interval``
+seconds at first; each empty poll doubles the wait up to
+``max_poll_interval``, and a message resets it.  Postgres polls too, but far
+less often, to catch anything sent while the listener was reconnecting.
+Consumers that never receive channel messages (DeviceConsumer) set
+``channel_layer_alias = None`` and so run no receive loop at all.
+
+Messages must be JSON-serializable; everything this project sends is.
+``capacity`` (``channel_capacity`` for name patterns) is checked with a count
+before the insert, so concurrent senders can overshoot it slightly.  A full
+channel makes ``send`` raise ChannelFull, while ``group_send`` skips it, as
+channels_redis does.  Messages older than ``expiry`` seconds, and memberships
+not renewed within ``group_expiry``, are never delivered.  Each process
+deletes them at most once every ``expiry`` seconds.
+
+Database calls run on executor threads, each with its own connection, which
+is closed after every call once it is broken or older than CONN_MAX_AGE
+(DATABASE_CONN_MAX_AGE).  A database error while receiving is logged and the
+receive retried with backoff, so an outage does not close every socket.
+
+``manage.py benchmark_channel_layer`` compares it with InMemoryChannelLayer.
+"""
+import asyncio
+import json
+import logging
+import time
+import uuid
+import weakref
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, connections, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import ChannelGroupMembership, ChannelMessage
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = 'soilution_channel_layer'
+
+
+class _Listener:
+    """LISTENs on a dedicated Postgres connection and wakes one event loop's receivers."""
+
+    def __init__(self, alias, loop):
+        self.alias = alias
+        self.loop = loop
+        self.events = {}  # channel -> asyncio.Event
+        self.connection = None
+        self._fd = None
+        self._task = loop.create_task(self._connect())
+
+    def event(self, channel):
+        event = self.events.get(channel)
+        if event is None:
+            event = self.events[channel] = asyncio.Event()
+        return event
+
+    def _open(self):
+        wrapper = connections[self.alias]
+        connection = wrapper.get_new_connection(wrapper.get_connection_params())
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f'LISTEN {NOTIFY_CHANNEL}')
+        return connection
+
+    async def _connect(self):
+        while self.connection is None:
+            try:
+                connection = await self.loop.run_in_executor(None, self._open)
+            except Exception:
+                logger.exception("Channel layer LISTEN connection failed; polling until it is back")
+                await asyncio.sleep(5)
+                continue
+            self.connection, self._fd = connection, connection.fileno()
+            self.loop.add_reader(self._fd, self._readable)
+            # Catch up on anything sent while not listening
+            for event in self.events.values():
+                event.set()
+
+    def _readable(self):
+        try:
+            self.connection.poll()
+        except Exception:
+            logger.warning("Channel layer LISTEN connection lost; reconnecting", exc_info=True)
+            self._drop()
+            self._task = self.loop.create_task(self._connect())
+            return
+        notifies = self.connection.notifies
+        while notifies:
+            event = self.events.get(notifies.pop(0).payload)
+            if event is not None:
+                event.set()
+
+    def _drop(self):
+        if self.connection is None:
+            return
+        self.loop.remove_reader(self._fd)
+        try:
+            self.connection.close()
+        except Exception:
+            pass
+        self.connection = self._fd = None
+
+    def close(self):
+        self._task.cancel()
+        self._drop()
+
+
+class DatabaseChannelLayer(BaseChannelLayer):
+    extensions = ['groups', 'flush']
+
+    def __init__(self, expiry=60, group_expiry=86400, capacity=100, channel_capacity=None,
+                 poll_interval=None, max_poll_interval=None, database='default'):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity)
+        self.group_expiry = group_expiry
+        self.database = database
+        self.postgres = connections[database].vendor == 'postgresql'
+        if poll_interval is None:
+            poll_interval = 1.0 if self.postgres else 0.05
+        self.poll_interval = poll_interval
+        if max_poll_interval is None:
+            max_poll_interval = 10.0 if self.postgres else 1.0
+        self.max_poll_interval = max(max_poll_interval, poll_interval)
+        self._listeners = weakref.WeakKeyDictionary()  # event loop -> _Listener
+        self._next_cleanup = 0.0
+        self._db = sync_to_async(self._call, thread_sensitive=False)
+
+        self.sent = 0
+        self.received = 0
+        self.dropped = 0
+        self.errors = 0
+
+    # Database side, run on executor threads (each with its own connection)
+
+    def _call(self, function, *args):
+        try:
+            return function(*args)
+        finally:
+            # Executor threads outlive requests, so nothing else would close their connections;
+            # a broken one is closed too, so this thread's next call reconnects
+            connections[self.database].close_if_unusable_or_obsolete()
+
+    def _messages(self):
+        return ChannelMessage.objects.using(self.database)
+
+    def _memberships(self):
+        return ChannelGroupMembership.objects.using(self.database)
+
+    def _wake(self, channels):
+        if self.postgres and channels:
+            with connections[self.database].cursor() as cursor:
+                cursor.execute('SELECT pg_notify(%s, channel) FROM unnest(%s::text[]) AS channel',
+                               [NOTIFY_CHANNEL, list(channels)])
+
+    def _cleanup(self, now):
+        if time.monotonic() < self._next_cleanup:
+            return
+        self._next_cleanup = time.monotonic() + self.expiry
+        self._messages().filter(expires__lte=now).delete()
+        self._memberships().filter(expires__lte=now).delete()
+
+    def _send(self, channel, payload):
+        now = timezone.now()
+        if self._messages().filter(channel=channel, expires__gt=now).count() >= self.get_capacity(channel):
+            return False
+        self._messages().create(channel=channel, payload=payload, expires=now + timedelta(seconds=self.expiry))
+        self._wake([channel])
+        self._cleanup(now)
+        return True
+
+    def _group_send(self, group, payload):
+        """Queue ``payload`` for every live member with room; returns how many were full."""
+        now = timezone.now()
+        members = list(self._memberships().filter(group=group, expires__gt=now).values_list('channel', flat=True))
+        if not members:
+            return 0
+        queued = dict(
+            self._messages().filter(channel__in=members, expires__gt=now)
+            .values('channel').annotate(n=Count('id')).values_list('channel', 'n')
+        )
+        room = [channel for channel in members if queued.get(channel, 0) < self.get_capacity(channel)]
+        expires = now + timedelta(seconds=self.expiry)
+        self._messages().bulk_create(
+            [ChannelMessage(channel=channel, payload=payload, expires=expires) for channel in room]
+        )
+        self._wake(room)
+        self._cleanup(now)
+        return len(members) - len(room)
+
+    def _claim(self, channel):
+        """Delete and return the payload of the channel's oldest live message, or None."""
+        now = timezone.now()
+        if self.postgres:
+            table = ChannelMessage._meta.db_table
+            with connections[self.database].cursor() as cursor:
+                cursor.execute(f"""
+                    DELETE FROM {table} WHERE id = (
+                        SELECT id FROM {table} WHERE channel = %s AND expires > %s
+                        ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED
+                    ) RETURNING payload
+                """, [channel, now])
+                row = cursor.fetchone()
+            return row[0] if row else None
+        while True:
+            with transaction.atomic(using=self.database):
+                row = (self._messages().filter(channel=channel, expires__gt=now)
+                       .order_by('id').values_list('id', 'payload').first())
+                if row is None:
+                    return None
+                # Zero rows deleted: another receiver took it first
+                if self._messages().filter(pk=row[0]).delete()[0]:
+                    return row[1]
+
+    def _group_add(self, group, channel):
+        self._memberships().bulk_create(
+            [ChannelGroupMembership(group=group, channel=channel,
+                                    expires=timezone.now() + timedelta(seconds=self.group_expiry))],
+            update_conflicts=True, unique_fields=['group', 'channel'], update_fields=['expires'],
+        )
+
+    def _group_discard(self, group, channel):
+        self._memberships().filter(group=group, channel=channel).delete()
+
+    def _flush(self):
+        self._messages().delete()
+        self._memberships().delete()
+
+    # Channel layer API
+
+    def _listener(self):
+        if not self.postgres:
+            return None
+        loop = asyncio.get_running_loop()
+        listener = self._listeners.get(loop)
+        if listener is None:
+            listener = self._listeners[loop] = _Listener(self.database, loop)
+        return listener
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_channel_name(channel)
+        if not await self._db(self._send, channel, json.dumps(message, cls=DjangoJSONEncoder)):
+            raise ChannelFull(channel)
+        self.sent += 1
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        listener = self._listener()
+        interval = self.poll_interval
+        failing = False
+        try:
+            while True:
+                event = listener.event(channel) if listener is not None else None
+                if event is not None:
+                    event.clear()
+                try:
+                    payload = await self._db(self._claim, channel)
+                except DatabaseError:
+                    if not failing:
+                        logger.warning("Channel layer receive failed; retrying", exc_info=True)
+                    failing = True
+                    self.errors += 1
+                    await asyncio.sleep(interval)
+                    interval = min(interval * 2, self.max_poll_interval)
+                    continue
+                if failing:
+                    logger.info("Channel layer receive recovered")
+                    failing = False
+                if payload is not None:
+                    self.received += 1
+                    return json.loads(payload)
+                if event is None:
+                    await asyncio.sleep(interval)
+                else:
+                    try:
+                        await asyncio.wait_for(event.wait(), interval)
+                    except asyncio.TimeoutError:
+                        pass
+                # Idle channels are polled less and less often
+                interval = min(interval * 2, self.max_poll_interval)
+        finally:
+            if listener is not None:
+                listener.events.pop(channel, None)
+
+    async def new_channel(self, prefix='specific'):
+        return f'{prefix}.db!{uuid.uuid4().hex}'
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self._db(self._group_add, group, channel)
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self._db(self._group_discard, group, channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_group_name(group)
+        self.dropped += await self._db(self._group_send, group, json.dumps(message, cls=DjangoJSONEncoder))
+        self.sent += 1
+
+    async def flush(self):
+        await self._db(self._flush)
+
+    async def close(self):
+        """Stop listening on the running event loop."""
+        listener = self._listeners.pop(asyncio.get_running_loop(), None)
+        if listener is not None:
+            listener.close()
+
+    def metric_counters(self):
+        return [
+            ('soilution_channel_layer_sent_total', 'counter', 'Sends and group sends through the database channel layer.',
+             self.sent),
+            ('soilution_channel_layer_received_total', 'counter', 'Messages received from the database channel layer.',
+             self.received),
+            ('soilution_channel_layer_dropped_total', 'counter', 'Group messages dropped for full member channels.',
+             self.dropped),
+            ('soilution_channel_layer_receive_errors_total', 'counter', 'Database errors while receiving (retried).',
+             self.errors),
+        ]
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+DATABASE_CHANNEL_LAYER = 'detector.channel_layer.DatabaseChannelLayer'
+PER_PROCESS_CACHE = 'django.core.cache.backends.locmem.LocMemCache'
+
+
+@register()
+def inbox_cache_shared(app_configs, **kwargs):
+    """With the database channel layer, workers must share the inbox cache (see inbox)."""
+    layer = settings.CHANNEL_LAYERS.get('default', {}).get('BACKEND')
+    alias = getattr(settings, 'INBOX_CACHE_ALIAS', 'default')
+    if layer != DATABASE_CHANNEL_LAYER or settings.CACHES.get(alias, {}).get('BACKEND') != PER_PROCESS_CACHE:
+        return []
+    return [Error(
+        f"CACHES['{alias}'] (INBOX_CACHE_ALIAS) is per process, but the database channel layer "
+        "is meant for several workers: their inbox versions and unread totals would disagree.",
+        hint="Point INBOX_CACHE_ALIAS at a shared cache such as DatabaseCache or Redis.",
+        id='detector.E001',
+    )]
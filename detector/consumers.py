@@ -1,17 +1,39 @@
+import asyncio
 import json
+import logging
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from asgiref.sync import sync_to_async
-from .models import Message
+from django.conf import settings
+from .models import Message, Workspace
 from django.contrib.auth.models import User
 from django.utils.timesince import timesince
+from . import anomalies, binary_readings, devices, inbox, inference
+from .dedup import reading_id, recent_readings
+from .live_stream import group_name as workspace_group, reading_state, stream as live_stream
+from .rate_limit import bucket_key, controller as admission_controller
+from .reading_buffer import buffer as reading_buffer, make_reading
+from .readings import ReadingError, parse_readings
+
+logger = logging.getLogger(__name__)
 
 class InboxConsumer(AsyncWebsocketConsumer):
+    """
+    A user's inbox: ws/inbox/.
+
+    Sends {"type": "snapshot", "unread_count": n, "messages": [...]} on every
+    (re)connect, then {"type": "inbox_update", ...} deltas as messages are
+    sent or read (see inbox), so clients never poll.
+    """
+
     async def connect(self):
         user = self.scope["user"]
         if user.is_authenticated:
             self.group_name = f"user_{user.id}"
             await self.channel_layer.group_add(self.group_name, self.channel_name)
             await self.accept()
+            state = await sync_to_async(inbox.snapshot)(user)
+            await self.send(text_data=json.dumps({"type": "snapshot", **state}))
         else:
             await self.close()
 
@@ -35,6 +57,14 @@ class InboxConsumer(AsyncWebsocketConsumer):
             }
         }))
 
+    async def inbox_update(self, event):
+        delta = {key: event[key] for key in ("message", "read_sender_id", "read_message_id") if key in event}
+        await self.send(text_data=json.dumps({
+            "type": "inbox_update",
+            "unread_count": event["unread_count"],
+            **delta,
+        }))
+
     async def typing(self, event):
         sender_id = event['sender_id']
         await self.send(text_data=json.dumps({
@@ -61,3 +91,262 @@ class InboxConsumer(AsyncWebsocketConsumer):
                 }
             )
 
+
+
+class WorkspaceConsumer(AsyncWebsocketConsumer):
+    """
+    Live readings for one workspace's dashboard: ws/workspace/<workspace_id>/.
+
+    Sends {"type": "snapshot", "state": {...}} on connect, then coalesced
+    {"type": "update", "delta": {...}} messages (see live_stream), and
+    {"type": "alert", "anomalies": [...]} when a device's sensor is flagged.
+    """
+
+    async def connect(self):
+        user = self.scope["user"]
+        self.group_name = None
+        if not user.is_authenticated:
+            await self.refuse()
+            return
+        try:
+            workspace = await sync_to_async(Workspace.objects.get)(
+                id=self.scope["url_route"]["kwargs"]["workspace_id"], user=user
+            )
+        except Workspace.DoesNotExist:
+            await self.refuse()
+            return
+
+        self.group_name = workspace_group(workspace.id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+        state = await sync_to_async(live_stream.snapshot)(workspace.id)
+        await self.send(text_data=json.dumps({"type": "snapshot", "state": state}))
+
+    async def refuse(self):
+        # Closing before accept() fails the handshake, and the browser only sees
+        # code 1006; accepted first, the dashboard gets 4403 and stops reconnecting
+        await self.accept()
+        await self.close(code=4403)
+
+    async def disconnect(self, close_code):
+        if self.group_name:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def workspace_update(self, event):
+        await self.send(text_data=json.dumps({
+            "type": "update",
+            "keyframe": event["keyframe"],
+            "delta": event["delta"],
+            "readings": event["readings"],
+            "timestamp": event["timestamp"],
+        }))
+
+    async def workspace_alert(self, event):
+        await self.send(text_data=json.dumps({
+            "type": "alert",
+            "device_id": event["device_id"],
+            "anomalies": event["anomalies"],
+            "timestamp": event["timestamp"],
+        }))
+
+
+# Per-process counters for the device channel, exposed on /metrics/
+device_stats = {'connections': 0, 'frames': 0, 'readings': 0, 'dropped': 0, 'rejected': 0, 'shed': 0}
+
+
+class DeviceConsumer(AsyncWebsocketConsumer):
+    """
+    Long-lived ingestion socket for one device: ws/device/<device_id>/?key=<device key>.
+
+    Readings are stored only when the socket presents the key of the
+    registered device <device_id> (``?key=`` or an X-Device-Key header), in
+    that device's workspace; without a key they are only scored.  A
+    ``?workspace=`` (or binary header workspace) other than the key's is
+    refused.
+
+    Each frame is a JSON reading (or list of readings, each with an optional
+    "seq") or a binary body in the binary_readings format.  Recommendations
+    are sent back on the same socket as
+    {"type": "recommendations", "model_version": ..., "results": [...]}.
+
+    Frames wait in a bounded per-connection queue (DEVICE_WS_QUEUE_SIZE) and
+    are scored one at a time.  When a device sends faster than it is served,
+    DEVICE_WS_OVERFLOW decides what happens: 'drop-oldest' discards the
+    oldest waiting frame, 'reject' refuses the new one; either way the device
+    is told with a {"type": "dropped"} / {"type": "rejected"} frame.
+
+    Frames go through the same admission control (see rate_limit) as the
+    HTTP endpoints, keyed by the authenticated device (the client address
+    without a key): one token per frame, and the rest of its row cost once
+    the frame is parsed.  A shed frame is
+    answered with {"type": "rejected", "retry_after": seconds}.
+    """
+
+    # Devices are never sent channel-layer messages, so skip the per-socket receive loop
+    channel_layer_alias = None
+
+    async def connect(self):
+        self.device_id = self.scope["url_route"]["kwargs"]["device_id"]
+        params = parse_qs(self.scope.get("query_string", b"").decode())
+        key = params["key"][0] if params.get("key") else dict(self.scope.get("headers", [])).get(b"x-device-key")
+        try:
+            device = await devices.aauthenticate(key.decode() if isinstance(key, bytes) else key)
+            workspace_id = int(params["workspace"][0]) if params.get("workspace") else None
+        except devices.InvalidDeviceKey:
+            await self.refuse(4401)
+            return
+        except ValueError:
+            await self.refuse(4400)
+            return
+        if device is None:
+            if workspace_id is not None:
+                await self.refuse(4403)
+                return
+        elif device.device_id != self.device_id or workspace_id not in (None, device.workspace_id):
+            await self.refuse(4403)
+            return
+        self.workspace_id = device.workspace_id if device else None
+        self.rate_key = bucket_key(device, (self.scope.get("client") or [None])[0])
+
+        self.queue = asyncio.Queue(maxsize=getattr(settings, 'DEVICE_WS_QUEUE_SIZE', 32))
+        self.overflow = getattr(settings, 'DEVICE_WS_OVERFLOW', 'drop-oldest')
+        self.worker = asyncio.create_task(self.drain())
+        device_stats['connections'] += 1
+        await self.accept()
+
+    async def refuse(self, code):
+        # Accepted first so the device sees the close code instead of a failed handshake
+        await self.accept()
+        await self.close(code=code)
+
+    async def disconnect(self, close_code):
+        worker = getattr(self, 'worker', None)
+        if worker is not None:
+            worker.cancel()
+            device_stats['connections'] -= 1
+
+    async def receive(self, text_data=None, bytes_data=None):
+        device_stats['frames'] += 1
+        if admission_controller is not None:
+            retry_after = await admission_controller.aadmit(self.rate_key)
+            if retry_after:
+                await self.send(text_data=json.dumps(self.shed(retry_after)))
+                return
+        frame = (text_data, bytes_data)
+        if not self.queue.full():
+            self.queue.put_nowait(frame)
+        elif self.overflow == 'reject':
+            device_stats['rejected'] += 1
+            await self.send(text_data=json.dumps({'type': 'rejected', 'message': 'Device queue is full.'}))
+        else:
+            self.queue.get_nowait()
+            self.queue.put_nowait(frame)
+            device_stats['dropped'] += 1
+            await self.send(text_data=json.dumps({'type': 'dropped', 'message': 'Oldest queued frame dropped.'}))
+
+    @staticmethod
+    def shed(retry_after):
+        device_stats['shed'] += 1
+        return {'type': 'rejected', 'message': 'Rate limit exceeded.', 'retry_after': retry_after}
+
+    async def drain(self):
+        while True:
+            text_data, bytes_data = await self.queue.get()
+            try:
+                response = await self.score_frame(text_data, bytes_data)
+            except (ReadingError, ValueError) as e:
+                response = {'type': 'error', 'message': str(e)}
+            except Exception as e:
+                logger.exception("Scoring failed for device %s", self.device_id)
+                response = {'type': 'error', 'message': str(e)}
+            await self.send(text_data=json.dumps(response))
+
+    async def score_frame(self, text_data, bytes_data):
+        workspace_id = self.workspace_id
+        if bytes_data is not None:
+            batch = binary_readings.decode(bytes_data)
+            matrix, errors = batch.matrix, batch.errors
+            # Without FLAG_SEQ the records carry no ids, so nothing is deduplicated
+            seq = [None] * len(matrix) if batch.seq is None else batch.seq.tolist()
+            ids = [None if s is None else str(s) for s in seq]
+            if batch.workspace_id not in (None, workspace_id) or batch.device_id not in ('', self.device_id):
+                raise ReadingError('The binary header names another workspace or device than the device key.')
+        else:
+            data = json.loads(text_data)
+            readings = data if isinstance(data, list) else [data]
+            if len(readings) > settings.ESP32_BATCH_MAX_READINGS:
+                raise ReadingError(f'At most {settings.ESP32_BATCH_MAX_READINGS} readings per frame.')
+            matrix, errors = parse_readings(readings)
+            seq = [r.get('seq') if isinstance(r, dict) else None for r in readings]
+            ids = [reading_id(r) if isinstance(r, dict) else None for r in readings]
+
+        if admission_controller is not None:
+            retry_after = await admission_controller.acharge_rows(self.rate_key, len(seq))
+            if retry_after:
+                return self.shed(retry_after)
+
+        # Readings resent after a reconnect replay their earlier result
+        keys, replayed, repeats = [None] * len(seq), {}, {}
+        if recent_readings is not None:
+            keys = [recent_readings.key(workspace_id, self.device_id, row_id, matrix[i]) if i not in errors else None
+                    for i, row_id in enumerate(ids)]
+            repeats = recent_readings.repeats(keys)
+            replayed = await recent_readings.areplay([None if i in repeats else key for i, key in enumerate(keys)])
+
+        valid = [i for i in range(len(seq)) if i not in errors and i not in replayed and i not in repeats]
+        recommendations, model_version = [], None
+        if len(valid) == 1:
+            top_5_crops, model_version = await inference.arecommend_one(matrix[valid[0]])
+            recommendations = [top_5_crops]
+        elif valid:
+            recommendations, model_version = await sync_to_async(
+                inference.recommend, thread_sensitive=False
+            )(matrix[valid])
+        device_stats['readings'] += len(valid)
+
+        flagged = {}
+        if valid:
+            for i, flags in zip(valid, await anomalies.check_many(workspace_id, self.device_id, matrix[valid])):
+                if flags:
+                    flagged[i] = flags
+
+        if workspace_id is not None and valid:
+            reading_buffer.add([
+                make_reading(workspace_id, self.device_id, matrix[i], top_5_crops, model_version,
+                             anomalies=anomalies.format_flags(flagged.get(i, ())))
+                for i, top_5_crops in zip(valid, recommendations)
+            ])
+            live_stream.publish(workspace_id, reading_state(
+                matrix[valid[-1]], recommendations[-1], self.device_id, model_version
+            ), readings=len(valid))
+
+        results = [None] * len(seq)
+        for i, top_5_crops in zip(valid, recommendations):
+            results[i] = {'seq': seq[i], 'status': 'success', 'recommendations': top_5_crops}
+            if i in flagged:
+                results[i]['anomalies'] = [{'sensor': sensor, 'kind': kind} for sensor, kind in flagged[i]]
+        for i, message in errors.items():
+            results[i] = {'seq': seq[i], 'status': 'error', 'message': message}
+        for i, result in replayed.items():
+            results[i] = {**result, 'duplicate': True}
+        for i, first in repeats.items():
+            results[i] = {**results[first], 'duplicate': True}
+        if recent_readings is not None:
+            await recent_readings.aremember({keys[i]: results[i] for i in valid if keys[i]})
+        return {'type': 'recommendations', 'model_version': model_version, 'results': results}
+
+
+def device_metric_counters():
+    return [
+        ('soilution_device_connections', 'gauge', 'Open device WebSocket connections.', device_stats['connections']),
+        ('soilution_device_frames_total', 'counter', 'Frames received from devices.', device_stats['frames']),
+        ('soilution_device_readings_total', 'counter', 'Readings scored over device sockets.',
+         device_stats['readings']),
+        ('soilution_device_frames_dropped_total', 'counter', 'Queued frames dropped on overflow.',
+         device_stats['dropped']),
+        ('soilution_device_frames_rejected_total', 'counter', 'Frames rejected on overflow.',
+         device_stats['rejected']),
+        ('soilution_device_frames_shed_total', 'counter', 'Frames shed by admission control.',
+         device_stats['shed']),
+    ]
@@ -1,9 +1,31 @@
 # yourapp/context_processors.py
 
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+
+from .inbox import inbox_cache, inbox_version
 from .models import Message
 
+
+def cached_recent_messages(user_id):
+    """The user's five newest received messages, cached until their inbox changes."""
+    messages = Message.objects.filter(receiver_id=user_id).select_related('sender').order_by('-timestamp')[:5]
+    ttl = getattr(settings, 'RECENT_MESSAGES_CACHE_TTL', 300)
+    if not ttl:
+        return list(messages)
+    cache = inbox_cache()
+    key = f'recent_messages:{user_id}:{inbox_version(user_id)}'
+    cached = cache.get(key)
+    if cached is None:
+        cached = list(messages)
+        cache.set(key, cached, ttl)
+    return cached
+
+
 def recent_messages(request):
-    if request.user.is_authenticated:
-        messages = Message.objects.filter(receiver=request.user).order_by('-timestamp')[:5]
-        return {'recent_messages': messages}
-    return {}
+    # Lazy: pages whose templates never read recent_messages cost no query or cache lookup
+    def load():
+        user = request.user
+        return cached_recent_messages(user.id) if user.is_authenticated else []
+
+    return {'recent_messages': SimpleLazyObject(load)}
@@ -0,0 +1,214 @@
+"""
+Per-workspace crop recommendation history, built from stored predictions.
+
+For the last CROP_HISTORY_DAYS local days the summary holds per-day counts
+of each top crop (the dashboard chart) and the most recommended crop of each
+day (the reports table), the current streak of consecutive readings with the
+same top crop, and a trend: each crop's share of the last week against the
+week before.
+
+State is computed with NumPy over ``values_list`` columns and cached per
+workspace (CACHES[CROP_HISTORY_CACHE_ALIAS]).  New predictions are folded in
+incrementally, from the reading buffer after every flush and from any rows
+with a higher id than the cached state on the next page view, so a page view
+only reads what landed since the last one.  Rows committed out of id order
+by concurrent writers can be missed until the entry expires
+(CROP_HISTORY_CACHE_TTL) and is rebuilt from scratch.
+"""
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+from .models import SensorReading
+from .reading_buffer import buffer as reading_buffer
+from .rollups import local_offsets
+
+DAY = 86400
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+TREND_DAYS = 7
+
+
+def _cache():
+    return caches[getattr(settings, 'CROP_HISTORY_CACHE_ALIAS', 'default')]
+
+
+def _key(workspace_id):
+    return f'crop_history:{workspace_id}'
+
+
+def _window():
+    return getattr(settings, 'CROP_HISTORY_DAYS', 90)
+
+
+def _local_days(epochs):
+    """Local day number (days since 1970-01-01 in TIME_ZONE) of each timestamp."""
+    return (epochs + local_offsets(epochs)) // DAY
+
+
+def _today():
+    return timezone.localdate().toordinal() - EPOCH_ORDINAL
+
+
+def empty_state():
+    return {
+        'last_id': 0,
+        'first_day': _today() - _window() + 1,
+        'crops': [],
+        'counts': np.zeros((_window(), 0), dtype=np.int64),  # (day, crop)
+        'streak': None,                                      # [crop index, length, start epoch]
+    }
+
+
+def _trim(state, today):
+    """Drop days that fell out of the window and extend it up to ``today``."""
+    first_day = today - _window() + 1
+    shift = first_day - state['first_day']
+    if shift == 0:
+        return
+    counts = np.zeros((_window(), len(state['crops'])), dtype=np.int64)
+    old = state['counts']
+    if shift > 0:
+        keep = old[shift:]
+        counts[:len(keep)] = keep
+    elif -shift < _window():
+        counts[-shift:] = old[:_window() + shift]
+    state['counts'] = counts
+    state['first_day'] = first_day
+
+
+def fold(state, ids, epochs, crops):
+    """
+    Add readings (sorted oldest first) to ``state`` in place: ``ids`` and
+    ``epochs`` are (n,) int64, ``crops`` is (n,) str.
+    """
+    if not len(ids):
+        return state
+    _trim(state, _today())
+
+    # Map crop names onto the state's columns, adding new ones
+    names, inverse = np.unique(crops, return_inverse=True)
+    index = {crop: i for i, crop in enumerate(state['crops'])}
+    for name in names.tolist():
+        if name not in index:
+            index[name] = len(state['crops'])
+            state['crops'].append(name)
+    added = len(state['crops']) - state['counts'].shape[1]
+    if added:
+        state['counts'] = np.pad(state['counts'], ((0, 0), (0, added)))
+    codes = np.array([index[name] for name in names.tolist()], dtype=np.int64)[inverse.reshape(-1)]
+
+    rows = _local_days(epochs) - state['first_day']
+    inside = (rows >= 0) & (rows < _window())
+    np.add.at(state['counts'], (rows[inside], codes[inside]), 1)
+
+    # Run-length encode the crop sequence; the first run may extend the current streak
+    starts = np.concatenate(([0], np.flatnonzero(codes[1:] != codes[:-1]) + 1))
+    lengths = np.diff(np.append(starts, len(codes)))
+    run_crops = codes[starts]
+    streak = state['streak']
+    if streak is not None and streak[0] == run_crops[0]:
+        lengths[0] += streak[1]
+        first_start = streak[2]
+    else:
+        first_start = int(epochs[0])
+    last_start = first_start if len(starts) == 1 else int(epochs[starts[-1]])
+    state['streak'] = [int(run_crops[-1]), int(lengths[-1]), last_start]
+
+    state['last_id'] = max(state['last_id'], int(ids.max()))
+    return state
+
+
+def _columns(rows):
+    ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    epochs = np.fromiter((int(row[1].timestamp()) for row in rows), dtype=np.int64, count=len(rows))
+    crops = np.array([row[2] for row in rows], dtype=str)
+    return ids, epochs, crops
+
+
+def _fetch(workspace_id, state):
+    start = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+    start -= timedelta(days=_window() - 1)
+    return list(
+        SensorReading.objects
+        .filter(workspace_id=workspace_id, id__gt=state['last_id'], timestamp__gte=start)
+        .order_by('timestamp', 'id')
+        .values_list('id', 'timestamp', 'top_crop')
+    )
+
+
+def state_for(workspace_id):
+    """The workspace's cached state, brought up to date with rows saved since."""
+    cache = _cache()
+    cached = cache.get(_key(workspace_id))
+    state = empty_state() if cached is None else cached
+    rows = _fetch(workspace_id, state)
+    if rows or cached is None:
+        fold(state, *_columns(rows))
+        cache.set(_key(workspace_id), state, getattr(settings, 'CROP_HISTORY_CACHE_TTL', 3600))
+    return state
+
+
+def summarize(state):
+    _trim(state, _today())
+    counts, crops = state['counts'], state['crops']
+    per_day = counts.sum(axis=1)
+    days = np.flatnonzero(per_day)
+    totals = counts.sum(axis=0)
+
+    recent = counts[-TREND_DAYS:].sum(axis=0)
+    previous = counts[-2 * TREND_DAYS:-TREND_DAYS].sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        recent_share = np.nan_to_num(recent / recent.sum())
+        previous_share = np.nan_to_num(previous / previous.sum())
+    change = recent_share - previous_share
+
+    labels = [date.fromordinal(int(day) + state['first_day'] + EPOCH_ORDINAL).isoformat() for day in days]
+    order = np.argsort(-totals, kind='stable')
+    streak = state['streak']
+    return {
+        'days': labels,
+        'crops': [crops[j] for j in order if totals[j]],
+        'counts': {crops[j]: counts[days, j].tolist() for j in order if totals[j]},
+        # The most recommended crop of each day, oldest first
+        'history': [
+            {'timestamp': label, 'crop': crops[int(counts[day].argmax())], 'count': int(per_day[day])}
+            for label, day in zip(labels, days)
+        ],
+        'streak': None if streak is None else {
+            'crop': crops[streak[0]], 'length': streak[1],
+            'since': timezone.localtime(datetime.fromtimestamp(streak[2], tz=dt_timezone.utc)).isoformat(),
+        },
+        'trends': sorted(
+            ({'crop': crops[j], 'share': round(float(recent_share[j]), 4),
+              'change': round(float(change[j]), 4)} for j in range(len(crops)) if recent[j] or previous[j]),
+            key=lambda trend: -trend['change'],
+        ),
+    }
+
+
+def summary(workspace_id):
+    """Crop history summary of one workspace (see the module docstring)."""
+    return summarize(state_for(workspace_id))
+
+
+def record(readings):
+    """Fold newly saved readings into the cached state of their workspaces (reading buffer listener)."""
+    by_workspace = {}
+    for reading in readings:
+        if reading.pk is not None:
+            by_workspace.setdefault(reading.workspace_id, []).append(reading)
+    cache = _cache()
+    for workspace_id, rows in by_workspace.items():
+        state = cache.get(_key(workspace_id))
+        if state is None:
+            continue  # Built on the next page view
+        rows = sorted((r for r in rows if r.pk > state['last_id']), key=lambda r: (r.timestamp, r.pk))
+        if rows:
+            fold(state, *_columns([(r.pk, r.timestamp, r.top_crop) for r in rows]))
+            cache.set(_key(workspace_id), state, getattr(settings, 'CROP_HISTORY_CACHE_TTL', 3600))
+
+
+reading_buffer.listeners.append(record)
@@ -0,0 +1,198 @@
+"""
+Duplicate suppression for device retransmissions.
+
+A reading of an authenticated device (see devices) that carries a ``seq``
+(or, failing that, a client ``timestamp``) is idempotent: the first response
+for that (workspace, device, reading) is remembered and replayed for every
+retry instead of scoring and storing the reading again.  Readings without a
+device key or an id are always scored, so nobody can claim another device's
+readings by copying its id and seq.  The key also holds a fingerprint of the sensor values, so a device
+that reuses a seq (after a reboot, say) for a new reading is scored afresh.
+The same key twice in one batch is scored once and the copy marked duplicate.
+
+Keys live in a bounded LRU + TTL map in this process, or with
+``backend='django'`` in Django's cache (``alias``) so a retry landing on
+another worker is still recognised.  While the first request for a key is
+being scored the key holds an in-flight marker, claimed with ``add`` so that
+only one worker processes it.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+
+IN_FLIGHT = '__in_flight__'
+
+
+def reading_id(data):
+    """The device-assigned id of a JSON reading: its seq, else its client timestamp."""
+    value = data.get('seq', data.get('timestamp'))
+    if value is None or isinstance(value, (dict, list)) or value == '':
+        return None
+    return str(value)[:64]
+
+
+class RecentReadings:
+    def __init__(self, max_entries=50000, ttl=600, in_flight_ttl=30, backend='local', alias='default'):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.in_flight_ttl = in_flight_ttl
+        self.backend = backend
+        self.alias = alias
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.checked = 0
+        self.duplicates = 0
+        self.in_flight = 0
+
+    @staticmethod
+    def key(workspace_id, device_id, reading_id, values):
+        """
+        Key of one reading; ``values`` is its parsed feature row.  None (not
+        deduplicated) unless the device authenticated, i.e. ``workspace_id``
+        is its workspace (see views.reading_origin).
+        """
+        if workspace_id is None or not device_id or reading_id is None:
+            return None
+        fingerprint = hashlib.blake2b(np.asarray(values, dtype='<f4').tobytes(), digest_size=8).hexdigest()
+        return f'seen:{workspace_id}:{device_id}:{reading_id}:{fingerprint}'
+
+    # Local LRU + TTL map
+
+    def _local_get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _local_set(self, key, value, ttl):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    # Single readings: claim, then store or release
+
+    async def aclaim(self, key):
+        """
+        Claim ``key`` for processing.  Returns None when the caller should go
+        ahead, IN_FLIGHT when another request is processing the same reading,
+        or the stored response of an earlier one.
+        """
+        self.checked += 1
+        if self.backend == 'django':
+            cache = caches[self.alias]
+            if await cache.aadd(key, IN_FLIGHT, self.in_flight_ttl):
+                return None
+            value = await cache.aget(key)
+        else:
+            with self._lock:
+                value = self._local_get(key)
+                if value is None:
+                    self._local_set(key, IN_FLIGHT, self.in_flight_ttl)
+        return self._count(value)
+
+    async def astore(self, key, value):
+        if self.backend == 'django':
+            await caches[self.alias].aset(key, value, self.ttl)
+        else:
+            with self._lock:
+                self._local_set(key, value, self.ttl)
+
+    async def arelease(self, key):
+        """Forget a claim whose request failed, so the retry is processed."""
+        if self.backend == 'django':
+            await caches[self.alias].adelete(key)
+        else:
+            with self._lock:
+                self._entries.pop(key, None)
+
+    # Batches: replay per row, remember per row
+
+    async def areplay(self, keys):
+        """``{index: stored result}`` for every key (None = no key) seen before."""
+        wanted = [key for key in keys if key is not None]
+        self.checked += len(wanted)
+        if not wanted:
+            return {}
+        if self.backend == 'django':
+            found = await caches[self.alias].aget_many(wanted)
+        else:
+            with self._lock:
+                found = {key: self._local_get(key) for key in wanted}
+        replayed = {
+            i: found[key] for i, key in enumerate(keys)
+            if key is not None and found.get(key) not in (None, IN_FLIGHT)
+        }
+        self.duplicates += len(replayed)
+        return replayed
+
+    def repeats(self, keys):
+        """``{index: index of the first row with the same key}`` for keys repeated within one batch."""
+        first, repeated = {}, {}
+        for i, key in enumerate(keys):
+            if key is None:
+                continue
+            if key in first:
+                repeated[i] = first[key]
+            else:
+                first[key] = i
+        self.duplicates += len(repeated)
+        return repeated
+
+    async def aremember(self, results):
+        """Store ``{key: result}`` for rows processed now."""
+        if not results:
+            return
+        if self.backend == 'django':
+            await caches[self.alias].aset_many(results, self.ttl)
+        else:
+            with self._lock:
+                for key, value in results.items():
+                    self._local_set(key, value, self.ttl)
+
+    def _count(self, value):
+        if value == IN_FLIGHT:
+            self.in_flight += 1
+        elif value is not None:
+            self.duplicates += 1
+        return value
+
+    def metric_counters(self):
+        rate = self.duplicates / self.checked if self.checked else 0.0
+        return [
+            ('soilution_dedup_checked_total', 'counter', 'Readings checked for retransmission.', self.checked),
+            ('soilution_dedup_duplicates_total', 'counter', 'Retransmitted readings answered from memory.',
+             self.duplicates),
+            ('soilution_dedup_in_flight_total', 'counter', 'Retries that arrived while the original was scored.',
+             self.in_flight),
+            ('soilution_dedup_duplicate_ratio', 'gauge', 'Share of checked readings that were duplicates.', rate),
+            ('soilution_dedup_entries', 'gauge', 'Keys remembered in this process.', len(self._entries)),
+        ]
+
+
+def build_recent_readings():
+    """The duplicate filter configured in settings, or None when READING_DEDUP_BACKEND is 'off'."""
+    backend = getattr(settings, 'READING_DEDUP_BACKEND', 'local')
+    if backend == 'off':
+        return None
+    return RecentReadings(
+        max_entries=getattr(settings, 'READING_DEDUP_MAX_ENTRIES', 50000),
+        ttl=getattr(settings, 'READING_DEDUP_TTL', 600),
+        backend=backend,
+        alias=getattr(settings, 'READING_DEDUP_ALIAS', 'default'),
+    )
+
+
+recent_readings = build_recent_readings()
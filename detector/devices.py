@@ -0,0 +1,96 @@
+"""
+Registered sensor devices and their keys.
+
+The ingest endpoints are open to anyone (no session, no CSRF), so what a
+caller says about its workspace is never trusted.  A reading is stored only
+when it comes with the key of a registered Device (``X-Device-Key`` header,
+or ``?key=`` on the device WebSocket).  It is then stored in that device's
+workspace and under its id.  Readings without a key are still scored but
+not stored.
+
+Keys are random tokens, kept only as SHA-256 hashes.  ``manage.py
+register_device`` creates or rotates a key and prints it once.  Lookups are
+cached in this process for DEVICE_KEY_CACHE_TTL seconds, so a rotated or
+deleted key can keep working for at most that long.
+"""
+import hashlib
+import secrets
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .models import Device
+
+KEY_HEADER = 'X-Device-Key'
+
+DeviceIdentity = namedtuple('DeviceIdentity', 'workspace_id device_id')
+
+
+class InvalidDeviceKey(Exception):
+    pass
+
+
+def hash_key(key):
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def register(workspace, device_id):
+    """Register ``device_id`` in ``workspace`` (or rotate its key); returns the new key."""
+    key = secrets.token_urlsafe(32)
+    Device.objects.update_or_create(workspace=workspace, device_id=device_id,
+                                    defaults={'key_hash': hash_key(key)})
+    return key
+
+
+class KeyCache:
+    """Bounded LRU + TTL map of key hash -> DeviceIdentity (or None for unknown keys)."""
+
+    def __init__(self, max_entries=10000, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key_hash):
+        """``(found, identity)``."""
+        with self._lock:
+            entry = self._entries.get(key_hash)
+            if entry is None or entry[0] < time.monotonic():
+                return False, None
+            self._entries.move_to_end(key_hash)
+            return True, entry[1]
+
+    def set(self, key_hash, identity):
+        with self._lock:
+            self._entries[key_hash] = (time.monotonic() + self.ttl, identity)
+            self._entries.move_to_end(key_hash)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+keys = KeyCache(ttl=getattr(settings, 'DEVICE_KEY_CACHE_TTL', 60))
+
+
+def _lookup(key_hash):
+    device = Device.objects.filter(key_hash=key_hash).values_list('workspace_id', 'device_id').first()
+    return DeviceIdentity(*device) if device else None
+
+
+async def aauthenticate(key):
+    """
+    The DeviceIdentity of ``key``, or None when no key was given.  Raises
+    InvalidDeviceKey for a key that is not registered.
+    """
+    if not key:
+        return None
+    key_hash = hash_key(key)
+    found, identity = keys.get(key_hash)
+    if not found:
+        identity = await sync_to_async(_lookup, thread_sensitive=False)(key_hash)
+        keys.set(key_hash, identity)
+    if identity is None:
+        raise InvalidDeviceKey('Unknown device key.')
+    return identity
@@ -0,0 +1,139 @@
+"""
+Streaming exports of stored sensor readings.
+
+Everything here is an async generator, so the export view streams under
+ASGI instead of being buffered whole.  Rows are read one keyset page
+(timestamp, id) at a time, each query run through ``sync_to_async``, and
+encoded as they arrive, so memory stays flat however long the range is.
+CSV can be gzipped on the fly; Parquet is written one row group per chunk
+and needs the optional ``pyarrow`` package.
+"""
+import csv
+import zlib
+
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+
+from .models import MEASUREMENT_FIELDS, SensorReading
+
+COLUMNS = ('timestamp', 'device_id', *MEASUREMENT_FIELDS, 'top_crop', 'top_probability', 'model_version')
+CHUNK_SIZE = 5000
+
+
+def _page(readings, after, chunk_size):
+    """Up to ``chunk_size`` (id, *COLUMNS) rows following ``after`` = (timestamp, id)."""
+    if after is not None:
+        timestamp, pk = after
+        readings = readings.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=pk))
+    return list(readings.order_by('timestamp', 'id').values_list('id', *COLUMNS)[:chunk_size])
+
+
+async def reading_rows(workspace, start, end, chunk_size=CHUNK_SIZE):
+    """Lists of up to ``chunk_size`` value tuples in COLUMNS order, oldest first."""
+    readings = SensorReading.objects.filter(workspace=workspace, timestamp__gte=start, timestamp__lt=end)
+    page = sync_to_async(_page)
+    after = None
+    while True:
+        rows = await page(readings, after, chunk_size)
+        if not rows:
+            return
+        yield [row[1:] for row in rows]
+        if len(rows) < chunk_size:
+            return
+        after = (rows[-1][1], rows[-1][0])
+
+
+class _Lines:
+    """Write target for csv.writer that hands back what was written."""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, value):
+        self.parts.append(value)
+
+    def take(self):
+        data, self.parts = ''.join(self.parts), []
+        return data.encode('utf-8')
+
+
+async def csv_chunks(chunks):
+    lines = _Lines()
+    writer = csv.writer(lines)
+    writer.writerow(COLUMNS)
+    async for chunk in chunks:
+        writer.writerows(
+            (timestamp.isoformat(), *values) for timestamp, *values in chunk
+        )
+        yield lines.take()
+    yield lines.take()
+
+
+async def gzip_chunks(chunks, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    async for data in chunks:
+        compressed = compressor.compress(data)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+class _Sink:
+    """Minimal writable file for pyarrow whose contents are drained after every row group."""
+
+    closed = False
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self.parts.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data, self.parts = b''.join(self.parts), []
+        return data
+
+
+def parquet_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ('timestamp', pa.timestamp('us', tz='UTC')),
+        ('device_id', pa.string()),
+        *[(field, pa.float64()) for field in MEASUREMENT_FIELDS],
+        ('top_crop', pa.string()),
+        ('top_probability', pa.float64()),
+        ('model_version', pa.string()),
+    ])
+
+
+async def parquet_chunks(chunks):
+    """One Parquet row group per chunk; raises ImportError without pyarrow."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = parquet_schema()
+    sink = _Sink()
+    writer = pq.ParquetWriter(sink, schema, compression='snappy')
+    async for chunk in chunks:
+        columns = list(zip(*chunk))
+        table = pa.Table.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema,
+        )
+        writer.write_table(table, row_group_size=len(chunk))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
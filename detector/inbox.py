@@ -0,0 +1,259 @@
+"""
+Conversation summaries for the inbox.
+
+Every message updates two Conversation rows, one per participant, in the
+same transaction that creates it: the last message, its preview and time,
+and (on the receiver's side) the unread count.  Marking a thread read locks
+the reader's row before touching Message, so a message arriving meanwhile is
+either marked read with the rest or counted after the reset, never lost.
+
+``manage.py backfill_conversations`` rebuilds the table from Message.
+
+Per-user cache entries derived from an inbox (the recent_messages context
+processor and the unread total) include the user's inbox version in their
+key.  Every change replaces the version with a new random token after
+commit, so stale entries are simply never read again; tokens rather than a
+counter, because incr is not atomic on every cache backend and two bumps
+must never land on the same version.  The cache (INBOX_CACHE_ALIAS) must be
+shared by all workers: a per-process one would keep serving a version
+another worker has replaced (see checks).
+
+``unread_count`` recounts a user's unread messages from the partial unread
+index once per version, and the new total is pushed with a preview of what
+changed to the user's ``user_<id>`` group, where InboxConsumer forwards it.
+A recount racing a commit is stored under the version that commit then
+replaces, so it is never served.
+"""
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Q
+from django.utils.timesince import timesince
+
+from .models import Conversation, Message
+
+PREVIEW_LENGTH = 100
+THREAD_PAGE_SIZE = 30
+MAX_THREAD_PAGE_SIZE = 100
+
+
+def inbox_cache():
+    return caches[getattr(settings, 'INBOX_CACHE_ALIAS', 'default')]
+
+
+def _version_key(user_id):
+    return f'inbox_version:{user_id}'
+
+
+def inbox_version(user_id):
+    cache, key = inbox_cache(), _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        # Never set (or evicted): whoever adds first decides
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def _bump(user_id):
+    inbox_cache().set(_version_key(user_id), uuid.uuid4().hex, None)
+
+
+def inbox_changed(*user_ids):
+    """Invalidate cached inbox data of ``user_ids`` once the current transaction commits."""
+    transaction.on_commit(lambda: [_bump(user_id) for user_id in set(user_ids)])
+
+
+def unread_count(user_id):
+    """Unread messages of a user, counted once per inbox version."""
+    cache = inbox_cache()
+    key = f'inbox_unread:{user_id}:{inbox_version(user_id)}'
+    count = cache.get(key)
+    if count is None:
+        count = Message.objects.filter(receiver_id=user_id, is_read=False).count()
+        cache.set(key, count, getattr(settings, 'INBOX_UNREAD_CACHE_TTL', 300))
+    return count
+
+
+def message_entry(message):
+    """A received message as shown in the inbox dropdown."""
+    sender = message.sender
+    profile = getattr(sender, 'profile', None)
+    initials = f"{sender.first_name[:1]}{sender.last_name[:1]}".upper() \
+        if sender.first_name and sender.last_name else sender.username[:2].upper()
+    return {
+        'id': message.id,
+        'sender': sender.username,
+        'sender_id': sender.id,
+        'content': message.content[:50],
+        'timestamp': timesince(message.timestamp) + " ago",
+        'is_read': message.is_read,
+        'sender_avatar': (profile.get_profile_image() if profile else None) or None,
+        'sender_initials': initials,
+    }
+
+
+def snapshot(user):
+    """Unread count plus the three latest unread and two latest read messages."""
+    received = Message.objects.filter(receiver=user).select_related('sender__profile').order_by('-timestamp')
+    recent = list(received.filter(is_read=False)[:3]) + list(received.filter(is_read=True)[:2])
+    return {
+        'unread_count': unread_count(user.id),
+        'messages': [message_entry(message) for message in recent],
+    }
+
+
+def _push(user_id, **delta):
+    async_to_sync(get_channel_layer().group_send)(f'user_{user_id}', {
+        'type': 'inbox.update',
+        'unread_count': unread_count(user_id),
+        **delta,
+    })
+
+
+def _touch(user_id, counterpart_id, message, unread):
+    conversation = Conversation.objects.filter(user_id=user_id, counterpart_id=counterpart_id)
+    if unread:
+        found = conversation.update(unread_count=F('unread_count') + 1)
+    else:
+        found = conversation.exists()
+    if not found:
+        try:
+            with transaction.atomic():
+                Conversation.objects.create(
+                    user_id=user_id, counterpart_id=counterpart_id, last_message=message,
+                    last_sender_id=message.sender_id, preview=message.content[:PREVIEW_LENGTH],
+                    last_timestamp=message.timestamp, unread_count=int(unread),
+                )
+            return
+        except IntegrityError:
+            # The other side of a concurrent first message created it first
+            if unread:
+                conversation.update(unread_count=F('unread_count') + 1)
+    # A concurrent, newer message may already be the latest one
+    conversation.filter(Q(last_message__isnull=True) | Q(last_message_id__lt=message.id)).update(
+        last_message=message, last_sender_id=message.sender_id,
+        preview=message.content[:PREVIEW_LENGTH], last_timestamp=message.timestamp,
+    )
+
+
+def send(sender, receiver, content):
+    """Create a message and update both participants' conversations atomically."""
+    with transaction.atomic():
+        message = Message.objects.create(sender=sender, receiver=receiver, content=content)
+        _touch(receiver.id, sender.id, message, unread=True)
+        if sender.id != receiver.id:
+            _touch(sender.id, receiver.id, message, unread=False)
+        inbox_changed(receiver.id)
+
+        # Runs after inbox_changed's bump, so the pushed total is recounted
+        def sent():
+            _push(receiver.id, message=message_entry(message))
+        transaction.on_commit(sent)
+    return message
+
+
+def mark_read(user, counterpart_id):
+    """Mark everything ``counterpart_id`` sent to ``user`` as read; returns the number of messages."""
+    conversation = Conversation.objects.filter(user=user, counterpart_id=counterpart_id)
+    with transaction.atomic():
+        list(conversation.select_for_update())
+        marked = Message.objects.filter(receiver=user, sender_id=counterpart_id, is_read=False).update(is_read=True)
+        conversation.update(unread_count=0)
+        if marked:
+            inbox_changed(user.id)
+
+            def read():
+                _push(user.id, read_sender_id=counterpart_id)
+            transaction.on_commit(read)
+    return marked
+
+
+def mark_message_read(message):
+    """Mark one received message as read, keeping its conversation's unread count in step."""
+    conversation = Conversation.objects.filter(user_id=message.receiver_id, counterpart_id=message.sender_id)
+    with transaction.atomic():
+        list(conversation.select_for_update())
+        if Message.objects.filter(pk=message.pk, is_read=False).update(is_read=True):
+            conversation.filter(unread_count__gt=0).update(unread_count=F('unread_count') - 1)
+            inbox_changed(message.receiver_id)
+
+            def read():
+                _push(message.receiver_id, read_message_id=message.id)
+            transaction.on_commit(read)
+    message.is_read = True
+
+
+def conversations(user, limit=50):
+    """The user's conversations, most recent first, with counterpart profiles joined in."""
+    return (
+        Conversation.objects
+        .filter(user=user)
+        .select_related('counterpart__profile')
+        .order_by('-last_timestamp')[:limit]
+    )
+
+
+def thread_page(user, other_id, before=None, after=None, limit=THREAD_PAGE_SIZE):
+    """
+    One page of the thread between ``user`` and ``other_id``, oldest first.
+
+    Without cursors this is the newest ``limit`` messages; ``before`` pages
+    back from a message id and ``after`` fetches what arrived since one.
+    Returns ``(messages, has_more)`` where ``has_more`` says whether older
+    (or, with ``after``, newer) messages remain.  Ids grow with timestamps,
+    so the id alone is the keyset.
+    """
+    limit = max(1, min(limit, MAX_THREAD_PAGE_SIZE))
+    messages = Message.objects.filter(
+        Q(sender=user, receiver_id=other_id) | Q(sender_id=other_id, receiver=user)
+    ).select_related('sender__profile')
+    if after is not None:
+        page = list(messages.filter(id__gt=after).order_by('id')[:limit + 1])
+        return page[:limit], len(page) > limit
+    if before is not None:
+        messages = messages.filter(id__lt=before)
+    page = list(messages.order_by('-id')[:limit + 1])
+    return page[:limit][::-1], len(page) > limit
+
+
+def backfill(user_ids=None):
+    """Rebuild Conversation rows from Message (all users, or only ``user_ids``); returns the row count."""
+    messages = Message.objects.order_by()
+    if user_ids is not None:
+        messages = messages.filter(Q(sender_id__in=user_ids) | Q(receiver_id__in=user_ids))
+
+    # Latest message and unread count per (user, counterpart), from both directions
+    latest, unread = {}, {}
+    for sender_id, receiver_id, last_id, unread_count in (
+        messages.values('sender_id', 'receiver_id')
+        .annotate(last_id=Max('id'), unread_count=Count('id', filter=Q(is_read=False)))
+        .values_list('sender_id', 'receiver_id', 'last_id', 'unread_count')
+    ):
+        for pair in ((receiver_id, sender_id), (sender_id, receiver_id)):
+            latest[pair] = max(latest.get(pair, 0), last_id)
+        unread[(receiver_id, sender_id)] = unread_count
+    if user_ids is not None:
+        latest = {pair: last_id for pair, last_id in latest.items() if pair[0] in user_ids}
+
+    last_messages = Message.objects.in_bulk(set(latest.values()))
+    rows = []
+    for (user_id, counterpart_id), last_id in latest.items():
+        message = last_messages[last_id]
+        rows.append(Conversation(
+            user_id=user_id, counterpart_id=counterpart_id, last_message=message,
+            last_sender_id=message.sender_id, preview=message.content[:PREVIEW_LENGTH],
+            last_timestamp=message.timestamp, unread_count=unread.get((user_id, counterpart_id), 0),
+        ))
+
+    with transaction.atomic():
+        stale = Conversation.objects.all()
+        if user_ids is not None:
+            stale = stale.filter(user_id__in=user_ids)
+        stale.delete()
+        Conversation.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
@@ -0,0 +1,302 @@
+"""
+Crop recommendation inference.
+
+Models come from the versioned bundles in ``model_registry`` (Keras or the
+TensorFlow-free NumPy engine, picked by ``settings.INFERENCE_BACKEND``) and are
+loaded once per process, unless ``settings.INFERENCE_SERVICE_SOCKET`` points at
+a shared inference service, in which case the model is only loaded if the
+service stops answering.  Every caller goes through ``recommend`` (a matrix of
+readings in, the top-5 recommendations per row and the model version out) so
+that one scale + predict call can serve many readings.
+"""
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import metrics
+from .inference_client import InferenceUnavailable, build_client
+from .lookup_table import load_table
+from .model_backends import ML_DIR
+from .model_registry import ModelRegistry
+from .prediction_cache import build_cache
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_BACKEND = getattr(settings, 'INFERENCE_BACKEND', 'keras')
+
+# Shared inference service over a Unix socket, when configured
+inference_client = build_client()
+
+registry = ModelRegistry(ML_DIR, INFERENCE_BACKEND, getattr(settings, 'MODEL_VERSION', None))
+if inference_client is None:
+    registry.ensure_loaded()
+if getattr(settings, 'MODEL_REGISTRY_POLL_INTERVAL', 0):
+    registry.watch(settings.MODEL_REGISTRY_POLL_INTERVAL)
+
+TOP_K = 5
+
+
+def model_version():
+    """Tag (version + file fingerprint) of the active model bundle."""
+    bundle = registry.active
+    if bundle is not None:
+        return bundle.tag
+    spec = registry.target()
+    return spec.tag if spec else None
+
+
+def predict_proba(rows):
+    """Scale a (n, 7) float32 matrix and return the model's (n, classes) probabilities."""
+    with registry.acquire() as bundle:
+        return bundle.predict_proba(rows)
+
+
+def top_k_rows(probabilities, k=TOP_K):
+    """
+    Best-first (indices, probabilities), each (n, k), for a (n, classes) matrix.
+    argpartition finds the k largest per row without sorting all classes; only
+    those k are then ordered.
+    """
+    k = min(k, probabilities.shape[1])
+    indices = np.argpartition(-probabilities, k - 1, axis=1)[:, :k]
+    top = np.take_along_axis(probabilities, indices, axis=1)
+    order = np.argsort(-top, axis=1)
+    return np.take_along_axis(indices, order, axis=1), np.take_along_axis(top, order, axis=1)
+
+
+def score(rows):
+    """In-process top-k ``(indices, probabilities, model_version)`` from one bundle."""
+    with registry.acquire() as bundle:
+        start = time.perf_counter()
+        scaled = bundle.backend.transform(rows)
+        transformed = time.perf_counter()
+        probabilities = bundle.backend.predict(scaled)
+        predicted = time.perf_counter()
+        indices, top = top_k_rows(probabilities)
+        done = time.perf_counter()
+
+    metrics.observe('transform', transformed - start)
+    metrics.observe('predict', predicted - transformed)
+    metrics.observe('top_k', done - predicted)
+    metrics.batch_rows.observe(len(rows))
+    return indices, top, bundle.tag
+
+
+def as_recommendations(indices, probabilities, labels):
+    """Turn top-k index/probability rows into the recommendation dicts the API returns."""
+    return [
+        [
+            {
+                "crop_name": labels[i] if i < len(labels) else str(i),
+                "probability": p
+            }
+            for i, p in zip(row_indices, row_probabilities)
+        ]
+        for row_indices, row_probabilities in zip(indices.tolist(), probabilities.tolist())
+    ]
+
+
+def recommend(rows):
+    """
+    Score a (n, 7) matrix of readings and return ``(recommendations,
+    model_version)`` with the top-5 crops for each row, on the inference
+    service when it is up, otherwise in this process.
+    """
+    if inference_client is not None and inference_client.available():
+        try:
+            indices, probabilities, version = inference_client.predict(rows)
+            return as_recommendations(indices, probabilities, registry.labels(version)), version
+        except InferenceUnavailable as e:
+            logger.warning("Inference service unavailable (%s); scoring in process.", e)
+    indices, probabilities, version = score(rows)
+    return as_recommendations(indices, probabilities, registry.labels(version)), version
+
+
+def recommend_rows(rows):
+    """``recommend`` split per row, as the micro-batcher hands results back."""
+    recommendations, version = recommend(rows)
+    return [(top_5, version) for top_5 in recommendations]
+
+
+class MicroBatcher:
+    """
+    Gathers readings submitted by concurrent requests and scores them together.
+
+    A single worker thread takes the first queued reading, keeps collecting for
+    at most ``max_wait`` seconds (or until ``max_batch_size`` readings are
+    queued), then runs one ``score_fn`` call over the stacked matrix and hands
+    each waiting request its own row of results through a Future.
+    """
+
+    def __init__(self, score_fn, max_batch_size=64, max_wait=0.005):
+        self.score_fn = score_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, row):
+        """Queue one 1-D reading; returns a Future resolving to its row of ``score_fn``'s result."""
+        future = Future()
+        self._ensure_started()
+        self._queue.put((row, future))
+        return future
+
+    def predict(self, row, timeout=None):
+        return self.submit(row).result(timeout)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='crop-micro-batcher', daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    # Past the deadline: still take whatever is already queued
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            futures = [future for _, future in batch]
+            try:
+                results = self.score_fn(np.stack([row for row, _ in batch]))
+                if len(results) != len(futures):
+                    # zip() would leave the unmatched futures waiting forever
+                    raise RuntimeError(f'score_fn returned {len(results)} results for {len(futures)} readings.')
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+
+batcher = None
+if getattr(settings, 'INFERENCE_BATCHING', False):
+    batcher = MicroBatcher(
+        recommend_rows,
+        max_batch_size=settings.INFERENCE_MAX_BATCH_SIZE,
+        max_wait=settings.INFERENCE_MAX_WAIT_MS / 1000.0,
+    )
+
+
+# Top-5 per quantized reading; the key follows the active model version
+prediction_cache = build_cache(model_version)
+if prediction_cache is not None:
+    registry.listeners.append(lambda bundle: prediction_cache.invalidate(bundle.tag))
+
+# Precomputed top-5 over a grid of the sensor space (manage.py build_lookup_table)
+lookup_table = load_table(model_version())
+
+
+def lookup(row):
+    """``(top_5, model_version)`` from the lookup table, or None when the reading must be scored live."""
+    if lookup_table is None:
+        return None
+    # A table built for a model that has since been swapped out no longer applies
+    if registry.active is not None and registry.active.tag != lookup_table.version:
+        return None
+    found = lookup_table.lookup(row)
+    if found is None:
+        return None
+    indices, probabilities = found
+    labels = registry.labels(lookup_table.version)
+    return as_recommendations(indices[np.newaxis, :], probabilities[np.newaxis, :], labels)[0], lookup_table.version
+
+
+def recommend_one(row):
+    """
+    Score a single reading into ``(top_5, model_version)``: lookup table
+    first, then the prediction cache, then the model (through the
+    micro-batcher when enabled).
+    """
+    result = lookup(row)
+    if result is not None:
+        return result
+    if prediction_cache is not None:
+        cached = prediction_cache.get(row)
+        if cached is not None:
+            return cached
+    if batcher is not None:
+        result = batcher.predict(row)
+    else:
+        result = recommend_rows(row[np.newaxis, :])[0]
+    if prediction_cache is not None:
+        prediction_cache.set(row, result)
+    return result
+
+
+async def arecommend_one(row):
+    """Async variant of ``recommend_one`` that never blocks the event loop."""
+    result = lookup(row)
+    if result is not None:
+        return result
+    if prediction_cache is not None:
+        cached = await prediction_cache.aget(row)
+        if cached is not None:
+            return cached
+    if batcher is not None:
+        result = await asyncio.wrap_future(batcher.submit(row))
+    else:
+        results = await sync_to_async(recommend_rows, thread_sensitive=False)(row[np.newaxis, :])
+        result = results[0]
+    if prediction_cache is not None:
+        await prediction_cache.aset(row, result)
+    return result
+
+
+def metric_counters():
+    """``(name, type, help, value)`` tuples for the metrics endpoint."""
+    counters = [
+        (f'soilution_model_info{{version="{model_version()}"}}', 'gauge', 'Active model version.', 1),
+    ]
+    if prediction_cache is not None:
+        stats = prediction_cache.stats()
+        counters += [
+            ('soilution_prediction_cache_entries', 'gauge', 'Entries in the local prediction cache.', stats['entries']),
+            ('soilution_prediction_cache_hits_total', 'counter', 'Prediction cache hits.', stats['hits']),
+            ('soilution_prediction_cache_misses_total', 'counter', 'Prediction cache misses.', stats['misses']),
+            ('soilution_prediction_cache_evictions_total', 'counter', 'LRU evictions.', stats['evictions']),
+            ('soilution_prediction_cache_expirations_total', 'counter', 'TTL expirations.', stats['expirations']),
+            ('soilution_prediction_cache_invalidations_total', 'counter', 'Model changes that cleared the cache.',
+             stats['invalidations']),
+        ]
+    if lookup_table is not None:
+        stats = lookup_table.stats()
+        counters += [
+            ('soilution_lookup_table_hits_total', 'counter', 'Readings answered from the lookup table.', stats['hits']),
+            ('soilution_lookup_table_out_of_grid_total', 'counter', 'Readings outside the table grid.',
+             stats['out_of_grid']),
+            ('soilution_lookup_table_over_error_total', 'counter', 'Readings in cells above the error bound.',
+             stats['over_error']),
+        ]
+    if inference_client is not None:
+        counters += [
+            ('soilution_inference_service_requests_total', 'counter', 'Calls to the inference service.',
+             inference_client.requests),
+            ('soilution_inference_service_failures_total', 'counter', 'Inference service calls that fell back.',
+             inference_client.failures),
+        ]
+    return counters
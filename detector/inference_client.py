@@ -0,0 +1,93 @@
+"""
+Client for the shared inference service (``manage.py run_inference_server``).
+
+Each thread keeps its own connection to the service's Unix socket.  Any
+timeout or socket error closes that connection and marks the service down for
+``retry_interval`` seconds, during which callers fall back to in-process
+inference without paying the timeout again.
+"""
+import json
+import socket
+import threading
+import time
+
+from django.conf import settings
+
+from . import inference_protocol as protocol
+
+
+class InferenceUnavailable(Exception):
+    pass
+
+
+class InferenceClient:
+    def __init__(self, path, timeout=0.5, retry_interval=5.0):
+        self.path = path
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self._local = threading.local()
+        self._down_until = 0.0
+
+        self.requests = 0
+        self.failures = 0
+
+    def available(self):
+        return time.monotonic() >= self._down_until
+
+    def _connection(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+            self._local.sock = sock
+        return sock
+
+    def _close(self):
+        sock = getattr(self._local, 'sock', None)
+        self._local.sock = None
+        if sock is not None:
+            sock.close()
+
+    def _call(self, frame):
+        if not self.available():
+            raise InferenceUnavailable(f'Inference service marked down for {self.retry_interval}s')
+        self.requests += 1
+        try:
+            sock = self._connection()
+            sock.sendall(frame)
+            status, k, count = protocol.read_header(sock)
+            if status == protocol.STATUS_OK and k:
+                payload_size = protocol.predict_response_size(count, k)
+            else:
+                payload_size = count
+            payload = protocol.recv_exact(sock, payload_size)
+        except (OSError, protocol.ProtocolError) as e:
+            self._close()
+            self.failures += 1
+            self._down_until = time.monotonic() + self.retry_interval
+            raise InferenceUnavailable(str(e)) from e
+        if status == protocol.STATUS_ERROR:
+            raise InferenceUnavailable(bytes(payload).decode('utf-8', 'replace'))
+        return k, count, payload
+
+    def predict(self, rows):
+        """Top-k ``(indices, probabilities, model_version)`` for a (n, 7) matrix, computed by the service."""
+        k, count, payload = self._call(protocol.encode_predict_request(rows))
+        return protocol.decode_predict_response(payload, count, k)
+
+    def ping(self):
+        """Health check: the service's backend, model version and counters."""
+        _, _, payload = self._call(protocol.encode_message(protocol.OP_PING, ''))
+        return json.loads(bytes(payload))
+
+
+def build_client():
+    path = getattr(settings, 'INFERENCE_SERVICE_SOCKET', None)
+    if not path:
+        return None
+    return InferenceClient(
+        path,
+        timeout=getattr(settings, 'INFERENCE_SERVICE_TIMEOUT', 0.5),
+        retry_interval=getattr(settings, 'INFERENCE_SERVICE_RETRY_INTERVAL', 5.0),
+    )
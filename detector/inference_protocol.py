@@ -0,0 +1,92 @@
+"""
+Binary framing spoken between web workers and ``manage.py run_inference_server``.
+
+Every frame starts with a 12-byte little-endian header::
+
+    magic  4s   b'SOIL'
+    version B   PROTOCOL_VERSION
+    op     B   OP_PREDICT / OP_PING (requests), STATUS_OK / STATUS_ERROR (responses)
+    k      H   top-k width of a predict response, 0 otherwise
+    count  I   rows in a predict frame, payload bytes otherwise
+
+A predict request carries ``count x 7`` float32 readings.  A predict response
+carries the model version that produced it (ASCII, NUL-padded to 32 bytes),
+then ``count x k`` uint16 label indices and ``count x k`` float32
+probabilities.  Ping responses and errors carry a UTF-8 JSON / text payload.
+"""
+import struct
+
+import numpy as np
+
+from .readings import FEATURES
+
+MAGIC = b'SOIL'
+PROTOCOL_VERSION = 2
+HEADER = struct.Struct('<4sBBHI')
+
+OP_PREDICT = 1
+OP_PING = 2
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+ROW_BYTES = len(FEATURES) * 4
+VERSION_BYTES = 32
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def recv_exact(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            raise ConnectionError('Connection closed mid-frame')
+        received += n
+    return buffer
+
+
+def read_header(sock):
+    magic, version, op, k, count = HEADER.unpack(recv_exact(sock, HEADER.size))
+    if magic != MAGIC or version != PROTOCOL_VERSION:
+        raise ProtocolError(f'Bad frame header {magic!r} v{version}')
+    return op, k, count
+
+
+def encode_predict_request(rows):
+    rows = np.ascontiguousarray(rows, dtype='<f4')
+    return HEADER.pack(MAGIC, PROTOCOL_VERSION, OP_PREDICT, 0, len(rows)) + rows.tobytes()
+
+
+def predict_response_size(count, k):
+    return VERSION_BYTES + count * k * 6
+
+
+def encode_predict_response(indices, probabilities, model_version):
+    n, k = indices.shape
+    return b''.join((
+        HEADER.pack(MAGIC, PROTOCOL_VERSION, STATUS_OK, k, n),
+        model_version.encode('ascii')[:VERSION_BYTES].ljust(VERSION_BYTES, b'\0'),
+        np.ascontiguousarray(indices, dtype='<u2').tobytes(),
+        np.ascontiguousarray(probabilities, dtype='<f4').tobytes(),
+    ))
+
+
+def encode_message(status, payload):
+    payload = payload.encode('utf-8')
+    return HEADER.pack(MAGIC, PROTOCOL_VERSION, status, 0, len(payload)) + payload
+
+
+def decode_rows(payload, count):
+    return np.frombuffer(payload, dtype='<f4').reshape(count, len(FEATURES))
+
+
+def decode_predict_response(payload, count, k):
+    model_version = bytes(payload[:VERSION_BYTES]).rstrip(b'\0').decode('ascii')
+    split = VERSION_BYTES + count * k * 2
+    indices = np.frombuffer(payload, dtype='<u2', count=count * k, offset=VERSION_BYTES).reshape(count, k)
+    probabilities = np.frombuffer(payload, dtype='<f4', offset=split).reshape(count, k)
+    return indices, probabilities, model_version
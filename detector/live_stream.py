@@ -0,0 +1,115 @@
+"""
+Live per-workspace sensor updates for open dashboards.
+
+Ingest paths call ``stream.publish`` with the latest reading of a workspace.
+Nothing is sent right away: each process keeps at most one pending state per
+workspace and a task on the event loop sends it to the ``workspace_<id>``
+group at most LIVE_UPDATES_PER_SECOND times per second.  An update carries
+only the fields that changed since the last one sent (plus how many readings
+it stands for), with a full keyframe every LIVE_KEYFRAME_INTERVAL seconds so
+dashboards fed by several workers converge.  Dashboards get a full snapshot
+when they connect (``WorkspaceConsumer``).
+"""
+import asyncio
+import time
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.utils import timezone
+
+from .models import MEASUREMENT_FIELDS, SensorReading
+from .readings import FEATURES
+
+
+def group_name(workspace_id):
+    return f"workspace_{workspace_id}"
+
+
+def reading_state(row, recommendations, device_id, model_version):
+    """Dashboard state for one scored (7,) row in FEATURES order."""
+    state = {name: round(float(value), 3) for name, value in zip(FEATURES, row)}
+    state.update(device_id=device_id, recommendations=recommendations, model_version=model_version)
+    return state
+
+
+class WorkspaceStream:
+    def __init__(self, rate=2.0, keyframe_interval=30.0):
+        self.interval = 1.0 / rate
+        self.keyframe_interval = keyframe_interval
+        self.pending = {}  # workspace_id -> [latest state, readings since last update]
+        self.sent = {}  # workspace_id -> last full state sent
+        self._keyframe_due = {}
+        self._task = None
+
+        self.published = 0
+        self.updates = 0
+
+    def publish(self, workspace_id, state, readings=1):
+        """Queue the latest state of a workspace; must be called on the event loop."""
+        self.published += readings
+        pending = self.pending.get(workspace_id)
+        if pending is None:
+            self.pending[workspace_id] = [dict(state), readings]
+        else:
+            pending[0].update(state)
+            pending[1] += readings
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while self.pending:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self):
+        pending, self.pending = self.pending, {}
+        channel_layer = get_channel_layer()
+        now = time.monotonic()
+        for workspace_id, (state, readings) in pending.items():
+            last = self.sent.get(workspace_id, {})
+            current = {**last, **state}
+            keyframe = now >= self._keyframe_due.get(workspace_id, 0.0)
+            if keyframe:
+                delta = current
+                self._keyframe_due[workspace_id] = now + self.keyframe_interval
+            else:
+                delta = {key: value for key, value in state.items() if last.get(key) != value}
+            self.sent[workspace_id] = current
+            self.updates += 1
+            await channel_layer.group_send(group_name(workspace_id), {
+                "type": "workspace.update",
+                "keyframe": keyframe,
+                "delta": delta,
+                "readings": readings,
+                "timestamp": timezone.now().isoformat(),
+            })
+
+    def snapshot(self, workspace_id):
+        """Full state for a dashboard that just connected, from this process or the latest stored reading."""
+        if workspace_id in self.sent:
+            return self.sent[workspace_id]
+        reading = SensorReading.objects.filter(workspace_id=workspace_id).order_by('-timestamp').first()
+        if reading is None:
+            return None
+        state = {name: getattr(reading, field) for name, field in zip(FEATURES, MEASUREMENT_FIELDS)}
+        state.update(
+            device_id=reading.device_id,
+            recommendations=[{'crop_name': reading.top_crop, 'probability': reading.top_probability}],
+            model_version=reading.model_version,
+            timestamp=reading.timestamp.isoformat(),
+        )
+        return state
+
+    def metric_counters(self):
+        return [
+            ('soilution_live_readings_published_total', 'counter', 'Readings offered to dashboard streams.',
+             self.published),
+            ('soilution_live_updates_sent_total', 'counter', 'Coalesced updates sent to workspace groups.',
+             self.updates),
+        ]
+
+
+stream = WorkspaceStream(
+    rate=getattr(settings, 'LIVE_UPDATES_PER_SECOND', 2.0),
+    keyframe_interval=getattr(settings, 'LIVE_KEYFRAME_INTERVAL', 30.0),
+)
@@ -0,0 +1,165 @@
+"""
+Precomputed recommendation lookup table.
+
+``manage.py build_lookup_table`` evaluates the model on every node of a
+quantized grid over the seven sensor inputs and writes the top-5 labels,
+their probabilities and a measured per-cell error to ``.npy`` files.  At
+request time those files are memory-mapped and a reading is answered by
+snapping it to the nearest node, an O(1) index computation.
+"""
+import json
+import logging
+import os
+
+import numpy as np
+from django.conf import settings
+
+from .readings import FEATURES
+
+logger = logging.getLogger(__name__)
+
+# (min, max, step) per sensor, in FEATURES order
+DEFAULT_GRID = {
+    'nitrogen': (0, 140, 20),
+    'phosphorus': (5, 145, 20),
+    'potassium': (5, 205, 25),
+    'temperature': (10, 45, 5),
+    'moisture': (10, 100, 10),
+    'pH': (3.5, 9.5, 0.5),
+    'conductivity': (0, 3000, 500),
+}
+
+DEFAULT_DIR = os.path.join(os.path.dirname(__file__), 'ml_models', 'lookup')
+
+
+class Grid:
+    def __init__(self, spec):
+        spec = {**DEFAULT_GRID, **spec}
+        self.spec = {name: tuple(float(v) for v in spec[name]) for name in FEATURES}
+        self.low = np.array([self.spec[name][0] for name in FEATURES])
+        self.high = np.array([self.spec[name][1] for name in FEATURES])
+        self.step = np.array([self.spec[name][2] for name in FEATURES])
+        self.shape = tuple(int(n) for n in np.floor((self.high - self.low) / self.step + 1e-9) + 1)
+        self.size = int(np.prod(self.shape))
+
+    def nodes(self, cell_ids):
+        """Sensor values (len(cell_ids), 7) of the given flat node ids."""
+        coords = np.stack(np.unravel_index(cell_ids, self.shape), axis=1)
+        return (self.low + coords * self.step).astype(np.float32)
+
+    def cell_id(self, row):
+        """Flat id of the nearest node, or None if the reading is outside the grid."""
+        coords = np.rint((np.asarray(row, dtype=np.float64) - self.low) / self.step).astype(np.int64)
+        if (coords < 0).any() or (coords >= self.shape).any():
+            return None
+        return int(np.ravel_multi_index(coords, self.shape))
+
+
+class LookupTable:
+    """
+    Read-only view over a built table.  ``lookup`` returns ``(indices,
+    probabilities)`` for a reading, or None when the reading falls outside the
+    grid or its cell's measured error exceeds ``max_error``; callers then run
+    live inference.
+    """
+
+    def __init__(self, directory, max_error):
+        with open(os.path.join(directory, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.grid = Grid(self.meta['grid'])
+        self.indices = np.load(os.path.join(directory, 'indices.npy'), mmap_mode='r')
+        self.probabilities = np.load(os.path.join(directory, 'probabilities.npy'), mmap_mode='r')
+        self.error = np.load(os.path.join(directory, 'error.npy'), mmap_mode='r')
+        self.max_error = max_error
+
+        self.hits = 0
+        self.out_of_grid = 0
+        self.over_error = 0
+
+    @property
+    def version(self):
+        return self.meta['model_version']
+
+    def lookup(self, row):
+        cell = self.grid.cell_id(row)
+        if cell is None:
+            self.out_of_grid += 1
+            return None
+        if self.error[cell] > self.max_error:
+            self.over_error += 1
+            return None
+        self.hits += 1
+        return self.indices[cell], self.probabilities[cell].astype(np.float32)
+
+    def stats(self):
+        return {
+            'cells': self.grid.size,
+            'hits': self.hits,
+            'out_of_grid': self.out_of_grid,
+            'over_error': self.over_error,
+        }
+
+
+def write_table(directory, grid, predict_proba, top_k_rows, model_version,
+                samples_per_cell=2, chunk_size=65536, seed=0, progress=None):
+    """
+    Evaluate ``predict_proba`` on every grid node and store the top-5 in
+    memory-mapped ``.npy`` files, chunk by chunk so memory stays flat.
+
+    The error of a cell is the largest absolute probability difference between
+    its node and ``samples_per_cell`` random points inside the cell, i.e. how
+    wrong answering any reading in the cell with the node's result can be.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    open_memmap = np.lib.format.open_memmap
+    indices = open_memmap(os.path.join(directory, 'indices.npy'), mode='w+', dtype=np.uint8, shape=(grid.size, 5))
+    probabilities = open_memmap(os.path.join(directory, 'probabilities.npy'), mode='w+', dtype=np.float16, shape=(grid.size, 5))
+    error = open_memmap(os.path.join(directory, 'error.npy'), mode='w+', dtype=np.float16, shape=(grid.size,))
+
+    for start in range(0, grid.size, chunk_size):
+        cell_ids = np.arange(start, min(start + chunk_size, grid.size))
+        nodes = grid.nodes(cell_ids)
+        node_proba = predict_proba(nodes)
+        top_indices, top_proba = top_k_rows(node_proba)
+        indices[cell_ids] = top_indices
+        probabilities[cell_ids] = top_proba
+
+        cell_error = np.zeros(len(cell_ids), dtype=np.float32)
+        for _ in range(samples_per_cell):
+            jitter = rng.uniform(-0.5, 0.5, size=nodes.shape) * grid.step
+            samples = np.clip(nodes + jitter, grid.low, grid.high).astype(np.float32)
+            diff = np.abs(predict_proba(samples) - node_proba).max(axis=1)
+            np.maximum(cell_error, diff, out=cell_error)
+        error[cell_ids] = cell_error
+
+        if progress:
+            progress(min(start + chunk_size, grid.size), grid.size)
+
+    for array in (indices, probabilities, error):
+        array.flush()
+
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump({
+            'grid': grid.spec,
+            'model_version': model_version,
+            'samples_per_cell': samples_per_cell,
+            'max_cell_error': float(error.max()) if grid.size else 0.0,
+        }, f, indent=2)
+
+
+def load_table(model_version):
+    """The configured table, or None if it is disabled, missing or built for another model."""
+    if not getattr(settings, 'LOOKUP_TABLE_ENABLED', False):
+        return None
+    directory = getattr(settings, 'LOOKUP_TABLE_DIR', DEFAULT_DIR)
+    try:
+        table = LookupTable(directory, getattr(settings, 'LOOKUP_TABLE_MAX_ERROR', 0.05))
+    except FileNotFoundError:
+        logger.warning("Lookup table enabled but not built in %s; using live inference.", directory)
+        return None
+    if table.version != model_version:
+        logger.warning("Lookup table in %s was built for model %s, not %s; using live inference.",
+                       directory, table.version, model_version)
+        return None
+    return table
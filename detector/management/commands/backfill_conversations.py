@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from detector.inbox import backfill
+
+
+class Command(BaseCommand):
+    help = ("Rebuild the inbox conversation summaries from stored messages. "
+            "Idempotent: existing summaries of the selected users are replaced.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users',
+                            help="Only this user id (repeatable).")
+
+    def handle(self, *args, **options):
+        rows = backfill(user_ids=options['users'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {rows} conversation summaries."))
@@ -0,0 +1,83 @@
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from detector.model_backends import BACKENDS, load_backend, sample_readings
+
+
+def rss_mb():
+    # ru_maxrss is reported in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+class Command(BaseCommand):
+    help = "Per-row latency, batch throughput and worker RSS for each inference backend."
+    # The URL check imports views and so inference, which would load the configured
+    # backend (TensorFlow by default) into every child and skew its RSS
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000, help="Single-row calls to time.")
+        parser.add_argument('--batch-size', type=int, default=1024)
+        parser.add_argument('--batches', type=int, default=50)
+        parser.add_argument('--only', choices=BACKENDS,
+                            help="Measure one backend in this process and print the result as JSON.")
+
+    def handle(self, *args, **options):
+        if options['only']:
+            self.stdout.write(json.dumps(self.measure(options['only'], options)))
+            return
+
+        # Each backend runs in its own process so RSS is not polluted by the other
+        self.stdout.write(f"{'backend':<8} {'load s':>8} {'row p50 ms':>11} {'row p99 ms':>11} "
+                          f"{'rows/s (batch)':>15} {'RSS MB':>8}")
+        for backend in BACKENDS:
+            output = subprocess.run(
+                [sys.executable, sys.argv[0], 'benchmark_backends', '--only', backend,
+                 '--rows', str(options['rows']), '--batch-size', str(options['batch_size']),
+                 '--batches', str(options['batches'])],
+                capture_output=True, text=True,
+                env={**os.environ, 'INFERENCE_BACKEND': backend},
+            )
+            if output.returncode != 0:
+                self.stderr.write(f"{backend}: failed\n{output.stderr}")
+                continue
+            r = json.loads(output.stdout.strip().splitlines()[-1])
+            self.stdout.write(f"{backend:<8} {r['load_s']:>8.2f} {r['row_p50_ms']:>11.3f} "
+                              f"{r['row_p99_ms']:>11.3f} {r['batch_rows_per_s']:>15.0f} {r['rss_mb']:>8.1f}")
+
+    def measure(self, name, options):
+        start = time.perf_counter()
+        backend = load_backend(name)
+        load_s = time.perf_counter() - start
+
+        rows = sample_readings(max(options['rows'], options['batch_size']))
+        backend.predict_proba(rows[:1])  # warm up
+
+        latencies = []
+        for i in range(options['rows']):
+            start = time.perf_counter()
+            backend.predict_proba(rows[i:i + 1])
+            latencies.append(time.perf_counter() - start)
+        p50, p99 = np.percentile(np.asarray(latencies) * 1000.0, [50, 99])
+
+        batch = rows[:options['batch_size']]
+        start = time.perf_counter()
+        for _ in range(options['batches']):
+            backend.predict_proba(batch)
+        elapsed = time.perf_counter() - start
+
+        return {
+            'backend': name,
+            'load_s': load_s,
+            'row_p50_ms': float(p50),
+            'row_p99_ms': float(p99),
+            'batch_rows_per_s': options['batch_size'] * options['batches'] / elapsed,
+            'rss_mb': rss_mb(),
+        }
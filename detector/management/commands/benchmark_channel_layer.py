@@ -0,0 +1,135 @@
+import argparse
+import asyncio
+import sys
+import time
+import uuid
+
+import numpy as np
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+
+from detector.channel_layer import DatabaseChannelLayer
+
+
+class Command(BaseCommand):
+    help = ("Messages/sec and delivery latency of the database channel layer against the in-memory one: "
+            "point to point, group fan-out, and (database only) from another process.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1000, help="Messages delivered per test.")
+        parser.add_argument('--members', type=int, default=20, help="Channels in the fan-out group.")
+        parser.add_argument('--senders', type=int, default=4, help="Concurrent sending tasks.")
+        parser.add_argument('--timeout', type=float, default=60.0, help="Seconds to wait for delivery per test.")
+        # Internal: run as the sending process of the cross-process test
+        parser.add_argument('--send-to', help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['send_to']:
+            asyncio.run(self.send_from_child(options))
+            return
+        asyncio.run(self.run(options))
+
+    async def run(self, options):
+        capacity = options['messages'] + 1
+        layers = {
+            'memory': InMemoryChannelLayer(capacity=capacity),
+            'database': DatabaseChannelLayer(capacity=capacity),
+        }
+        self.stdout.write(f"{'layer':<9} {'test':<14} {'delivered':>10} {'msg/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+        for name, layer in layers.items():
+            for test in (self.direct, self.group, self.cross_process):
+                label = test.__name__.replace('_', '-')
+                if test is self.cross_process and name == 'memory':
+                    self.stdout.write(f"{name:<9} {label:<14} {'n/a: one process only':>37}")
+                    continue
+                expected, latencies, elapsed = await test(layer, options)
+                self.report(name, label, expected, latencies, elapsed)
+            if isinstance(layer, DatabaseChannelLayer):
+                await layer.close()
+
+    def report(self, layer, test, expected, latencies, elapsed):
+        delivered = f'{len(latencies)}/{expected}'
+        if not latencies:
+            self.stdout.write(f"{layer:<9} {test:<14} {delivered:>10}")
+            return
+        ms = np.array(latencies) * 1000
+        self.stdout.write(f"{layer:<9} {test:<14} {delivered:>10} {len(latencies) / elapsed:>9.0f} "
+                          f"{np.percentile(ms, 50):>8.2f} {np.percentile(ms, 99):>8.2f}")
+
+    @staticmethod
+    def message(seq):
+        return {'type': 'benchmark.message', 'seq': seq, 'sent': time.time()}
+
+    async def send_all(self, count, senders, send):
+        async def sender(offset):
+            for seq in range(offset, count, senders):
+                await send(self.message(seq))
+        await asyncio.gather(*(sender(offset) for offset in range(senders)))
+
+    async def measure(self, layer, channels, per_channel, send, timeout):
+        """
+        Receive ``per_channel`` messages on each of ``channels`` while ``send()``
+        runs; returns ``(expected, latencies, seconds from first send to last delivery)``.
+        """
+        latencies, sent, received = [], [], []
+
+        async def drain(channel):
+            for _ in range(per_channel):
+                message = await layer.receive(channel)
+                received.append(time.time())
+                sent.append(message['sent'])
+                latencies.append(received[-1] - message['sent'])
+
+        receivers = asyncio.gather(*(drain(channel) for channel in channels))
+        try:
+            await send()
+            await asyncio.wait_for(receivers, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            receivers.cancel()
+        elapsed = max(received) - min(sent) if received else 0.0
+        return per_channel * len(channels), latencies, elapsed
+
+    async def direct(self, layer, options):
+        channel = await layer.new_channel()
+        return await self.measure(
+            layer, [channel], options['messages'],
+            lambda: self.send_all(options['messages'], options['senders'], lambda m: layer.send(channel, m)),
+            options['timeout'],
+        )
+
+    async def group(self, layer, options):
+        group = f'benchmark-{uuid.uuid4().hex[:12]}'
+        channels = [await layer.new_channel() for _ in range(options['members'])]
+        for channel in channels:
+            await layer.group_add(group, channel)
+        # About --messages deliveries in all
+        sends = max(1, options['messages'] // options['members'])
+        try:
+            return await self.measure(
+                layer, channels, sends,
+                lambda: self.send_all(sends, options['senders'], lambda m: layer.group_send(group, m)),
+                options['timeout'],
+            )
+        finally:
+            for channel in channels:
+                await layer.group_discard(group, channel)
+
+    async def cross_process(self, layer, options):
+        channel = await layer.new_channel()
+
+        async def send():
+            # Process start-up is not timed: throughput runs from the first message sent
+            child = await asyncio.create_subprocess_exec(
+                sys.executable, sys.argv[0], 'benchmark_channel_layer', '--send-to', channel,
+                '--messages', str(options['messages']), '--senders', str(options['senders']),
+            )
+            await child.wait()
+
+        return await self.measure(layer, [channel], options['messages'], send, options['timeout'])
+
+    async def send_from_child(self, options):
+        layer = DatabaseChannelLayer(capacity=options['messages'] + 1)
+        await self.send_all(options['messages'], options['senders'],
+                            lambda m: layer.send(options['send_to'], m))
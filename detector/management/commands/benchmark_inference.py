@@ -0,0 +1,62 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from detector import inference
+from detector.model_backends import sample_readings
+
+
+def summarize(label, latencies, elapsed):
+    latencies = np.asarray(latencies) * 1000.0
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return (
+        f"{label:<14} {len(latencies) / elapsed:>10.1f} req/s   "
+        f"p50 {p50:7.2f} ms   p95 {p95:7.2f} ms   p99 {p99:7.2f} ms"
+    )
+
+
+class Command(BaseCommand):
+    help = "Compare one-row inference against the micro-batcher under concurrent load."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=64)
+        parser.add_argument('--max-batch-size', type=int, default=64)
+        parser.add_argument('--max-wait-ms', type=float, default=5.0)
+
+    def handle(self, *args, **options):
+        rows = sample_readings(options['requests'])
+        concurrency = options['concurrency']
+
+        def one_row(row):
+            start = time.perf_counter()
+            inference.recommend(row[np.newaxis, :])
+            return time.perf_counter() - start
+
+        batcher = inference.MicroBatcher(
+            inference.recommend_rows,
+            max_batch_size=options['max_batch_size'],
+            max_wait=options['max_wait_ms'] / 1000.0,
+        )
+
+        def batched(row):
+            start = time.perf_counter()
+            batcher.predict(row)
+            return time.perf_counter() - start
+
+        # Warm up both paths so graph tracing is not counted
+        one_row(rows[0])
+        batched(rows[0])
+
+        self.stdout.write(
+            f"{options['requests']} requests, concurrency {concurrency}, "
+            f"max batch {options['max_batch_size']}, max wait {options['max_wait_ms']} ms"
+        )
+        for label, fn in (('one-row', one_row), ('micro-batch', batched)):
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                start = time.perf_counter()
+                latencies = list(pool.map(fn, rows))
+                elapsed = time.perf_counter() - start
+            self.stdout.write(summarize(label, latencies, elapsed))
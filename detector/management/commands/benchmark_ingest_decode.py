@@ -0,0 +1,49 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from detector import binary_readings
+from detector.model_backends import sample_readings
+from detector.readings import FEATURES, load_reading_list, parse_readings
+
+
+def per_call(fn, min_seconds):
+    """Mean seconds per call of ``fn``, repeating until ``min_seconds`` have passed."""
+    fn()
+    calls, start = 0, time.perf_counter()
+    while True:
+        fn()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return elapsed / calls
+
+
+class Command(BaseCommand):
+    help = "Compare decoding JSON and binary ESP32 bodies into the (n, 7) reading matrix."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1, 100, 10000])
+        parser.add_argument('--min-seconds', type=float, default=1.0,
+                            help="Time spent on each format and size.")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'records':>8} {'format':<8} {'bytes':>10} {'per body':>12} {'per record':>12}")
+        for size in options['sizes']:
+            rows = sample_readings(size)
+            json_body = json.dumps([dict(zip(FEATURES, row)) for row in rows.tolist()]).encode()
+            binary_body = binary_readings.encode(rows, device_id='bench-01')
+
+            def decode_json():
+                readings, _ = load_reading_list(json_body, 'application/json')
+                return parse_readings(readings)
+
+            def decode_binary():
+                return binary_readings.decode(binary_body)
+
+            for label, body, fn in (('json', json_body, decode_json), ('binary', binary_body, decode_binary)):
+                seconds = per_call(fn, options['min_seconds'])
+                self.stdout.write(
+                    f"{size:>8} {label:<8} {len(body):>10,} {seconds * 1e6:>9.1f} us {seconds / size * 1e9:>9.0f} ns"
+                )
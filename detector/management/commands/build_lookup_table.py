@@ -0,0 +1,63 @@
+import os
+import time
+
+import numpy as np
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from detector import inference
+from detector.lookup_table import DEFAULT_DIR, Grid, write_table
+from detector.readings import FEATURES
+
+
+def parse_axis(value):
+    try:
+        name, bounds = value.split('=', 1)
+        low, high, step = (float(v) for v in bounds.split(':'))
+    except ValueError:
+        raise CommandError(f"Invalid --axis '{value}', expected name=min:max:step")
+    if name not in FEATURES:
+        raise CommandError(f"Unknown sensor '{name}', expected one of {', '.join(FEATURES)}")
+    if step <= 0 or high < low:
+        raise CommandError(f"Invalid range for '{name}'")
+    return name, (low, high, step)
+
+
+class Command(BaseCommand):
+    help = "Precompute top-5 recommendations over a quantized grid of sensor readings."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--axis', action='append', default=[],
+                            help="Override one sensor's grid, e.g. --axis pH=4:9:0.25 (repeatable).")
+        parser.add_argument('--output', default=getattr(settings, 'LOOKUP_TABLE_DIR', DEFAULT_DIR))
+        parser.add_argument('--samples-per-cell', type=int, default=2,
+                            help="Random in-cell points used to measure each cell's error.")
+        parser.add_argument('--chunk-size', type=int, default=65536)
+        parser.add_argument('--max-cells', type=int, default=50_000_000)
+
+    def handle(self, *args, **options):
+        spec = dict(getattr(settings, 'LOOKUP_TABLE_GRID', {}))
+        spec.update(parse_axis(value) for value in options['axis'])
+        grid = Grid(spec)
+
+        if grid.size > options['max_cells']:
+            raise CommandError(f"Grid has {grid.size:,} cells (shape {grid.shape}); "
+                               f"coarsen it or raise --max-cells.")
+
+        self.stdout.write(f"Grid shape {grid.shape} = {grid.size:,} cells")
+        start = time.perf_counter()
+
+        def progress(done, total):
+            self.stdout.write(f"  {done:,}/{total:,} cells ({time.perf_counter() - start:.0f}s)")
+
+        write_table(
+            str(options['output']), grid, inference.predict_proba, inference.top_k_rows,
+            inference.model_version(), samples_per_cell=options['samples_per_cell'],
+            chunk_size=options['chunk_size'], progress=progress,
+        )
+        error = np.load(os.path.join(str(options['output']), 'error.npy'), mmap_mode='r')
+        bound = getattr(settings, 'LOOKUP_TABLE_MAX_ERROR', 0.05)
+        self.stdout.write(f"{float((error <= bound).mean()):.1%} of cells are within the "
+                          f"{bound} error bound and will be served from the table")
+        self.stdout.write(self.style.SUCCESS(f"Wrote lookup table to {options['output']}"))
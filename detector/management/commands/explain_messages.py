@@ -0,0 +1,140 @@
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from detector import inbox
+from detector.models import Conversation, Message
+
+SEED_PREFIX = 'explain-seed-'
+
+
+class Rollback(Exception):
+    pass
+
+
+def messaging_queries(user, other):
+    """(name, queryset) for every messaging query in views.py and context_processors.py."""
+    pair = Message.objects.filter(sender=user, receiver=other) | Message.objects.filter(sender=other, receiver=user)
+    # The cursor a client would send for the second page
+    before = pair.order_by('-id').values_list('id', flat=True)[inbox.THREAD_PAGE_SIZE:].first() or 0
+    return [
+        ('context_processors.recent_messages', Message.objects.filter(receiver=user).order_by('-timestamp')[:5]),
+        # COUNT(*) plans walk the same index as selecting the ids
+        ('unread count', Message.objects.filter(receiver=user, is_read=False).order_by().values('pk')),
+        ('dropdown: latest unread', Message.objects.filter(receiver=user, is_read=False)
+         .select_related('sender__profile').order_by('-timestamp')[:3]),
+        ('dropdown: latest read', Message.objects.filter(receiver=user, is_read=True)
+         .select_related('sender__profile').order_by('-timestamp')[:2]),
+        ('inbox conversations', inbox.conversations(user)),
+        ('thread: newest page', pair.select_related('sender__profile').order_by('-id')[:inbox.THREAD_PAGE_SIZE + 1]),
+        ('thread: older page', pair.filter(id__lt=before).select_related('sender__profile')
+         .order_by('-id')[:inbox.THREAD_PAGE_SIZE + 1]),
+        ('mark read', Message.objects.filter(receiver=user, sender=other, is_read=False).order_by().values('pk')),
+    ]
+
+
+class Command(BaseCommand):
+    help = ("Print the query plan of every messaging query, optionally against seeded messages. "
+            "Seeded rows are rolled back afterwards unless --keep is given.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, metavar='MESSAGES',
+                            help="Insert this many synthetic messages first (e.g. 2000000).")
+        parser.add_argument('--users', type=int, default=500, help="Synthetic users to spread them over.")
+        parser.add_argument('--keep', action='store_true', help="Commit the seeded data instead of rolling back.")
+        parser.add_argument('--fail-on-seq-scan', action='store_true',
+                            help="Exit with an error if any plan scans the message table sequentially.")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                seq_scans = self.run(options)
+                if not options['keep']:
+                    raise Rollback
+        except Rollback:
+            pass
+        if seq_scans and options['fail_on_seq_scan']:
+            raise CommandError(f"Sequential scans in: {', '.join(seq_scans)}")
+
+    def run(self, options):
+        if options['seed']:
+            users = self.seed_users(options['users'])
+            start = time.perf_counter()
+            self.seed_messages(users, options['seed'])
+            inbox.backfill(user_ids=users)
+            self.stdout.write(f"Seeded {options['seed']} messages in {time.perf_counter() - start:.1f}s")
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(f'ANALYZE {Message._meta.db_table}')
+                cursor.execute(f'ANALYZE {Conversation._meta.db_table}')
+
+        # The busiest inbox and its busiest correspondent
+        top = (Message.objects.order_by().values('receiver', 'sender')
+               .annotate(n=Count('id')).order_by('-n').first())
+        if top is None:
+            raise CommandError("No messages; run with --seed.")
+        user, other = User.objects.get(pk=top['receiver']), User.objects.get(pk=top['sender'])
+        self.stdout.write(f"Plans for user {user.pk} reading from user {other.pk} ({top['n']} messages)\n")
+
+        seq_scans = []
+        table = Message._meta.db_table
+        for name, queryset in messaging_queries(user, other):
+            plan = queryset.explain(analyze=connection.vendor == 'postgresql')
+            scanned = f'Seq Scan on {table}' in plan or f'SCAN {table}' in plan
+            if scanned:
+                seq_scans.append(name)
+            label = self.style.WARNING('SEQ SCAN') if scanned else self.style.SUCCESS('indexed')
+            self.stdout.write(f"== {name} [{label}]\n{plan}\n")
+        return seq_scans
+
+    def seed_users(self, count):
+        existing = set(User.objects.filter(username__startswith=SEED_PREFIX).values_list('username', flat=True))
+        User.objects.bulk_create([
+            User(username=f'{SEED_PREFIX}{i}', password='!')
+            for i in range(count) if f'{SEED_PREFIX}{i}' not in existing
+        ], batch_size=1000)
+        return list(User.objects.filter(username__startswith=SEED_PREFIX).values_list('pk', flat=True)[:count])
+
+    def seed_messages(self, users, count):
+        """
+        ``count`` messages between ``users``; a fifth go to the first user (a
+        support inbox) and about 10% are unread.
+        """
+        if connection.vendor == 'postgresql':
+            fields = {f.name: f.column for f in Message._meta.concrete_fields}
+            with connection.cursor() as cursor:
+                cursor.execute(f"""
+                    INSERT INTO {Message._meta.db_table}
+                        ({fields['sender']}, {fields['receiver']}, {fields['content']},
+                         {fields['timestamp']}, {fields['is_read']})
+                    SELECT u[1 + floor(random() * n)::int],
+                           CASE WHEN random() < 0.2 THEN u[1] ELSE u[1 + floor(random() * n)::int] END,
+                           'Seeded message ' || g,
+                           now() - (g || ' seconds')::interval,
+                           random() >= 0.1
+                    FROM generate_series(1, %s) AS g,
+                         (SELECT %s::bigint[] AS u, cardinality(%s::bigint[]) AS n) AS seed_users
+                """, [count, users, users])
+            return
+
+        now = timezone.now()
+        batch = []
+        for i in range(count):
+            receiver = users[0] if random.random() < 0.2 else random.choice(users)
+            batch.append(Message(sender_id=random.choice(users), receiver_id=receiver,
+                                 content=f'Seeded message {i}', is_read=random.random() >= 0.1))
+            if len(batch) == 10000 or i == count - 1:
+                created = Message.objects.bulk_create(batch)
+                # auto_now_add stamps every row with the same time; spread them out
+                first = i + 1 - len(created)
+                for offset, message in enumerate(created):
+                    message.timestamp = now - timedelta(seconds=first + offset)
+                if created[0].pk is not None:
+                    Message.objects.bulk_update(created, ['timestamp'], batch_size=2000)
+                batch = []
@@ -0,0 +1,41 @@
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from detector.model_backends import (
+    MODEL_PATH, NUMPY_MODEL_PATH, SCALER_PATH, KerasBackend, NumpyBackend, export_numpy, sample_readings,
+)
+
+
+class Command(BaseCommand):
+    help = "Export the Keras crop model and scaler to .npz weights for the NumPy backend."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', default=MODEL_PATH)
+        parser.add_argument('--scaler', default=SCALER_PATH)
+        parser.add_argument('--output', default=NUMPY_MODEL_PATH)
+        parser.add_argument('--samples', type=int, default=10000,
+                            help="Random readings used for the parity check.")
+        parser.add_argument('--tolerance', type=float, default=1e-4,
+                            help="Maximum absolute probability difference allowed between backends.")
+
+    def handle(self, *args, **options):
+        keras_backend = KerasBackend(options['model'], options['scaler'])
+        try:
+            export_numpy(keras_backend.model, keras_backend.scaler, options['output'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(f"Wrote {options['output']}")
+
+        # Parity check: both backends must agree on the same readings
+        rows = sample_readings(options['samples'])
+        expected = keras_backend.predict_proba(rows)
+        actual = NumpyBackend(options['output']).predict_proba(rows)
+        max_diff = float(np.abs(expected - actual).max())
+        top1_agreement = float((expected.argmax(axis=1) == actual.argmax(axis=1)).mean())
+
+        self.stdout.write(f"max |keras - numpy| = {max_diff:.2e}, top-1 agreement = {top1_agreement:.4%}")
+        if max_diff > options['tolerance']:
+            raise CommandError(
+                f"NumPy backend differs from Keras by {max_diff:.2e} (tolerance {options['tolerance']:.0e})"
+            )
+        self.stdout.write(self.style.SUCCESS("Parity check passed."))
@@ -0,0 +1,90 @@
+import asyncio
+import json
+import time
+
+import numpy as np
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+
+from detector import binary_readings
+from detector.model_backends import sample_readings
+from detector.readings import FEATURES
+from detector.routing import websocket_urlpatterns
+
+
+class Command(BaseCommand):
+    help = ("In-process load test of the device WebSocket: holds many device connections open "
+            "in this worker and measures readings/sec and round-trip latency.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=200)
+        parser.add_argument('--frames', type=int, default=50, help="Frames sent per connection.")
+        parser.add_argument('--per-frame', type=int, default=1, help="Readings per frame.")
+        parser.add_argument('--window', type=int, default=1,
+                            help="Frames a device sends before waiting for replies.")
+        parser.add_argument('--format', choices=('json', 'binary'), default='json')
+        parser.add_argument('--timeout', type=float, default=30.0)
+
+    def handle(self, *args, **options):
+        asyncio.run(self.run(options))
+
+    def frames(self, device, options):
+        rows = sample_readings(options['frames'] * options['per_frame'], seed=device)
+        for n in range(options['frames']):
+            chunk = rows[n * options['per_frame']:(n + 1) * options['per_frame']]
+            seq = np.arange(n * len(chunk), (n + 1) * len(chunk))
+            if options['format'] == 'binary':
+                yield {'bytes_data': binary_readings.encode(chunk, seq, device_id=f'load-{device}')}
+            else:
+                readings = [dict(zip(FEATURES, row), seq=int(s)) for row, s in zip(chunk.tolist(), seq)]
+                yield {'text_data': json.dumps(readings)}
+
+    async def run(self, options):
+        application = URLRouter(websocket_urlpatterns)
+        timeout = options['timeout']
+        outcomes = {'recommendations': 0, 'dropped': 0, 'rejected': 0, 'error': 0}
+        latencies = []
+
+        communicators = []
+        for device in range(options['connections']):
+            communicator = WebsocketCommunicator(application, f'/ws/device/load-{device}/')
+            connected, _ = await communicator.connect(timeout=timeout)
+            if not connected:
+                self.stderr.write(f"Connection {device} refused")
+                continue
+            communicators.append(communicator)
+        self.stdout.write(f"Holding {len(communicators)} device connections")
+
+        async def receive(communicator, sent_at):
+            reply = json.loads(await communicator.receive_from(timeout=timeout))
+            outcomes[reply['type']] = outcomes.get(reply['type'], 0) + 1
+            # Every frame gets exactly one reply, in order (a 'dropped' reply stands for an older frame)
+            sent = sent_at.pop(0)
+            if reply['type'] == 'recommendations':
+                latencies.append(time.perf_counter() - sent)
+
+        async def device_session(device, communicator):
+            sent_at = []
+            for frame in self.frames(device, options):
+                await communicator.send_to(**frame)
+                sent_at.append(time.perf_counter())
+                if len(sent_at) >= options['window']:
+                    await receive(communicator, sent_at)
+            while sent_at:
+                await receive(communicator, sent_at)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(device_session(i, c) for i, c in enumerate(communicators)))
+        elapsed = time.perf_counter() - start
+        for communicator in communicators:
+            await communicator.disconnect()
+
+        readings = outcomes['recommendations'] * options['per_frame']
+        self.stdout.write(f"{readings:,} readings in {elapsed:.2f}s = {readings / elapsed:,.0f} readings/s "
+                          f"over {len(communicators)} connections")
+        if latencies:
+            p50, p95, p99 = np.percentile(np.asarray(latencies) * 1000, [50, 95, 99])
+            self.stdout.write(f"Round trip p50 {p50:.2f} ms   p95 {p95:.2f} ms   p99 {p99:.2f} ms")
+        self.stdout.write(f"Dropped {outcomes['dropped']}, rejected {outcomes['rejected']}, "
+                          f"errors {outcomes['error']}")
@@ -0,0 +1,85 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from detector.context_processors import cached_recent_messages
+from detector.models import Message
+
+DEFAULT_PAGES = ['dashboard', 'insights', 'crop_details', 'logs', 'reports', 'dashboard_settings']
+LAZY_PROCESSOR = 'detector.context_processors.recent_messages'
+BASELINE_PROCESSOR = f'{__name__}.previous_recent_messages'
+
+
+def previous_recent_messages(request):
+    """recent_messages as it was before it became lazy and cached, to measure against."""
+    if request.user.is_authenticated:
+        messages = Message.objects.filter(receiver=request.user).order_by('-timestamp')[:5]
+        return {'recent_messages': messages}
+    return {}
+
+
+def templates_with(processor):
+    """TEMPLATES with the recent_messages context processor replaced by ``processor``."""
+    templates = []
+    for engine in settings.TEMPLATES:
+        options = engine.get('OPTIONS', {})
+        processors = [processor if p == LAZY_PROCESSOR else p for p in options.get('context_processors', [])]
+        templates.append({**engine, 'OPTIONS': {**options, 'context_processors': processors}})
+    return templates
+
+
+class Command(BaseCommand):
+    help = ("Count the queries of logged-in page views and of the recent_messages context data, "
+            "with the previous context processor and with the lazy, cached one.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, required=True, help="User id to view the pages as.")
+        parser.add_argument('--pages', nargs='+', default=DEFAULT_PAGES, help="URL names to request.")
+        parser.add_argument('--views', type=int, default=3, help="Views of each page (the first warms caches).")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(pk=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user {options['user']}")
+
+        # The context data itself: an uncached read always costs a query, a cached one only when cold
+        for label, ttl in (('uncached', 0), ('cached', 300)):
+            with override_settings(RECENT_MESSAGES_CACHE_TTL=ttl):
+                counts = []
+                for _ in range(options['views']):
+                    with CaptureQueriesContext(connection) as queries:
+                        list(cached_recent_messages(user.pk))
+                    counts.append(len(queries))
+            self.stdout.write(f"recent_messages ({label}): {counts} queries per read")
+
+        # Whole pages, rendered with the previous context processor and with the current one
+        hosts = [host for host in settings.ALLOWED_HOSTS if host != '*' and not host.startswith('.')]
+        client = Client(HTTP_HOST=hosts[0] if hosts else 'localhost')
+        client.force_login(user)
+        self.stdout.write(f"\n{'page':<22} {'status':>6}  {'queries per view (before)':<28} queries per view (now)")
+        totals = {'before': 0, 'now': 0}
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'localhost']):
+            for name in options['pages']:
+                url = reverse(name)
+                counts, status = {}, None
+                for label, processor in (('before', BASELINE_PROCESSOR), ('now', LAZY_PROCESSOR)):
+                    counts[label] = []
+                    with override_settings(TEMPLATES=templates_with(processor)):
+                        for _ in range(options['views']):
+                            with CaptureQueriesContext(connection) as queries:
+                                response = client.get(url)
+                            counts[label].append(len(queries))
+                            status = response.status_code
+                    totals[label] += sum(counts[label])
+                self.stdout.write(f"{name:<22} {status:>6}  {str(counts['before']):<28} {counts['now']}")
+
+        views = len(options['pages']) * options['views']
+        if views:
+            saved = totals['before'] - totals['now']
+            self.stdout.write(f"\n{views} views each: {totals['before']} queries before, {totals['now']} now, "
+                              f"{saved} fewer ({saved / views:.2f} per view).")
@@ -0,0 +1,39 @@
+from datetime import datetime, time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from detector.rollups import rebuild
+
+
+def parse_day(value):
+    day = parse_date(value)
+    if day is None:
+        raise CommandError(f"Invalid date '{value}', expected YYYY-MM-DD")
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+class Command(BaseCommand):
+    help = ("Recompute 5-minute, hourly and daily rollups from stored sensor readings. "
+            "Idempotent: every day in the range is replaced, so it can be rerun after a crash or backfill.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help="First local day to rebuild (YYYY-MM-DD).")
+        parser.add_argument('--until', help="Stop before this local day (YYYY-MM-DD).")
+        parser.add_argument('--days', type=int, default=2,
+                            help="Without --since, rebuild this many days back from today.")
+        parser.add_argument('--all', action='store_true', help="Rebuild every stored reading.")
+        parser.add_argument('--workspace', type=int, help="Only this workspace id.")
+
+    def handle(self, *args, **options):
+        since = until = None
+        if options['since']:
+            since = parse_day(options['since'])
+        elif not options['all']:
+            since = timezone.now() - timedelta(days=options['days'])
+        if options['until']:
+            until = parse_day(options['until'])
+
+        days = rebuild(workspace_id=options['workspace'], since=since, until=until)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt rollups for {days} day(s)."))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from detector import devices
+from detector.models import Device, Workspace
+
+
+class Command(BaseCommand):
+    help = ("Register a device in a workspace, or rotate its key, and print the key. "
+            "Only readings sent with this key are stored in the workspace.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('workspace', type=int, help="Workspace id.")
+        parser.add_argument('device_id', help="Device id, as sent in X-Device-Id or the device socket URL.")
+        parser.add_argument('--revoke', action='store_true', help="Delete the device and its key instead.")
+
+    def handle(self, *args, **options):
+        try:
+            workspace = Workspace.objects.get(pk=options['workspace'])
+        except Workspace.DoesNotExist:
+            raise CommandError(f"No workspace {options['workspace']}")
+        device_id = options['device_id'][:64]
+
+        if options['revoke']:
+            deleted, _ = Device.objects.filter(workspace=workspace, device_id=device_id).delete()
+            if not deleted:
+                raise CommandError(f"Device {device_id} is not registered in workspace {workspace.pk}")
+            self.stdout.write(self.style.SUCCESS(f"Revoked {device_id} (cached keys expire within "
+                                                 f"{devices.keys.ttl} seconds)."))
+            return
+
+        key = devices.register(workspace, device_id)
+        self.stdout.write(f"Device {device_id} in workspace {workspace.pk} ({workspace.name}).")
+        self.stdout.write(f"Key (shown once, send it as {devices.KEY_HEADER}): {key}")
@@ -0,0 +1,125 @@
+import json
+import os
+import socketserver
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from detector import inference
+from detector import inference_protocol as protocol
+from detector.inference_client import InferenceClient, InferenceUnavailable
+
+
+def score_rows(rows):
+    indices, probabilities, model_version = inference.score(rows)
+    return [(i, p, model_version) for i, p in zip(indices, probabilities)]
+
+
+class InferenceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, batcher):
+        self.batcher = batcher
+        self.started_at = time.time()
+        self.frames = 0
+        self.rows = 0
+        self.errors = 0
+        super().__init__(path, InferenceHandler)
+
+
+class InferenceHandler(socketserver.BaseRequestHandler):
+    """One persistent client connection; frames are answered in order."""
+
+    def handle(self):
+        server = self.server
+        while True:
+            try:
+                op, _, count = protocol.read_header(self.request)
+                if op == protocol.OP_PREDICT:
+                    payload = protocol.recv_exact(self.request, count * protocol.ROW_BYTES)
+                    response = self.predict(protocol.decode_rows(payload, count))
+                elif op == protocol.OP_PING:
+                    protocol.recv_exact(self.request, count)
+                    response = protocol.encode_message(protocol.STATUS_OK, json.dumps({
+                        'backend': inference.INFERENCE_BACKEND,
+                        'model_version': inference.model_version(),
+                        'uptime': time.time() - server.started_at,
+                        'frames': server.frames,
+                        'rows': server.rows,
+                        'errors': server.errors,
+                    }))
+                else:
+                    raise protocol.ProtocolError(f'Unknown op {op}')
+            except (ConnectionError, OSError, protocol.ProtocolError):
+                return
+            try:
+                self.request.sendall(response)
+            except OSError:
+                return
+
+    def predict(self, rows):
+        server = self.server
+        server.frames += 1
+        server.rows += len(rows)
+        try:
+            if len(rows) >= server.batcher.max_batch_size:
+                # Already a full batch: score it directly
+                indices, probabilities, model_version = inference.score(rows)
+            else:
+                # Small frames from many workers are merged by the batcher
+                futures = [server.batcher.submit(row) for row in rows]
+                indices, probabilities, versions = zip(*(future.result() for future in futures))
+                model_version = versions[-1]
+            return protocol.encode_predict_response(np.asarray(indices), np.asarray(probabilities), model_version)
+        except Exception as e:
+            server.errors += 1
+            return protocol.encode_message(protocol.STATUS_ERROR, str(e))
+
+
+class Command(BaseCommand):
+    help = "Run the shared crop model inference service on a Unix domain socket."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=getattr(settings, 'INFERENCE_SERVICE_SOCKET', None))
+        parser.add_argument('--max-batch-size', type=int, default=settings.INFERENCE_MAX_BATCH_SIZE)
+        parser.add_argument('--max-wait-ms', type=float, default=settings.INFERENCE_MAX_WAIT_MS)
+        parser.add_argument('--ping', action='store_true',
+                            help="Health-check a running service and exit non-zero if it does not answer.")
+
+    def handle(self, *args, **options):
+        path = options['socket']
+        if not path:
+            raise CommandError("Set INFERENCE_SERVICE_SOCKET or pass --socket.")
+
+        if options['ping']:
+            try:
+                health = InferenceClient(path, timeout=settings.INFERENCE_SERVICE_TIMEOUT).ping()
+            except InferenceUnavailable as e:
+                raise CommandError(f"Inference service on {path} is down: {e}")
+            self.stdout.write(json.dumps(health))
+            return
+
+        if os.path.exists(path):
+            os.unlink(path)  # stale socket from a previous run
+
+        # Importing inference already started the registry watcher (MODEL_REGISTRY_POLL_INTERVAL)
+        inference.registry.ensure_loaded()
+        batcher = inference.MicroBatcher(
+            score_fn=score_rows,
+            max_batch_size=options['max_batch_size'],
+            max_wait=options['max_wait_ms'] / 1000.0,
+        )
+
+        server = InferenceServer(path, batcher)
+        os.chmod(path, 0o660)
+        self.stdout.write(f"Serving {inference.INFERENCE_BACKEND} model "
+                          f"{inference.model_version()} on {path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.unlink(path)
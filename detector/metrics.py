@@ -0,0 +1,109 @@
+"""
+Low-overhead latency metrics for the ESP32 recommendation path.
+
+Each stage has a histogram with fixed bucket bounds whose counts live in a
+preallocated ``array``, so recording a sample is a bisect plus three in-place
+increments.  Updates are not locked: under contention a sample may be lost,
+which is acceptable for monitoring and keeps the hot path cheap.  Metrics are
+per process; scrape every worker.
+"""
+import logging
+import random
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+
+logger = logging.getLogger('detector.slow_requests')
+
+# Seconds
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# Rows per model call
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096, 16384)
+
+STAGES = ('decode', 'transform', 'predict', 'top_k', 'inference', 'serialize', 'total')
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.bounds = buckets
+        self.counts = array('Q', bytes(8 * (len(buckets) + 1)))
+        self.sum = array('d', [0.0])
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum[0] += value
+
+    def samples(self):
+        """Cumulative ``(le, count)`` pairs, Prometheus style."""
+        total = 0
+        for bound, count in zip(self.bounds + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+
+stage_seconds = {stage: Histogram(LATENCY_BUCKETS) for stage in STAGES}
+batch_rows = Histogram(BATCH_BUCKETS)
+
+
+def observe(stage, seconds):
+    stage_seconds[stage].observe(seconds)
+
+
+def record_request(endpoint, shape, model_version, start, decoded, inferred, done):
+    """
+    Record the request-level stages from ``time.perf_counter()`` marks and log
+    a sample of requests slower than METRICS_SLOW_REQUEST_SECONDS.
+    """
+    total = done - start
+    stage_seconds['decode'].observe(decoded - start)
+    stage_seconds['inference'].observe(inferred - decoded)
+    stage_seconds['serialize'].observe(done - inferred)
+    stage_seconds['total'].observe(total)
+
+    if total < getattr(settings, 'METRICS_SLOW_REQUEST_SECONDS', 0.25):
+        return
+    if random.random() >= getattr(settings, 'METRICS_SLOW_REQUEST_SAMPLE_RATE', 0.1):
+        return
+    logger.warning(
+        "Slow %s request: %.1f ms (decode %.2f, inference %.2f, serialize %.2f), input shape %s, model %s",
+        endpoint, total * 1000, (decoded - start) * 1000, (inferred - decoded) * 1000,
+        (done - inferred) * 1000, shape, model_version,
+    )
+
+
+def _format_histogram(lines, name, histogram, labels=''):
+    for bound, count in histogram.samples():
+        le = bound if isinstance(bound, str) else repr(float(bound))
+        lines.append(f'{name}_bucket{{{labels}le="{le}"}} {count}')
+    suffix = f'{{{labels.rstrip(",")}}}' if labels else ''
+    lines.append(f'{name}_sum{suffix} {histogram.sum[0]}')
+    lines.append(f'{name}_count{suffix} {sum(histogram.counts)}')
+
+
+def render(counters=()):
+    """
+    Text exposition format of every histogram plus ``counters``, an iterable
+    of ``(name, type, help, value)`` gathered by the caller.
+    """
+    lines = [
+        '# HELP soilution_stage_seconds Time spent in each stage of the ESP32 recommendation path.',
+        '# TYPE soilution_stage_seconds histogram',
+    ]
+    for stage, histogram in stage_seconds.items():
+        _format_histogram(lines, 'soilution_stage_seconds', histogram, f'stage="{stage}",')
+
+    lines += [
+        '# HELP soilution_batch_rows Rows scored per model call.',
+        '# TYPE soilution_batch_rows histogram',
+    ]
+    _format_histogram(lines, 'soilution_batch_rows', batch_rows)
+
+    # Labeled samples of one family share a single HELP / TYPE and must be contiguous
+    families = {}
+    for name, kind, help_text, value in counters:
+        base = name.split('{', 1)[0]
+        families.setdefault(base, (kind, help_text, []))[2].append(f'{name} {value}')
+    for base, (kind, help_text, samples) in families.items():
+        lines += [f'# HELP {base} {help_text}', f'# TYPE {base} {kind}', *samples]
+    return '\n'.join(lines) + '\n'
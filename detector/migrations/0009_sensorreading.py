@@ -0,0 +1,38 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0008_message'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SensorReading',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_id', models.CharField(blank=True, max_length=64)),
+                ('timestamp', models.DateTimeField()),
+                ('nitrogen', models.FloatField()),
+                ('phosphorus', models.FloatField()),
+                ('potassium', models.FloatField()),
+                ('temperature', models.FloatField()),
+                ('moisture', models.FloatField()),
+                ('ph', models.FloatField()),
+                ('conductivity', models.FloatField()),
+                ('top_crop', models.CharField(max_length=50)),
+                ('top_probability', models.FloatField()),
+                ('model_version', models.CharField(blank=True, max_length=64)),
+                ('workspace', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='readings', to='detector.workspace')),
+            ],
+            options={
+                'ordering': ['-timestamp'],
+                'indexes': [
+                    models.Index(fields=['workspace', 'timestamp'], name='reading_workspace_time_idx'),
+                    models.Index(fields=['workspace', 'device_id', 'timestamp'], name='reading_device_time_idx'),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,62 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0009_sensorreading'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CropRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('5m', '5 minutes'), ('1h', 'Hourly'), ('1d', 'Daily')], max_length=2)),
+                ('bucket_start', models.DateTimeField()),
+                ('crop', models.CharField(max_length=50)),
+                ('count', models.PositiveIntegerField()),
+                ('workspace', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='crop_rollups', to='detector.workspace')),
+            ],
+            options={
+                'ordering': ['bucket_start'],
+                'constraints': [models.UniqueConstraint(fields=('workspace', 'resolution', 'bucket_start', 'crop'), name='unique_crop_rollup')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ReadingRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('5m', '5 minutes'), ('1h', 'Hourly'), ('1d', 'Daily')], max_length=2)),
+                ('bucket_start', models.DateTimeField()),
+                ('count', models.PositiveIntegerField()),
+                ('nitrogen_min', models.FloatField()),
+                ('nitrogen_max', models.FloatField()),
+                ('nitrogen_sum', models.FloatField()),
+                ('phosphorus_min', models.FloatField()),
+                ('phosphorus_max', models.FloatField()),
+                ('phosphorus_sum', models.FloatField()),
+                ('potassium_min', models.FloatField()),
+                ('potassium_max', models.FloatField()),
+                ('potassium_sum', models.FloatField()),
+                ('temperature_min', models.FloatField()),
+                ('temperature_max', models.FloatField()),
+                ('temperature_sum', models.FloatField()),
+                ('moisture_min', models.FloatField()),
+                ('moisture_max', models.FloatField()),
+                ('moisture_sum', models.FloatField()),
+                ('ph_min', models.FloatField()),
+                ('ph_max', models.FloatField()),
+                ('ph_sum', models.FloatField()),
+                ('conductivity_min', models.FloatField()),
+                ('conductivity_max', models.FloatField()),
+                ('conductivity_sum', models.FloatField()),
+                ('workspace', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='reading_rollups', to='detector.workspace')),
+            ],
+            options={
+                'ordering': ['bucket_start'],
+                'constraints': [models.UniqueConstraint(fields=('workspace', 'resolution', 'bucket_start'), name='unique_reading_rollup')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0010_readingrollup_croprollup'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='sensorreading',
+            name='reading_workspace_time_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='sensorreading',
+            name='reading_device_time_idx',
+        ),
+        migrations.AddIndex(
+            model_name='sensorreading',
+            index=models.Index(fields=['workspace', 'timestamp', 'id'], name='reading_workspace_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sensorreading',
+            index=models.Index(fields=['workspace', 'device_id', 'timestamp', 'id'], name='reading_device_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sensorreading',
+            index=models.Index(fields=['workspace', 'top_crop', 'timestamp', 'id'], name='reading_crop_time_idx'),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0011_sensorreading_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sensorreading',
+            name='anomalies',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0014_message_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChannelMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('channel', models.CharField(max_length=100)),
+                ('payload', models.TextField()),
+                ('expires', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [
+                    models.Index(fields=['channel', 'id'], name='channel_message_queue_idx'),
+                    models.Index(fields=['expires'], name='channel_message_expiry_idx'),
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name='ChannelGroupMembership',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('group', models.CharField(max_length=100)),
+                ('channel', models.CharField(max_length=100)),
+                ('expires', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['expires'], name='channel_group_expiry_idx')],
+                'constraints': [
+                    models.UniqueConstraint(fields=('group', 'channel'), name='unique_channel_group_membership'),
+                ],
+            },
+        ),
+    ]
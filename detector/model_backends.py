@@ -0,0 +1,167 @@
+"""
+Crop model backends.
+
+Every backend takes raw readings, a (n, 7) float32 matrix in
+``readings.FEATURES`` order, and returns (n, classes) probabilities from
+``predict_proba``, which is ``predict(transform(rows))`` so the scaling and
+model stages can be timed separately.
+
+``KerasBackend`` runs the saved .keras model.  ``NumpyBackend`` runs the same
+network from the weights written by ``manage.py export_numpy_model``, so a
+worker using it never imports TensorFlow.
+"""
+import os
+
+import numpy as np
+
+ML_DIR = os.path.join(os.path.dirname(__file__), 'ml_models')
+MODEL_PATH = os.path.join(ML_DIR, 'crop_recommendation_model_v3.keras')
+SCALER_PATH = os.path.join(ML_DIR, 'scaler.pkl')
+NUMPY_MODEL_PATH = os.path.join(ML_DIR, 'crop_recommendation_model_v3.npz')
+
+BACKENDS = ('keras', 'numpy')
+
+
+class KerasBackend:
+    name = 'keras'
+
+    def __init__(self, model_path=MODEL_PATH, scaler_path=SCALER_PATH):
+        import joblib
+        from tensorflow import keras
+
+        self.model = keras.models.load_model(model_path)
+        self.scaler = joblib.load(scaler_path)
+
+    def transform(self, rows):
+        return self.scaler.transform(rows)
+
+    def predict(self, scaled):
+        # predict_on_batch skips the tf.data pipeline that predict() builds on every call
+        return np.asarray(self.model.predict_on_batch(scaled))
+
+    def predict_proba(self, rows):
+        return self.predict(self.transform(rows))
+
+
+def relu(x):
+    return np.maximum(x, 0, out=x)
+
+
+def sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def softmax(x):
+    x -= x.max(axis=1, keepdims=True)
+    np.exp(x, out=x)
+    x /= x.sum(axis=1, keepdims=True)
+    return x
+
+
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': relu,
+    'sigmoid': sigmoid,
+    'tanh': np.tanh,
+    'softmax': softmax,
+}
+
+
+class NumpyBackend:
+    name = 'numpy'
+
+    def __init__(self, npz_path=NUMPY_MODEL_PATH):
+        with np.load(npz_path) as data:
+            self.scale = data['scaler_scale']
+            self.offset = data['scaler_offset']
+            self.layers = [
+                (data[f'kernel_{i}'], data[f'bias_{i}'], ACTIVATIONS[str(data[f'activation_{i}'])])
+                for i in range(int(data['layer_count']))
+            ]
+
+    def transform(self, rows):
+        return np.asarray(rows, dtype=np.float32) * self.scale + self.offset
+
+    def predict(self, x):
+        for kernel, bias, activation in self.layers:
+            x = x @ kernel
+            x += bias
+            x = activation(x)
+        return x
+
+    def predict_proba(self, rows):
+        return self.predict(self.transform(rows))
+
+
+def load_backend(name):
+    if name == 'numpy':
+        return NumpyBackend()
+    if name == 'keras':
+        return KerasBackend()
+    raise ValueError(f"Unknown inference backend '{name}', expected one of {BACKENDS}")
+
+
+def scaler_affine(scaler):
+    """Express a fitted MinMaxScaler/StandardScaler as ``x * scale + offset``."""
+    if hasattr(scaler, 'min_'):
+        return scaler.scale_, scaler.min_
+    if hasattr(scaler, 'mean_'):
+        return 1.0 / scaler.scale_, -scaler.mean_ / scaler.scale_
+    raise ValueError(f"Unsupported scaler {type(scaler).__name__}")
+
+
+def export_numpy(model, scaler, path):
+    """
+    Write the dense layers of a Keras Sequential model to ``path`` as .npz.
+
+    Dropout is dropped (inference only) and each BatchNormalization is folded
+    into the kernel and bias of the Dense layer that follows it, so the NumPy
+    forward pass is just one matmul + bias + activation per layer.
+    """
+    arrays = {}
+    count = 0
+    pending = None  # (scale, shift) of a BatchNormalization not yet folded
+
+    for layer in model.layers:
+        kind = type(layer).__name__
+        if kind in ('InputLayer', 'Dropout'):
+            continue
+        if kind == 'BatchNormalization':
+            config = layer.get_config()
+            gamma, beta, mean, variance = layer.get_weights()
+            scale = gamma / np.sqrt(variance + config['epsilon'])
+            pending = (scale, beta - mean * scale)
+            continue
+        if kind != 'Dense':
+            raise ValueError(f"Layer {layer.name} ({kind}) is not supported by the NumPy backend")
+
+        kernel, bias = layer.get_weights()
+        if pending is not None:
+            scale, shift = pending
+            bias = shift @ kernel + bias
+            kernel = scale[:, np.newaxis] * kernel
+            pending = None
+        arrays[f'kernel_{count}'] = kernel.astype(np.float32)
+        arrays[f'bias_{count}'] = bias.astype(np.float32)
+        arrays[f'activation_{count}'] = np.array(layer.get_config()['activation'])
+        count += 1
+
+    if pending is not None:
+        raise ValueError("A trailing BatchNormalization layer cannot be folded into a Dense layer")
+
+    scale, offset = scaler_affine(scaler)
+    np.savez_compressed(
+        path,
+        layer_count=np.array(count),
+        scaler_scale=np.asarray(scale, dtype=np.float32),
+        scaler_offset=np.asarray(offset, dtype=np.float32),
+        **arrays,
+    )
+
+
+def sample_readings(count, seed=0):
+    """Random but plausible sensor rows, used by the parity check and benchmarks."""
+    rng = np.random.default_rng(seed)
+    low = np.array([0, 5, 5, 10, 10, 3.5, 0], dtype=np.float32)
+    high = np.array([140, 145, 205, 45, 100, 9.5, 3000], dtype=np.float32)
+    return rng.uniform(low, high, size=(count, len(low))).astype(np.float32)
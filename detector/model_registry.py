@@ -0,0 +1,243 @@
+"""
+Versioned model bundles with hot swapping.
+
+A bundle is a directory under ``ml_models/`` holding::
+
+    <version>/model.keras    (or model.npz for the NumPy backend)
+    <version>/scaler.pkl     (Keras backend only)
+    <version>/labels.json    optional list of class labels, in output order
+
+The original flat ``crop_recommendation_model_v3.keras`` + ``scaler.pkl`` pair
+is exposed as bundle ``v3``.  New versions are loaded on a background thread
+and swapped in under a lock; requests hold a reference to the bundle they
+started with, and a replaced bundle is only unloaded once the last of those
+references is released.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from .model_backends import MODEL_PATH, NUMPY_MODEL_PATH, SCALER_PATH, KerasBackend, NumpyBackend
+
+logger = logging.getLogger(__name__)
+
+LEGACY_VERSION = 'v3'
+
+DEFAULT_LABELS = ['apple', 'banana', 'blackgram', 'chickpea', 'coconut', 'coffee', 'cotton', 'grapes',
+                  'jute', 'kidneybeans', 'lentil', 'maize', 'mango', 'mothbeans', 'mungbean', 'muskmelon',
+                  'orange', 'papaya', 'pigeonpeas', 'pomegranate', 'rice', 'watermelon', 'wheat']
+
+
+def file_fingerprint(paths):
+    """Short hash of the size and mtime of each bundle file."""
+    digest = hashlib.sha1()
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            digest.update(f'{path}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+        except OSError:
+            digest.update(f'{path}:missing;'.encode())
+    return digest.hexdigest()[:12]
+
+
+def version_sort_key(version):
+    """Natural ordering so that v10 sorts after v9."""
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', version)]
+
+
+class BundleSpec:
+    """Where a version's files live; cheap to build, nothing is loaded."""
+
+    def __init__(self, version, backend_name, model_path, scaler_path=None, labels_path=None):
+        self.version = version
+        self.backend_name = backend_name
+        self.model_path = model_path
+        self.scaler_path = scaler_path
+        self.labels_path = labels_path
+
+    @property
+    def paths(self):
+        return tuple(p for p in (self.model_path, self.scaler_path, self.labels_path) if p)
+
+    @property
+    def tag(self):
+        """Version plus a fingerprint of its files, so edits in place are noticed."""
+        return f'{self.version}-{file_fingerprint(self.paths)}'
+
+    def labels(self):
+        if self.labels_path:
+            with open(self.labels_path) as f:
+                return json.load(f)
+        return DEFAULT_LABELS
+
+    def load(self):
+        if self.backend_name == 'numpy':
+            backend = NumpyBackend(self.model_path)
+        else:
+            backend = KerasBackend(self.model_path, self.scaler_path)
+        return ModelBundle(self, backend, self.labels())
+
+
+class ModelBundle:
+    def __init__(self, spec, backend, labels):
+        self.spec = spec
+        self.version = spec.version
+        self.tag = spec.tag
+        self.backend = backend
+        self.labels = labels
+        self.refs = 0
+        self.retired = False
+
+    def predict_proba(self, rows):
+        return self.backend.predict_proba(rows)
+
+
+class ModelRegistry:
+    def __init__(self, root, backend_name, pinned_version=None):
+        self.root = root
+        self.backend_name = backend_name
+        self.pinned_version = pinned_version
+        self.active = None
+        self._lock = threading.Lock()
+        self._loading = None
+        self._labels = {}
+        self._watcher = None
+        self.listeners = []  # called with the new bundle after every swap
+
+    def discover(self):
+        """All bundles available for this backend, keyed by version."""
+        specs = {}
+        legacy_model = NUMPY_MODEL_PATH if self.backend_name == 'numpy' else MODEL_PATH
+        if os.path.exists(legacy_model):
+            specs[LEGACY_VERSION] = BundleSpec(
+                LEGACY_VERSION, self.backend_name, legacy_model,
+                SCALER_PATH if self.backend_name == 'keras' else None,
+            )
+        for name in sorted(os.listdir(self.root)):
+            directory = os.path.join(self.root, name)
+            if not os.path.isdir(directory):
+                continue
+            model_file = 'model.npz' if self.backend_name == 'numpy' else 'model.keras'
+            model_path = os.path.join(directory, model_file)
+            scaler_path = os.path.join(directory, 'scaler.pkl')
+            labels_path = os.path.join(directory, 'labels.json')
+            if not os.path.exists(model_path):
+                continue
+            if self.backend_name == 'keras' and not os.path.exists(scaler_path):
+                continue
+            specs[name] = BundleSpec(
+                name, self.backend_name, model_path,
+                scaler_path if self.backend_name == 'keras' else None,
+                labels_path if os.path.exists(labels_path) else None,
+            )
+        return specs
+
+    def target(self):
+        """The bundle that should be active: the pinned version, else the newest one."""
+        specs = self.discover()
+        if self.pinned_version:
+            return specs.get(self.pinned_version)
+        if not specs:
+            return None
+        return specs[max(specs, key=version_sort_key)]
+
+    def labels(self, tag):
+        """Labels of a bundle by tag, without loading its model (e.g. for inference service results)."""
+        active = self.active
+        if active is not None and active.tag == tag:
+            return active.labels
+        if tag not in self._labels:
+            specs = [spec for spec in self.discover().values() if spec.tag == tag]
+            self._labels[tag] = specs[0].labels() if specs else DEFAULT_LABELS
+        return self._labels[tag]
+
+    def ensure_loaded(self):
+        """Load the target bundle synchronously if nothing is active yet."""
+        if self.active is None:
+            with self._lock:
+                if self.active is None:
+                    spec = self.target()
+                    if spec is None:
+                        raise FileNotFoundError(f'No {self.backend_name} model bundle under {self.root}')
+                    self.active = spec.load()
+                    logger.info("Loaded model %s", self.active.tag)
+        return self.active
+
+    @contextmanager
+    def acquire(self):
+        """Hold the active bundle for the duration of one batch."""
+        self.ensure_loaded()
+        with self._lock:
+            bundle = self.active
+            bundle.refs += 1
+        try:
+            yield bundle
+        finally:
+            with self._lock:
+                bundle.refs -= 1
+                if bundle.retired and bundle.refs == 0:
+                    self._unload(bundle)
+
+    def _activate(self, bundle):
+        with self._lock:
+            old, self.active = self.active, bundle
+            if old is not None:
+                old.retired = True
+                if old.refs == 0:
+                    self._unload(old)
+        logger.info("Activated model %s", bundle.tag)
+        for listener in self.listeners:
+            listener(bundle)
+
+    def _unload(self, bundle):
+        bundle.backend = None
+        logger.info("Unloaded model %s", bundle.tag)
+
+    def refresh(self):
+        """
+        Load the target bundle in the background if it differs from the active
+        one.  Requests keep using the active bundle until the swap.
+        """
+        if self.active is None:
+            return False  # nothing loaded in this process (e.g. the inference service is used)
+        spec = self.target()
+        if spec is None or spec.tag == self.active.tag:
+            return False
+        if self._loading is not None and self._loading.is_alive():
+            return False
+
+        def load():
+            try:
+                self._activate(spec.load())
+            except Exception:
+                logger.exception("Failed to load model %s; keeping %s", spec.version, self.active.tag)
+
+        self._loading = threading.Thread(target=load, name=f'model-load-{spec.version}', daemon=True)
+        self._loading.start()
+        return True
+
+    def watch(self, interval):
+        """
+        Poll for new bundles every ``interval`` seconds on a daemon thread.
+        Only the first call starts one: two watchers would race on swaps and
+        notify the listeners twice.
+        """
+        with self._lock:
+            if self._watcher is not None:
+                return
+            self._watcher = threading.Thread(target=self._watch, args=(interval,), name='model-registry-watch',
+                                             daemon=True)
+        self._watcher.start()
+
+    def _watch(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.refresh()
+            except OSError:
+                logger.exception("Model registry refresh failed")
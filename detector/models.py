@@ -39,14 +39,184 @@ class Profile(models.Model):
         return self.profile_image
 
 class Message(models.Model):
-    sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
-    receiver = models.ForeignKey(User, on_delete=models.CASCADE, related_name='received_messages')
+    # No single-column FK indexes: each is the prefix of a composite index below
+    sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages', db_index=False)
+    receiver = models.ForeignKey(User, on_delete=models.CASCADE, related_name='received_messages', db_index=False)
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
 
     class Meta:
         ordering = ['-timestamp']
+        # Check plans with: python manage.py explain_messages
+        indexes = [
+            # Recent messages of an inbox (context processor, dropdown)
+            models.Index(fields=['receiver', '-timestamp'], name='message_inbox_time_idx'),
+            # Latest unread / read messages of an inbox
+            models.Index(fields=['receiver', 'is_read', '-timestamp'], name='message_inbox_read_idx'),
+            # Thread pages between two users, keyset on id (both directions)
+            models.Index(fields=['sender', 'receiver', '-id'], name='message_pair_idx'),
+            # Unread counts and mark-read; only unread rows are indexed (PostgreSQL, SQLite)
+            models.Index(fields=['receiver', 'sender'], condition=models.Q(is_read=False),
+                         name='message_unread_idx'),
+        ]
 
     def __str__(self):
         return f'Message from {self.sender} to {self.receiver}'
+
+class Conversation(models.Model):
+    """
+    One row per (user, counterpart) pair, kept in step with Message by
+    detector.inbox so the inbox list is a single query.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversations', db_index=False)
+    counterpart = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    last_message = models.ForeignKey(Message, on_delete=models.SET_NULL, null=True, related_name='+')
+    last_sender = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='+')
+    preview = models.CharField(max_length=100, blank=True)
+    last_timestamp = models.DateTimeField()
+    unread_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'counterpart'], name='unique_conversation'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-last_timestamp'], name='conversation_inbox_idx'),
+        ]
+
+    def __str__(self):
+        return f'Conversation of {self.user} with {self.counterpart}'
+
+# SensorReading columns, in readings.FEATURES order
+MEASUREMENT_FIELDS = ('nitrogen', 'phosphorus', 'potassium', 'temperature', 'moisture', 'ph', 'conductivity')
+
+class SensorReading(models.Model):
+    # Not indexed on its own: every query filters on workspace and a time range,
+    # which the (workspace, timestamp) index serves
+    workspace = models.ForeignKey(Workspace, related_name='readings', on_delete=models.CASCADE, db_index=False)
+    device_id = models.CharField(max_length=64, blank=True)
+    timestamp = models.DateTimeField()
+    nitrogen = models.FloatField()
+    phosphorus = models.FloatField()
+    potassium = models.FloatField()
+    temperature = models.FloatField()
+    moisture = models.FloatField()
+    ph = models.FloatField()
+    conductivity = models.FloatField()
+    top_crop = models.CharField(max_length=50)
+    top_probability = models.FloatField()
+    model_version = models.CharField(max_length=64, blank=True)
+    # Sensors flagged by the anomaly detector, e.g. 'pH:stuck,conductivity:spike'
+    anomalies = models.CharField(max_length=200, blank=True)
+
+    class Meta:
+        ordering = ['-timestamp']
+        # id is the tie-breaker of the (timestamp, id) keyset used by the logs API
+        indexes = [
+            models.Index(fields=['workspace', 'timestamp', 'id'], name='reading_workspace_time_idx'),
+            models.Index(fields=['workspace', 'device_id', 'timestamp', 'id'], name='reading_device_time_idx'),
+            models.Index(fields=['workspace', 'top_crop', 'timestamp', 'id'], name='reading_crop_time_idx'),
+        ]
+
+    def __str__(self):
+        return f'Reading from {self.device_id or "unknown device"} at {self.timestamp}'
+
+class Device(models.Model):
+    """
+    A sensor device allowed to store readings in a workspace.  It proves who
+    it is with a random key, of which only the SHA-256 hash is kept.
+    """
+    workspace = models.ForeignKey(Workspace, related_name='devices', on_delete=models.CASCADE, db_index=False)
+    device_id = models.CharField(max_length=64)
+    key_hash = models.CharField(max_length=64, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['workspace', 'device_id'], name='unique_workspace_device'),
+        ]
+
+    def __str__(self):
+        return f'Device {self.device_id} of {self.workspace}'
+
+ROLLUP_RESOLUTIONS = [('5m', '5 minutes'), ('1h', 'Hourly'), ('1d', 'Daily')]
+
+class ReadingRollup(models.Model):
+    """Per-workspace min/max/sum of every measurement over one time bucket."""
+    workspace = models.ForeignKey(Workspace, related_name='reading_rollups', on_delete=models.CASCADE, db_index=False)
+    resolution = models.CharField(max_length=2, choices=ROLLUP_RESOLUTIONS)
+    bucket_start = models.DateTimeField()
+    count = models.PositiveIntegerField()
+    nitrogen_min = models.FloatField()
+    nitrogen_max = models.FloatField()
+    nitrogen_sum = models.FloatField()
+    phosphorus_min = models.FloatField()
+    phosphorus_max = models.FloatField()
+    phosphorus_sum = models.FloatField()
+    potassium_min = models.FloatField()
+    potassium_max = models.FloatField()
+    potassium_sum = models.FloatField()
+    temperature_min = models.FloatField()
+    temperature_max = models.FloatField()
+    temperature_sum = models.FloatField()
+    moisture_min = models.FloatField()
+    moisture_max = models.FloatField()
+    moisture_sum = models.FloatField()
+    ph_min = models.FloatField()
+    ph_max = models.FloatField()
+    ph_sum = models.FloatField()
+    conductivity_min = models.FloatField()
+    conductivity_max = models.FloatField()
+    conductivity_sum = models.FloatField()
+
+    class Meta:
+        ordering = ['bucket_start']
+        constraints = [
+            models.UniqueConstraint(fields=['workspace', 'resolution', 'bucket_start'], name='unique_reading_rollup'),
+        ]
+
+    def mean(self, field):
+        return getattr(self, f'{field}_sum') / self.count if self.count else None
+
+class CropRollup(models.Model):
+    """How often each crop was the top prediction in a workspace over one time bucket."""
+    workspace = models.ForeignKey(Workspace, related_name='crop_rollups', on_delete=models.CASCADE, db_index=False)
+    resolution = models.CharField(max_length=2, choices=ROLLUP_RESOLUTIONS)
+    bucket_start = models.DateTimeField()
+    crop = models.CharField(max_length=50)
+    count = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ['bucket_start']
+        constraints = [
+            models.UniqueConstraint(fields=['workspace', 'resolution', 'bucket_start', 'crop'],
+                                    name='unique_crop_rollup'),
+        ]
+
+class ChannelMessage(models.Model):
+    """A message queued on a channel by detector.channel_layer.DatabaseChannelLayer."""
+    channel = models.CharField(max_length=100)
+    payload = models.TextField()
+    expires = models.DateTimeField()
+
+    class Meta:
+        # Receivers take the oldest live message of their channel
+        indexes = [
+            models.Index(fields=['channel', 'id'], name='channel_message_queue_idx'),
+            models.Index(fields=['expires'], name='channel_message_expiry_idx'),
+        ]
+
+class ChannelGroupMembership(models.Model):
+    """A channel's membership of a group, renewed by every group_add."""
+    group = models.CharField(max_length=100)
+    channel = models.CharField(max_length=100)
+    expires = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['group', 'channel'], name='unique_channel_group_membership'),
+        ]
+        indexes = [
+            models.Index(fields=['expires'], name='channel_group_expiry_idx'),
+        ]
@@ -0,0 +1,165 @@
+"""
+Prediction cache for repeated soil readings.
+
+Readings are quantized to each sensor's resolution before being used as a
+key, so two readings the probes cannot tell apart share one cached top-5.
+Keys also carry the model version, so swapping the model or scaler makes
+every old entry unreachable.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+
+from .readings import FEATURES
+
+# Smallest step each probe reports, in FEATURES order
+DEFAULT_RESOLUTION = {
+    'nitrogen': 1.0,       # mg/kg
+    'phosphorus': 1.0,     # mg/kg
+    'potassium': 1.0,      # mg/kg
+    'temperature': 0.1,    # °C
+    'moisture': 0.1,       # %
+    'pH': 0.01,
+    'conductivity': 1.0,   # µS/cm
+}
+
+
+class PredictionCache:
+    """
+    Bounded LRU + TTL cache of top-5 recommendations.
+
+    ``backend='local'`` keeps entries in this process; ``backend='django'``
+    stores them through Django's cache framework (``alias``) so every worker
+    shares the same hits.  ``version_fn`` returns the current model version; it
+    is polled at most every ``check_interval`` seconds and any change drops the
+    local entries and moves shared ones to a new key prefix.
+    """
+
+    def __init__(self, version_fn, resolution=None, max_entries=10000, ttl=300,
+                 backend='local', alias='default', check_interval=5.0):
+        resolution = {**DEFAULT_RESOLUTION, **(resolution or {})}
+        self.step = np.array([resolution[name] for name in FEATURES], dtype=np.float64)
+        self.version_fn = version_fn
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.backend = backend
+        self.alias = alias
+        self.check_interval = check_interval
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = version_fn()
+        self._checked_at = time.monotonic()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def key(self, row):
+        quantized = np.rint(np.asarray(row, dtype=np.float64) / self.step).astype(np.int64)
+        return f'pred:{self._current_version()}:{quantized.tobytes().hex()}'
+
+    def _current_version(self):
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            version = self.version_fn()
+            if version != self._version:
+                self.invalidate(version)
+        return self._version
+
+    def invalidate(self, version=None):
+        with self._lock:
+            self._entries.clear()
+            self._version = version if version is not None else self.version_fn()
+            self.invalidations += 1
+
+    def get(self, row):
+        key = self.key(row)
+        if self.backend == 'django':
+            value = caches[self.alias].get(key)
+        else:
+            value = self._local_get(key)
+        self._count(value)
+        return value
+
+    def set(self, row, value):
+        key = self.key(row)
+        if self.backend == 'django':
+            caches[self.alias].set(key, value, self.ttl)
+        else:
+            self._local_set(key, value)
+
+    async def aget(self, row):
+        if self.backend != 'django':
+            return self.get(row)
+        value = await caches[self.alias].aget(self.key(row))
+        self._count(value)
+        return value
+
+    async def aset(self, row, value):
+        if self.backend != 'django':
+            return self.set(row, value)
+        await caches[self.alias].aset(self.key(row), value, self.ttl)
+
+    def _count(self, value):
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+    def _local_get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _local_set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': self.backend,
+            'version': self._version,
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+        }
+
+
+def build_cache(version_fn):
+    """The cache configured in settings, or None when PREDICTION_CACHE_BACKEND is 'off'."""
+    backend = getattr(settings, 'PREDICTION_CACHE_BACKEND', 'local')
+    if backend == 'off':
+        return None
+    return PredictionCache(
+        version_fn,
+        resolution=getattr(settings, 'PREDICTION_CACHE_RESOLUTION', None),
+        max_entries=getattr(settings, 'PREDICTION_CACHE_MAX_ENTRIES', 10000),
+        ttl=getattr(settings, 'PREDICTION_CACHE_TTL', 300),
+        backend=backend,
+        alias=getattr(settings, 'PREDICTION_CACHE_ALIAS', 'default'),
+    )
@@ -0,0 +1,193 @@
+"""
+Token-bucket admission control for the ESP32 ingest endpoints.
+
+Every request spends one token from its device's bucket and one from a
+global bucket, before the body is read.  Once a batch's rows are counted it
+spends one more token per RATE_LIMIT_ROWS_PER_TOKEN rows beyond the first
+(at most ``burst`` in all), so a 10,000-row batch costs more than a single
+reading.  The device WebSocket is metered the same way, per frame.  A bucket
+holds at most ``burst`` tokens and refills at ``rate`` tokens per second; a
+request that finds its bucket empty is shed with 429 and a Retry-After of
+when the tokens will be available.
+
+Buckets are kept in GCRA form (one "theoretical arrival time" per bucket),
+which behaves exactly like a token bucket but needs a single float of state.
+``LocalBucketStore`` keeps them in this process; ``CacheBucketStore`` keeps
+them in Django's cache so limits hold across workers.  The cache store reads
+and writes without a lock, so under heavy contention a few extra requests
+may get through; the limits are approximate, not exact.
+
+A request presenting a registered device key (see devices) spends from
+that device's bucket; any other request spends from its client address's.
+Device ids the client merely declares are never trusted: otherwise a client
+could rotate them for fresh buckets, or drain a real device's.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+
+from . import devices
+
+
+def _gcra(tat, now, rate, burst, cost=1):
+    """``(new tat, retry_after)`` for spending ``cost`` tokens; retry_after is 0 when they are spent."""
+    interval = 1.0 / rate
+    tat = max(tat, now)
+    allowed_at = tat + cost * interval - burst * interval
+    if allowed_at > now:
+        return None, allowed_at - now
+    return tat + cost * interval, 0.0
+
+
+class LocalBucketStore:
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._tats = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def atake(self, key, rate, burst, cost=1):
+        now = time.monotonic()
+        with self._lock:
+            tat, retry_after = _gcra(self._tats.get(key, now), now, rate, burst, cost)
+            if tat is not None:
+                self._tats[key] = tat
+                self._tats.move_to_end(key)
+                # A forgotten bucket is simply full again
+                while len(self._tats) > self.max_keys:
+                    self._tats.popitem(last=False)
+        return retry_after
+
+
+class CacheBucketStore:
+    def __init__(self, alias='default'):
+        self.alias = alias
+
+    async def atake(self, key, rate, burst, cost=1):
+        cache = caches[self.alias]
+        now = time.time()
+        cache_key = f'bucket:{key}'
+        tat, retry_after = _gcra(await cache.aget(cache_key, now), now, rate, burst, cost)
+        if tat is not None:
+            # Keep the entry until the bucket would be full again anyway
+            await cache.aset(cache_key, tat, timeout=math.ceil(tat - now + burst / rate) + 1)
+        return retry_after
+
+
+class AdmissionController:
+    def __init__(self, store, device_rate, device_burst, global_rate, global_burst, rows_per_token=100):
+        self.store = store
+        self.device_rate = device_rate
+        self.device_burst = device_burst
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.rows_per_token = rows_per_token
+
+        self.admitted = 0
+        self.shed_device = 0
+        self.shed_global = 0
+
+    async def _atake(self, device_key, cost):
+        # Device first, so a runaway device is shed without draining the global bucket.
+        # A cost above a bucket's burst could never be paid, so it is capped there.
+        retry_after = await self.store.atake(f'device:{device_key}', self.device_rate, self.device_burst,
+                                             min(cost, self.device_burst))
+        if retry_after:
+            self.shed_device += 1
+            return retry_after
+        if self.global_rate:
+            retry_after = await self.store.atake('global', self.global_rate, self.global_burst,
+                                                 min(cost, self.global_burst))
+            if retry_after:
+                self.shed_global += 1
+                return retry_after
+        return 0.0
+
+    async def aadmit(self, device_key, cost=1):
+        """Seconds until the request may be retried, or 0 if it is admitted."""
+        retry_after = await self._atake(device_key, cost)
+        if not retry_after:
+            self.admitted += 1
+        return retry_after
+
+    def row_cost(self, rows):
+        """Tokens a request carrying ``rows`` readings costs."""
+        return max(1, math.ceil(rows / self.rows_per_token))
+
+    async def acharge_rows(self, device_key, rows, paid=1):
+        """
+        Charge the rest of an admitted request's row cost, ``paid`` tokens
+        having been spent on admission.  Seconds until it may be retried, or 0.
+        """
+        cost = self.row_cost(rows) - paid
+        return await self._atake(device_key, cost) if cost > 0 else 0.0
+
+    def metric_counters(self):
+        return [
+            ('soilution_ingest_admitted_total', 'counter', 'Ingest requests admitted by the rate limiter.',
+             self.admitted),
+            ('soilution_ingest_shed_total{bucket="device"}', 'counter', 'Ingest requests shed with 429.',
+             self.shed_device),
+            ('soilution_ingest_shed_total{bucket="global"}', 'counter', 'Ingest requests shed with 429.',
+             self.shed_global),
+        ]
+
+
+def bucket_key(device, address):
+    """Bucket of a client: its authenticated DeviceIdentity, or its address without one."""
+    if device is not None:
+        return f'{device.workspace_id}:{device.device_id}'
+    return f'addr:{address or "unknown"}'
+
+
+async def arequest_key(request):
+    try:
+        device = await devices.aauthenticate(request.headers.get(devices.KEY_HEADER))
+    except devices.InvalidDeviceKey:
+        device = None  # The view answers 401
+    return bucket_key(device, request.META.get('REMOTE_ADDR'))
+
+
+def build_controller():
+    """The limiter configured in settings, or None when RATE_LIMIT_STORE is 'off'."""
+    store = getattr(settings, 'RATE_LIMIT_STORE', 'local')
+    if store == 'off':
+        return None
+    if store == 'django':
+        store = CacheBucketStore(getattr(settings, 'RATE_LIMIT_CACHE_ALIAS', 'default'))
+    else:
+        store = LocalBucketStore()
+    return AdmissionController(
+        store,
+        device_rate=getattr(settings, 'RATE_LIMIT_DEVICE_RATE', 5.0),
+        device_burst=getattr(settings, 'RATE_LIMIT_DEVICE_BURST', 20),
+        global_rate=getattr(settings, 'RATE_LIMIT_GLOBAL_RATE', 500.0),
+        global_burst=getattr(settings, 'RATE_LIMIT_GLOBAL_BURST', 1000),
+        rows_per_token=getattr(settings, 'RATE_LIMIT_ROWS_PER_TOKEN', 100),
+    )
+
+
+controller = build_controller()
+
+
+def shed_response(retry_after):
+    response = JsonResponse({'status': 'error', 'message': 'Rate limit exceeded.'}, status=429)
+    response['Retry-After'] = str(math.ceil(retry_after))
+    return response
+
+
+def admission_control(view):
+    """Shed over-limit requests to an async ingest view with 429 before the body is touched."""
+    @wraps(view)
+    async def wrapped(request, *args, **kwargs):
+        if controller is not None:
+            retry_after = await controller.aadmit(await arequest_key(request))
+            if retry_after:
+                return shed_response(retry_after)
+        return await view(request, *args, **kwargs)
+    return wrapped
@@ -0,0 +1,159 @@
+"""
+Write-behind buffer for ``SensorReading`` rows.
+
+Ingest views append unsaved readings and return without touching the
+database.  A daemon thread writes everything pending with one ``bulk_create``
+when READING_BUFFER_MAX_ROWS are waiting or READING_BUFFER_MAX_DELAY seconds
+have passed, and ``atexit`` flushes what is left when the server shuts down.
+
+At most READING_BUFFER_MAX_PENDING rows are held in memory; beyond that (for
+example while the database is unreachable) the oldest are dropped and
+counted.  A crash therefore loses at most MAX_DELAY seconds of readings, and
+never more than MAX_PENDING rows.
+"""
+import atexit
+import logging
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+
+from .models import MEASUREMENT_FIELDS, SensorReading, Workspace
+
+logger = logging.getLogger(__name__)
+
+
+def make_reading(workspace_id, device_id, row, recommendations, model_version, timestamp=None, anomalies=''):
+    """An unsaved SensorReading for one scored (7,) row, in readings.FEATURES order."""
+    top = recommendations[0]
+    return SensorReading(
+        workspace_id=workspace_id,
+        device_id=device_id or '',
+        timestamp=timestamp or timezone.now(),
+        top_crop=top['crop_name'],
+        top_probability=top['probability'],
+        model_version=model_version or '',
+        anomalies=anomalies,
+        **dict(zip(MEASUREMENT_FIELDS, map(float, row))),
+    )
+
+
+class ReadingBuffer:
+    def __init__(self, max_rows=500, max_delay=2.0, max_pending=20000, batch_size=1000):
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.listeners = []  # called with the saved readings after every flush
+
+        self.written = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.flushes = 0
+        self.failures = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, readings):
+        with self._lock:
+            self._start()
+            self._pending.extend(readings)
+            overflow = len(self._pending) - self.max_pending
+            for _ in range(max(overflow, 0)):
+                self._pending.popleft()
+            if overflow > 0:
+                self.dropped += overflow
+                logger.warning("Reading buffer full; dropped %d oldest readings", overflow)
+            full = len(self._pending) >= self.max_rows
+        if full:
+            self._wake.set()
+
+    def _start(self):
+        # Started on first use so management commands importing the views do not spawn it
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='reading-buffer', daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.max_delay)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        """Write everything pending; returns the number of rows saved."""
+        with self._flush_lock:
+            with self._lock:
+                rows = list(self._pending)
+                self._pending.clear()
+            if not rows:
+                return 0
+            try:
+                saved = self._write(rows)
+            except DatabaseError:
+                logger.exception("Failed to write %d buffered readings; will retry", len(rows))
+                self.failures += 1
+                self._requeue(rows)
+                return 0
+            finally:
+                close_old_connections()
+
+        self.flushes += 1
+        self.written += len(saved)
+        for listener in self.listeners:
+            try:
+                listener(saved)
+            except Exception:
+                logger.exception("Reading buffer listener failed")
+        return len(saved)
+
+    def _write(self, rows):
+        try:
+            with transaction.atomic():
+                return SensorReading.objects.bulk_create(rows, batch_size=self.batch_size)
+        except IntegrityError:
+            # A workspace was deleted (or never existed) while its readings waited here
+            workspace_ids = {row.workspace_id for row in rows}
+            existing = set(Workspace.objects.filter(id__in=workspace_ids).values_list('id', flat=True))
+            kept = [row for row in rows if row.workspace_id in existing]
+            self.rejected += len(rows) - len(kept)
+            with transaction.atomic():
+                return SensorReading.objects.bulk_create(kept, batch_size=self.batch_size)
+
+    def _requeue(self, rows):
+        """Put failed rows back ahead of newer ones, within the MAX_PENDING bound."""
+        with self._lock:
+            room = self.max_pending - len(self._pending)
+            keep = rows[-room:] if room > 0 else []
+            self.dropped += len(rows) - len(keep)
+            self._pending.extendleft(reversed(keep))
+
+    def metric_counters(self):
+        return [
+            ('soilution_reading_buffer_pending', 'gauge', 'Readings waiting to be written.', len(self._pending)),
+            ('soilution_reading_buffer_written_total', 'counter', 'Readings written to the database.', self.written),
+            ('soilution_reading_buffer_flushes_total', 'counter', 'bulk_create flushes.', self.flushes),
+            ('soilution_reading_buffer_failures_total', 'counter', 'Flushes that failed and were retried.',
+             self.failures),
+            ('soilution_reading_buffer_dropped_total', 'counter', 'Readings dropped because the buffer was full.',
+             self.dropped),
+            ('soilution_reading_buffer_rejected_total', 'counter', 'Readings for workspaces that do not exist.',
+             self.rejected),
+        ]
+
+
+buffer = ReadingBuffer(
+    max_rows=getattr(settings, 'READING_BUFFER_MAX_ROWS', 500),
+    max_delay=getattr(settings, 'READING_BUFFER_MAX_DELAY', 2.0),
+    max_pending=getattr(settings, 'READING_BUFFER_MAX_PENDING', 20000),
+)
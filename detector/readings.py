@@ -0,0 +1,92 @@
+"""
+Sensor reading validation shared by the ESP32 ingest endpoints.
+"""
+import json
+
+import numpy as np
+
+# Column order the model was trained on: [N, P, K, temperature, moisture, pH, conductivity]
+FEATURES = ['nitrogen', 'phosphorus', 'potassium', 'temperature', 'moisture', 'pH', 'conductivity']
+
+
+class ReadingError(ValueError):
+    pass
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def parse_readings(readings):
+    """
+    Validate a list of reading dicts column by column.
+
+    Returns ``(matrix, errors)``: ``matrix`` is (n, 7) float32 in FEATURES order
+    and ``errors`` maps the index of every row that cannot be scored to a
+    message.  Each column is converted in one numpy call; only columns holding
+    a missing or non-numeric value fall back to converting value by value.
+    """
+    n = len(readings)
+    matrix = np.empty((n, len(FEATURES)), dtype=np.float32)
+    errors = {}
+
+    is_object = [isinstance(r, dict) for r in readings]
+    for i, ok in enumerate(is_object):
+        if not ok:
+            errors[i] = 'Reading must be a JSON object.'
+
+    for j, name in enumerate(FEATURES):
+        column = [r.get(name) if ok else None for r, ok in zip(readings, is_object)]
+        try:
+            matrix[:, j] = np.array(column, dtype=np.float32)
+        except (TypeError, ValueError):
+            matrix[:, j] = [_to_float(v) for v in column]
+
+    for i, message in invalid_rows(matrix).items():
+        errors.setdefault(i, message)
+
+    return matrix, errors
+
+
+def invalid_rows(matrix):
+    """``{row index: message}`` for every row of a (n, 7) matrix holding NaN or inf."""
+    invalid = ~np.isfinite(matrix)
+    errors = {}
+    for i in np.flatnonzero(invalid.any(axis=1)):
+        fields = ', '.join(FEATURES[j] for j in np.flatnonzero(invalid[i]))
+        errors[int(i)] = f'Missing or non-numeric field(s): {fields}.'
+    return errors
+
+
+def load_reading_list(body, content_type):
+    """
+    Decode a batch request body into ``(readings, errors)``.
+
+    ``application/x-ndjson`` bodies hold one JSON object per line; a line that
+    does not decode becomes a per-row error instead of failing the batch.
+    Anything else must be a JSON array (or an object with a ``readings`` array).
+    """
+    if content_type.startswith('application/x-ndjson'):
+        readings, errors = [], {}
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                readings.append(json.loads(line))
+            except ValueError as e:
+                errors[len(readings)] = f'Invalid JSON: {e}'
+                readings.append(None)
+        return readings, errors
+
+    try:
+        data = json.loads(body)
+    except ValueError as e:
+        raise ReadingError(f'Invalid JSON: {e}')
+    if isinstance(data, dict):
+        data = data.get('readings')
+    if not isinstance(data, list):
+        raise ReadingError('Expected a JSON array of readings.')
+    return data, {}
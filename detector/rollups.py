@@ -0,0 +1,271 @@
+"""
+Incrementally maintained time-series rollups of stored sensor readings.
+
+Every flush of the reading buffer is folded into per-workspace 5-minute,
+hourly and daily buckets: ``ReadingRollup`` keeps count and min/max/sum per
+measurement (the mean is sum / count) and ``CropRollup`` counts top
+predictions per crop.  Buckets are aligned to local midnight (TIME_ZONE), with
+the UTC offset in force at each reading.
+
+Folding happens after the readings are committed, so a crash between the two
+leaves the rollups short; ``manage.py rebuild_rollups`` recomputes any range
+from the raw rows and can be rerun safely.
+
+Chart queries go through ``sensor_series`` / ``crop_series`` (served by
+``workspace_series_api`` to the dashboard and reports charts), which read the
+finest resolution that still keeps the chart within ``max_points`` buckets.
+Bucket timestamps are returned in local time.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import MEASUREMENT_FIELDS, CropRollup, ReadingRollup, SensorReading
+from .reading_buffer import buffer as reading_buffer
+
+# (resolution, bucket width in seconds), finest first
+RESOLUTIONS = (('5m', 300), ('1h', 3600), ('1d', 86400))
+STATS = ('min', 'max', 'sum')
+STAT_FIELDS = [f'{field}_{stat}' for field in MEASUREMENT_FIELDS for stat in STATS]
+
+
+def local_offsets(epochs):
+    """
+    UTC offset of TIME_ZONE (seconds) in force at each epoch.  Offsets only
+    change on quarter hours, so it is looked up once per distinct quarter hour.
+    """
+    tz = timezone.get_current_timezone()
+    quarters, inverse = np.unique(np.asarray(epochs, dtype=np.int64) // 900, return_inverse=True)
+    offsets = np.array(
+        [int(datetime.fromtimestamp(q * 900, tz=tz).utcoffset().total_seconds()) for q in quarters.tolist()],
+        dtype=np.int64,
+    )
+    return offsets[inverse.reshape(-1)]
+
+
+def bucket_starts(epochs, step):
+    """Start (epoch seconds) of the local-time bucket holding each timestamp."""
+    offsets = local_offsets(epochs)
+    local_starts = (epochs + offsets) // step * step
+    # Back to UTC with the offset at the bucket start, which differs across a DST change
+    return local_starts - local_offsets(local_starts - offsets)
+
+
+def _as_datetime(epoch):
+    return datetime.fromtimestamp(int(epoch), tz=dt_timezone.utc)
+
+
+def aggregate(workspace_ids, epochs, values, crops, step):
+    """
+    Bucket raw readings at one resolution.
+
+    ``workspace_ids`` and ``epochs`` are (n,) int64, ``values`` is (n, 7) in
+    MEASUREMENT_FIELDS order and ``crops`` is (n,) str.  Returns
+    ``(readings, crop_counts)``: ``{(workspace_id, bucket): (count, stats)}``
+    where ``stats`` is a (7, 3) min/max/sum array, and
+    ``{(workspace_id, bucket, crop): count}``.
+    """
+    keys = np.stack([workspace_ids, bucket_starts(epochs, step)], axis=1)
+    unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    n = len(unique)
+
+    counts = np.bincount(inverse, minlength=n)
+    stats = np.empty((n, len(MEASUREMENT_FIELDS), 3))
+    stats[:, :, 0] = np.inf
+    stats[:, :, 1] = -np.inf
+    stats[:, :, 2] = 0.0
+    np.minimum.at(stats[:, :, 0], inverse, values)
+    np.maximum.at(stats[:, :, 1], inverse, values)
+    np.add.at(stats[:, :, 2], inverse, values)
+
+    readings = {
+        (int(ws), int(bucket)): (int(counts[i]), stats[i])
+        for i, (ws, bucket) in enumerate(unique.tolist())
+    }
+
+    crop_names, crop_index = np.unique(crops, return_inverse=True)
+    crop_keys = np.stack([inverse, crop_index.reshape(-1)], axis=1)
+    unique_crops, crop_counts = np.unique(crop_keys, axis=0, return_counts=True)
+    crop_totals = {
+        (int(unique[group][0]), int(unique[group][1]), str(crop_names[crop])): int(count)
+        for (group, crop), count in zip(unique_crops.tolist(), crop_counts.tolist())
+    }
+    return readings, crop_totals
+
+
+def _rollup_fields(count, stats):
+    fields = {'count': count}
+    for j, field in enumerate(MEASUREMENT_FIELDS):
+        for k, stat in enumerate(STATS):
+            fields[f'{field}_{stat}'] = float(stats[j, k])
+    return fields
+
+
+def _merge_readings(resolution, totals):
+    workspace_ids = {ws for ws, _ in totals}
+    starts = {_as_datetime(bucket) for _, bucket in totals}
+    existing = {
+        (row.workspace_id, int(row.bucket_start.timestamp())): row
+        for row in ReadingRollup.objects.select_for_update().filter(
+            resolution=resolution, workspace_id__in=workspace_ids, bucket_start__in=starts,
+        )
+    }
+    created, updated = [], []
+    for (ws, bucket), (count, stats) in totals.items():
+        row = existing.get((ws, bucket))
+        if row is None:
+            created.append(ReadingRollup(workspace_id=ws, resolution=resolution,
+                                         bucket_start=_as_datetime(bucket), **_rollup_fields(count, stats)))
+            continue
+        row.count += count
+        for j, field in enumerate(MEASUREMENT_FIELDS):
+            setattr(row, f'{field}_min', min(getattr(row, f'{field}_min'), float(stats[j, 0])))
+            setattr(row, f'{field}_max', max(getattr(row, f'{field}_max'), float(stats[j, 1])))
+            setattr(row, f'{field}_sum', getattr(row, f'{field}_sum') + float(stats[j, 2]))
+        updated.append(row)
+    ReadingRollup.objects.bulk_create(created)
+    ReadingRollup.objects.bulk_update(updated, ['count', *STAT_FIELDS])
+
+
+def _merge_crops(resolution, totals):
+    workspace_ids = {ws for ws, _, _ in totals}
+    starts = {_as_datetime(bucket) for _, bucket, _ in totals}
+    existing = {
+        (row.workspace_id, int(row.bucket_start.timestamp()), row.crop): row
+        for row in CropRollup.objects.select_for_update().filter(
+            resolution=resolution, workspace_id__in=workspace_ids, bucket_start__in=starts,
+        )
+    }
+    created, updated = [], []
+    for (ws, bucket, crop), count in totals.items():
+        row = existing.get((ws, bucket, crop))
+        if row is None:
+            created.append(CropRollup(workspace_id=ws, resolution=resolution,
+                                      bucket_start=_as_datetime(bucket), crop=crop, count=count))
+        else:
+            row.count += count
+            updated.append(row)
+    CropRollup.objects.bulk_create(created)
+    CropRollup.objects.bulk_update(updated, ['count'])
+
+
+def _columns(readings):
+    workspace_ids = np.fromiter((r.workspace_id for r in readings), dtype=np.int64, count=len(readings))
+    epochs = np.fromiter((int(r.timestamp.timestamp()) for r in readings), dtype=np.int64, count=len(readings))
+    values = np.array([[getattr(r, field) for field in MEASUREMENT_FIELDS] for r in readings], dtype=np.float64)
+    crops = np.array([r.top_crop for r in readings])
+    return workspace_ids, epochs, values, crops
+
+
+def record(readings):
+    """Fold newly saved readings into every resolution (reading buffer listener)."""
+    if not readings:
+        return
+    columns = _columns(readings)
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                for resolution, step in RESOLUTIONS:
+                    totals, crop_totals = aggregate(*columns, step)
+                    _merge_readings(resolution, totals)
+                    _merge_crops(resolution, crop_totals)
+            return
+        except IntegrityError:
+            # Another worker created one of the same buckets first; its rows exist now
+            if attempt:
+                raise
+
+
+reading_buffer.listeners.append(record)
+
+
+def rebuild(workspace_id=None, since=None, until=None):
+    """
+    Recompute rollups from raw readings, one local day at a time.
+
+    Every bucket of each day in [since, until) that has readings is replaced,
+    so rerunning over the same range gives the same result.  Returns the number of days rebuilt.
+    """
+    readings = SensorReading.objects.all()
+    if workspace_id is not None:
+        readings = readings.filter(workspace_id=workspace_id)
+    if since is not None:
+        since = timezone.localtime(since).replace(hour=0, minute=0, second=0, microsecond=0)
+        readings = readings.filter(timestamp__gte=since)
+    # ``until`` only selects days; each selected day is always rebuilt whole
+    in_range = readings.filter(timestamp__lt=until) if until is not None else readings
+
+    days = 0
+    for day in in_range.datetimes('timestamp', 'day', tzinfo=timezone.get_current_timezone()):
+        end = day + timedelta(days=1)
+        rows = list(
+            readings.filter(timestamp__gte=day, timestamp__lt=end)
+            .order_by()
+            .values_list('workspace_id', 'timestamp', *MEASUREMENT_FIELDS, 'top_crop')
+        )
+        workspace_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        epochs = np.array([int(row[1].timestamp()) for row in rows], dtype=np.int64)
+        values = np.array([row[2:-1] for row in rows], dtype=np.float64)
+        crops = np.array([row[-1] for row in rows])
+
+        with transaction.atomic():
+            for resolution, step in RESOLUTIONS:
+                stale = {'resolution': resolution, 'bucket_start__gte': day, 'bucket_start__lt': end}
+                if workspace_id is not None:
+                    stale['workspace_id'] = workspace_id
+                ReadingRollup.objects.filter(**stale).delete()
+                CropRollup.objects.filter(**stale).delete()
+
+                totals, crop_totals = aggregate(workspace_ids, epochs, values, crops, step)
+                ReadingRollup.objects.bulk_create([
+                    ReadingRollup(workspace_id=ws, resolution=resolution, bucket_start=_as_datetime(bucket),
+                                  **_rollup_fields(count, stats))
+                    for (ws, bucket), (count, stats) in totals.items()
+                ], batch_size=1000)
+                CropRollup.objects.bulk_create([
+                    CropRollup(workspace_id=ws, resolution=resolution, bucket_start=_as_datetime(bucket),
+                               crop=crop, count=count)
+                    for (ws, bucket, crop), count in crop_totals.items()
+                ], batch_size=1000)
+        days += 1
+    return days
+
+
+def choose_resolution(start, end, max_points=500):
+    """The finest resolution that covers [start, end) in at most ``max_points`` buckets."""
+    span = (end - start).total_seconds()
+    for resolution, step in RESOLUTIONS:
+        if span / step <= max_points:
+            return resolution
+    return RESOLUTIONS[-1][0]
+
+
+def sensor_series(workspace, start, end, max_points=500, fields=MEASUREMENT_FIELDS):
+    """``(resolution, points)`` where each point has the bucket start, count and min/max/mean per field."""
+    resolution = choose_resolution(start, end, max_points)
+    rows = ReadingRollup.objects.filter(
+        workspace=workspace, resolution=resolution, bucket_start__gte=start, bucket_start__lt=end,
+    ).values_list('bucket_start', 'count', *[f'{field}_{stat}' for field in fields for stat in STATS])
+    points = []
+    for bucket_start, count, *stats in rows:
+        point = {'timestamp': timezone.localtime(bucket_start).isoformat(), 'count': count}
+        for i, field in enumerate(fields):
+            low, high, total = stats[3 * i:3 * i + 3]
+            point[field] = {'min': low, 'max': high, 'mean': total / count if count else None}
+        points.append(point)
+    return resolution, points
+
+
+def crop_series(workspace, start, end, max_points=500):
+    """``(resolution, points)`` of top-prediction counts per crop and bucket."""
+    resolution = choose_resolution(start, end, max_points)
+    rows = CropRollup.objects.filter(
+        workspace=workspace, resolution=resolution, bucket_start__gte=start, bucket_start__lt=end,
+    ).values_list('bucket_start', 'crop', 'count')
+    return resolution, [
+        {'timestamp': timezone.localtime(bucket_start).isoformat(), 'crop': crop, 'count': count}
+        for bucket_start, crop, count in rows
+    ]
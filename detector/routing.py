@@ -1,6 +1,8 @@
 from django.urls import re_path
-from detector.consumers import InboxConsumer
+from detector.consumers import DeviceConsumer, InboxConsumer, WorkspaceConsumer
 
 websocket_urlpatterns = [
     re_path(r"ws/inbox/$", InboxConsumer.as_asgi()),
+    re_path(r"ws/workspace/(?P<workspace_id>\d+)/$", WorkspaceConsumer.as_asgi()),
+    re_path(r"ws/device/(?P<device_id>[\w.:-]{1,64})/$", DeviceConsumer.as_asgi()),
 ]
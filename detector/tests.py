@@ -1,3 +1,765 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from importlib.util import find_spec
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import async_to_sync
+from channels.exceptions import ChannelFull
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import anomalies, binary_readings, crop_history, devices, inbox, metrics, rate_limit, reading_logs, rollups
+from .anomalies import AnomalyDetector, format_flags
+from .channel_layer import DatabaseChannelLayer
+from .dedup import IN_FLIGHT, RecentReadings, reading_id
+from .model_backends import MODEL_PATH, SCALER_PATH, KerasBackend, export_numpy, sample_readings
+from .model_registry import BundleSpec, ModelRegistry
+from .models import (
+    ChannelGroupMembership, ChannelMessage, Conversation, CropRollup, ReadingRollup, SensorReading, Workspace,
+)
+from .prediction_cache import PredictionCache
+from .rate_limit import AdmissionController, LocalBucketStore, _gcra
+from .readings import FEATURES, ReadingError, load_reading_list, parse_readings
+
+TOP_5 = [{'crop_name': 'rice', 'probability': 0.9}]
+
+
+def registry_for(spec):
+    """A registry whose active bundle is ``spec``, loaded now."""
+    registry = ModelRegistry(os.path.dirname(spec.model_path), spec.backend_name)
+    registry.active = spec.load()
+    return registry
+
+
+def make_users(*usernames):
+    # bulk_create skips the post_save profile signal, which uploads an avatar to Supabase
+    return User.objects.bulk_create([User(username=username) for username in usernames])
+
+
+def reading_row(**values):
+    row = dict(zip(FEATURES, [40.0, 30.0, 20.0, 25.0, 35.0, 6.5, 300.0]))
+    row.update(values)
+    return row
+
+
+@skipUnless(find_spec('tensorflow') and find_spec('joblib') and os.path.exists(MODEL_PATH),
+            "needs TensorFlow, joblib and the saved Keras model")
+class BackendParityTests(SimpleTestCase):
+    """inference.recommend must give the same answers on the Keras and NumPy backends."""
+
+    tolerance = 1e-4
+
+    def test_numpy_recommendations_match_keras(self):
+        from . import inference
+
+        keras_backend = KerasBackend()
+        with tempfile.TemporaryDirectory() as directory:
+            npz_path = os.path.join(directory, 'model.npz')
+            export_numpy(keras_backend.model, keras_backend.scaler, npz_path)
+            specs = {
+                'keras': BundleSpec('v3', 'keras', MODEL_PATH, SCALER_PATH),
+                'numpy': BundleSpec('v3', 'numpy', npz_path),
+            }
+            rows = sample_readings(500, seed=1)
+            results = {}
+            for name, spec in specs.items():
+                with mock.patch.object(inference, 'registry', registry_for(spec)), \
+                        mock.patch.object(inference, 'inference_client', None):
+                    results[name], _ = inference.recommend(rows)
+
+        for keras_row, numpy_row in zip(results['keras'], results['numpy']):
+            expected = {r['crop_name']: r['probability'] for r in keras_row}
+            actual = {r['crop_name']: r['probability'] for r in numpy_row}
+            # Crops within the tolerance of each other may swap places at the edge of the top 5
+            for crop in expected.keys() & actual.keys():
+                self.assertAlmostEqual(expected[crop], actual[crop], delta=self.tolerance)
+            if keras_row[0]['probability'] - keras_row[1]['probability'] > 2 * self.tolerance:
+                self.assertEqual(keras_row[0]['crop_name'], numpy_row[0]['crop_name'])
+
+
+class ParseReadingsTests(SimpleTestCase):
+    def test_valid_rows_in_feature_order(self):
+        matrix, errors = parse_readings([reading_row(), reading_row(nitrogen='12.5')])
+        self.assertEqual(errors, {})
+        self.assertEqual(matrix.shape, (2, len(FEATURES)))
+        self.assertEqual(matrix.dtype, np.float32)
+        self.assertEqual(matrix[1, 0], 12.5)
+        self.assertEqual(matrix[0, FEATURES.index('pH')], np.float32(6.5))
+
+    def test_invalid_rows_are_reported_without_failing_the_rest(self):
+        missing = reading_row()
+        del missing['moisture']
+        matrix, errors = parse_readings([reading_row(), missing, 'text', reading_row(pH='acid')])
+        self.assertEqual(set(errors), {1, 2, 3})
+        self.assertIn('moisture', errors[1])
+        self.assertEqual(errors[2], 'Reading must be a JSON object.')
+        self.assertIn('pH', errors[3])
+
+    def test_ndjson_bad_line_is_a_row_error(self):
+        readings, errors = load_reading_list(b'{"nitrogen": 1}\nnot json\n\n{"nitrogen": 2}\n',
+                                             'application/x-ndjson')
+        self.assertEqual(len(readings), 3)
+        self.assertIsNone(readings[1])
+        self.assertEqual(list(errors), [1])
+
+    def test_json_array_or_readings_object(self):
+        self.assertEqual(load_reading_list(b'[{"a": 1}]', 'application/json'), ([{'a': 1}], {}))
+        self.assertEqual(load_reading_list(b'{"readings": [{"a": 1}]}', 'application/json'), ([{'a': 1}], {}))
+        with self.assertRaises(ReadingError):
+            load_reading_list(b'{"a": 1}', 'application/json')
+        with self.assertRaises(ReadingError):
+            load_reading_list(b'[', 'application/json')
+
+
+class PredictionCacheTests(SimpleTestCase):
+    top = [{'crop_name': 'rice', 'probability': 0.9}]
+
+    def test_readings_within_resolution_share_an_entry(self):
+        cache = PredictionCache(lambda: 'v1')
+        row = [40, 30, 20, 25.0, 35.0, 6.5, 300]
+        cache.set(row, self.top)
+        self.assertEqual(cache.get([40.2, 30, 20, 25.01, 35.0, 6.501, 300]), self.top)
+        self.assertIsNone(cache.get([41, 30, 20, 25.0, 35.0, 6.5, 300]))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = PredictionCache(lambda: 'v1', max_entries=2)
+        rows = [[n, 0, 0, 0, 0, 0, 0] for n in range(3)]
+        cache.set(rows[0], 'a')
+        cache.set(rows[1], 'b')
+        cache.get(rows[0])
+        cache.set(rows[2], 'c')
+        self.assertEqual(cache.get(rows[0]), 'a')
+        self.assertIsNone(cache.get(rows[1]))
+        self.assertEqual(cache.evictions, 1)
+
+    def test_entries_expire(self):
+        cache = PredictionCache(lambda: 'v1', ttl=0.01)
+        cache.set([1] * 7, 'a')
+        time.sleep(0.02)
+        self.assertIsNone(cache.get([1] * 7))
+        self.assertEqual(cache.expirations, 1)
+
+    def test_model_version_change_drops_entries(self):
+        version = ['v1']
+        cache = PredictionCache(lambda: version[0], check_interval=0)
+        cache.set([1] * 7, 'a')
+        version[0] = 'v2'
+        self.assertIsNone(cache.get([1] * 7))
+        self.assertEqual(cache.invalidations, 1)
+
+
+class BinaryReadingsTests(SimpleTestCase):
+    rows = np.arange(21, dtype=np.float32).reshape(3, 7)
+
+    def test_round_trip_with_seq(self):
+        body = binary_readings.encode(self.rows, seq=[7, 8, 9], device_id='esp-1', workspace_id=4)
+        batch = binary_readings.decode(body)
+        self.assertEqual(batch.device_id, 'esp-1')
+        self.assertEqual(batch.workspace_id, 4)
+        self.assertEqual(batch.seq.tolist(), [7, 8, 9])
+        np.testing.assert_array_equal(batch.matrix, self.rows)
+        self.assertEqual(batch.errors, {})
+
+    def test_without_seq_flag_there_is_no_seq(self):
+        batch = binary_readings.decode(binary_readings.encode(self.rows))
+        self.assertIsNone(batch.seq)
+        self.assertIsNone(batch.workspace_id)
+        self.assertEqual(batch.device_id, '')
+
+    def test_non_finite_records_are_row_errors(self):
+        rows = self.rows.copy()
+        rows[1, FEATURES.index('pH')] = np.nan
+        batch = binary_readings.decode(binary_readings.encode(rows))
+        self.assertEqual(list(batch.errors), [1])
+        self.assertIn('pH', batch.errors[1])
+
+    def test_malformed_bodies(self):
+        body = binary_readings.encode(self.rows)
+        for bad in (body[:10], b'XXXX' + body[4:], body[:-1],
+                    body[:5] + bytes([0x80]) + body[6:]):  # unknown flag
+            with self.subTest(bad=bad[:8]), self.assertRaises(ReadingError):
+                binary_readings.decode(bad)
+
+
+class ModelRegistryWatchTests(SimpleTestCase):
+    def test_only_one_watcher_runs(self):
+        registry = ModelRegistry(tempfile.gettempdir(), 'numpy')
+
+        def watchers():
+            return [t for t in threading.enumerate() if t.name == 'model-registry-watch']
+
+        before = len(watchers())
+        registry.watch(3600)
+        registry.watch(3600)
+        self.assertEqual(len(watchers()), before + 1)
+
+class MicroBatcherTests(SimpleTestCase):
+    def batcher(self, score_fn, **options):
+        # Imported here: importing inference loads the active model
+        from .inference import MicroBatcher
+
+        self.batches = []
+
+        def recording(matrix):
+            self.batches.append(len(matrix))
+            return score_fn(matrix)
+
+        return MicroBatcher(recording, **options)
+
+    def test_batches_close_at_max_batch_size(self):
+        batcher = self.batcher(lambda matrix: matrix[:, 0].tolist(), max_batch_size=4, max_wait=1.0)
+        futures = [batcher.submit(np.full(7, n, dtype=np.float32)) for n in range(8)]
+        self.assertEqual([future.result(timeout=5) for future in futures], list(range(8)))
+        self.assertEqual(self.batches, [4, 4])
+
+    def test_batches_close_after_max_wait(self):
+        batcher = self.batcher(lambda matrix: matrix[:, 0].tolist(), max_batch_size=64, max_wait=0.01)
+        self.assertEqual(batcher.predict(np.zeros(7), timeout=5), 0)
+        time.sleep(0.1)
+        self.assertEqual(batcher.predict(np.ones(7), timeout=5), 1)
+        self.assertEqual(self.batches, [1, 1])
+
+    def test_score_fn_error_reaches_every_future(self):
+        def fail(matrix):
+            raise ValueError('model failed')
+
+        batcher = self.batcher(fail, max_batch_size=3, max_wait=1.0)
+        futures = [batcher.submit(np.zeros(7)) for _ in range(3)]
+        for future in futures:
+            with self.assertRaisesMessage(ValueError, 'model failed'):
+                future.result(timeout=5)
+        self.assertEqual(self.batches, [3])
+
+    def test_missing_results_fail_every_future(self):
+        batcher = self.batcher(lambda matrix: matrix[:-1, 0].tolist(), max_batch_size=2, max_wait=1.0)
+        futures = [batcher.submit(np.zeros(7)) for _ in range(2)]
+        for future in futures:
+            with self.assertRaises(RuntimeError):
+                future.result(timeout=5)
+
+
+class AnomalyDetectorTests(SimpleTestCase):
+    base = np.array([40.0, 30.0, 20.0, 25.0, 35.0, 6.5, 300.0])
+
+    def noisy(self, n, seed=0):
+        # Bounded noise: once the EWMA variance has settled no reading is 4 sigma out
+        return self.base + np.random.default_rng(seed).uniform(-1, 1, size=(n, len(FEATURES)))
+
+    def test_spike_is_flagged_after_min_samples(self):
+        detector = AnomalyDetector(min_samples=60)
+        for row in self.noisy(80):
+            self.assertEqual(detector.update('esp-1', row), [])
+        spike = self.base.copy()
+        spike[0] += 1000
+        self.assertEqual(detector.update('esp-1', spike), [('nitrogen', 'spike')])
+        self.assertEqual(detector.flagged['spike'], 1)
+
+    def test_nothing_is_flagged_before_min_samples(self):
+        detector = AnomalyDetector(min_samples=30)
+        rows = self.noisy(5)
+        rows[-1, 0] += 1000
+        self.assertEqual([detector.update('esp-1', row) for row in rows], [[]] * 5)
+
+    def test_stuck_sensor_is_flagged_once(self):
+        detector = AnomalyDetector(min_samples=60, stuck_readings=3)
+        for row in self.noisy(80):
+            detector.update('esp-1', row)
+        rows = self.noisy(6, seed=1)
+        rows[:, FEATURES.index('temperature')] = 25.0
+        flags = [flag for row in rows for flag in detector.update('esp-1', row)]
+        self.assertEqual(flags, [('temperature', 'stuck')])
+
+    def test_update_many_matches_update(self):
+        rows = self.noisy(50)
+        rows[45, 2] += 500
+        one, many = AnomalyDetector(min_samples=10), AnomalyDetector(min_samples=10)
+        self.assertEqual([one.update('esp-1', row) for row in rows], many.update_many('esp-1', rows))
+        self.assertEqual(one.stats('esp-1'), many.stats('esp-1'))
+
+    def test_least_recently_seen_device_is_evicted(self):
+        detector = AnomalyDetector(max_devices=2)
+        for device_id in ('a', 'b', 'a', 'c'):
+            detector.update(device_id, self.base)
+        self.assertEqual(list(detector.devices), ['a', 'c'])
+        self.assertEqual(detector.stats('c')['count'], 1)
+        self.assertEqual(detector.evicted, 1)
+
+    def test_save_only_when_changed_and_merge_on_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            first, second = os.path.join(directory, 'a.npz'), os.path.join(directory, 'b.npz')
+            detector = AnomalyDetector()
+            self.assertFalse(detector.save(first))
+            detector.update_many('esp-1', self.noisy(3))
+            self.assertTrue(detector.save(first))
+            self.assertFalse(detector.save(first))
+            other = AnomalyDetector()
+            other.update_many('esp-1', self.noisy(5))
+            other.update('esp-2', self.base)
+            other.save(second)
+
+            merged = AnomalyDetector()
+            merged.load(first, second)
+            self.assertEqual(merged.stats('esp-1')['count'], 5)
+            self.assertEqual(merged.stats('esp-2')['count'], 1)
+
+    def test_format_flags(self):
+        self.assertEqual(format_flags([('pH', 'stuck'), ('conductivity', 'spike')]), 'pH:stuck,conductivity:spike')
+
+
+class AnomalyCheckTests(SimpleTestCase):
+    row = np.array([40.0, 30.0, 20.0, 25.0, 35.0, 6.5, 300.0])
+
+    def setUp(self):
+        patcher = mock.patch.object(anomalies, 'detector', AnomalyDetector())
+        self.detector = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_same_device_id_in_two_workspaces_is_two_devices(self):
+        async_to_sync(anomalies.check)(1, 'esp-1', self.row)
+        async_to_sync(anomalies.check_many)(2, 'esp-1', np.stack([self.row, self.row]))
+        self.assertEqual(self.detector.stats(anomalies.state_key(1, 'esp-1'))['count'], 1)
+        self.assertEqual(self.detector.stats(anomalies.state_key(2, 'esp-1'))['count'], 2)
+
+    def test_unauthenticated_readings_leave_the_device_state_alone(self):
+        async_to_sync(anomalies.check)(1, 'esp-1', self.row)
+        junk = {**dict(zip(FEATURES, (self.row * 100).tolist())), 'device_id': 'esp-1'}
+        # Imported here: importing inference loads the active model
+        from . import inference
+
+        with mock.patch.object(inference, 'arecommend_one', mock.AsyncMock(return_value=(TOP_5, 'v1'))):
+            response = self.client.post(reverse('esp32_data_api'), json.dumps(junk), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(list(self.detector.devices), [anomalies.state_key(1, 'esp-1')])
+        self.assertEqual(self.detector.stats(anomalies.state_key(1, 'esp-1'))['count'], 1)
+
+
+class GcraTests(SimpleTestCase):
+    def test_burst_then_rate(self):
+        tat = 0.0
+        for _ in range(3):
+            tat, retry_after = _gcra(tat, 0.0, rate=1.0, burst=3)
+            self.assertEqual(retry_after, 0.0)
+        new_tat, retry_after = _gcra(tat, 0.0, rate=1.0, burst=3)
+        self.assertIsNone(new_tat)
+        self.assertAlmostEqual(retry_after, 1.0)
+        _, retry_after = _gcra(tat, 1.0, rate=1.0, burst=3)
+        self.assertEqual(retry_after, 0.0)
+
+    def test_cost_spends_several_tokens(self):
+        tat, retry_after = _gcra(0.0, 0.0, rate=2.0, burst=4, cost=4)
+        self.assertEqual(retry_after, 0.0)
+        _, retry_after = _gcra(tat, 0.0, rate=2.0, burst=4, cost=2)
+        self.assertAlmostEqual(retry_after, 1.0)
+
+    async def test_controller_charges_rows_and_caps_cost_at_burst(self):
+        controller = AdmissionController(LocalBucketStore(), device_rate=1.0, device_burst=5,
+                                         global_rate=0, global_burst=0, rows_per_token=10)
+        self.assertEqual(controller.row_cost(1), 1)
+        self.assertEqual(controller.row_cost(25), 3)
+        # 100 tokens could never be paid from a burst of 5: capped, so a full bucket pays it
+        self.assertEqual(await controller.acharge_rows('esp-1', 1000, paid=0), 0.0)
+        self.assertGreater(await controller.aadmit('esp-1'), 0.0)
+        self.assertEqual(await controller.aadmit('esp-2'), 0.0)
+        self.assertEqual((controller.admitted, controller.shed_device), (1, 1))
+
+
+class RequestKeyTests(TransactionTestCase):
+    """Device keys are looked up on executor threads, so the test data must be committed."""
+
+    def setUp(self):
+        (user,) = make_users('device-owner')
+        self.workspace = Workspace.objects.create(name='Field', user=user)
+        self.key = devices.register(self.workspace, 'esp-1')
+        self.factory = RequestFactory()
+
+    def test_declared_device_id_does_not_pick_the_bucket(self):
+        keys = {async_to_sync(rate_limit.arequest_key)(self.factory.post('/', headers={'X-Device-Id': device_id}))
+                for device_id in ('esp-1', 'esp-2', 'esp-3')}
+        self.assertEqual(keys, {'addr:127.0.0.1'})
+
+    def test_device_key_picks_the_devices_bucket(self):
+        request = self.factory.post('/', headers={devices.KEY_HEADER: self.key, 'X-Device-Id': 'esp-9'})
+        self.assertEqual(async_to_sync(rate_limit.arequest_key)(request), f'{self.workspace.pk}:esp-1')
+
+
+class DedupTests(SimpleTestCase):
+    row = [40, 30, 20, 25, 35, 6.5, 300]
+
+    def test_reading_id(self):
+        self.assertEqual(reading_id({'seq': 5}), '5')
+        self.assertEqual(reading_id({'timestamp': '2026-01-01T00:00:00Z'}), '2026-01-01T00:00:00Z')
+        self.assertIsNone(reading_id({'nitrogen': 1}))
+        self.assertIsNone(reading_id({'seq': ''}))
+
+    def test_key_needs_workspace_device_and_id_and_covers_the_values(self):
+        self.assertIsNone(RecentReadings.key(None, 'esp-1', '1', self.row))
+        self.assertIsNone(RecentReadings.key(1, '', '1', self.row))
+        self.assertIsNone(RecentReadings.key(1, 'esp-1', None, self.row))
+        key = RecentReadings.key(1, 'esp-1', '1', self.row)
+        self.assertEqual(key, RecentReadings.key(1, 'esp-1', '1', np.array(self.row, dtype=np.float32)))
+        self.assertNotEqual(key, RecentReadings.key(2, 'esp-1', '1', self.row))
+        # A reused seq with other values is a new reading
+        self.assertNotEqual(key, RecentReadings.key(1, 'esp-1', '1', [41, *self.row[1:]]))
+
+    def test_repeats_within_a_batch(self):
+        recent = RecentReadings()
+        self.assertEqual(recent.repeats(['a', None, 'b', 'a', None, 'a']), {3: 0, 5: 0})
+        self.assertEqual(recent.duplicates, 2)
+
+    async def test_claim_store_and_release(self):
+        recent = RecentReadings()
+        self.assertIsNone(await recent.aclaim('k'))
+        self.assertEqual(await recent.aclaim('k'), IN_FLIGHT)
+        await recent.astore('k', ({'status': 'success'}, 201))
+        self.assertEqual(await recent.aclaim('k'), ({'status': 'success'}, 201))
+        await recent.arelease('k')
+        self.assertIsNone(await recent.aclaim('k'))
+
+    async def test_replay_and_remember(self):
+        recent = RecentReadings()
+        await recent.aremember({'a': {'status': 'success'}})
+        self.assertIsNone(await recent.aclaim('b'))  # in flight: not replayed
+        self.assertEqual(await recent.areplay(['a', None, 'b', 'c']), {0: {'status': 'success'}})
+
+    def test_entries_expire(self):
+        recent = RecentReadings(ttl=0.01)
+        asyncio.run(recent.aremember({'a': 1}))
+        time.sleep(0.02)
+        self.assertEqual(asyncio.run(recent.areplay(['a'])), {})
+
+
+class DedupViewTests(TransactionTestCase):
+    """Device keys are looked up on executor threads, so the test data must be committed."""
+
+    def setUp(self):
+        (user,) = make_users('device-owner')
+        self.key = devices.register(Workspace.objects.create(name='Field', user=user), 'esp-1')
+        for name, value in (('detector.views.recent_readings', RecentReadings()),
+                            ('detector.views.reading_buffer', mock.Mock()),
+                            ('detector.views.live_stream', mock.Mock()),
+                            ('detector.inference.arecommend_one', mock.AsyncMock(return_value=(TOP_5, 'v1')))):
+            patcher = mock.patch(name, value)
+            setattr(self, name.rsplit('.', 1)[1], patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def post(self, key=None):
+        headers = {devices.KEY_HEADER: key} if key else {}
+        return self.client.post(reverse('esp32_data_api'), json.dumps(reading_row(device_id='esp-1', seq=7)),
+                                content_type='application/json', headers=headers)
+
+    def test_unauthenticated_copy_does_not_claim_the_reading(self):
+        self.assertEqual(self.post().status_code, 201)
+        response = self.post(self.key)
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('X-Duplicate-Reading', response)
+        self.assertEqual(self.reading_buffer.add.call_count, 1)
+
+    def test_retry_replays_the_first_response(self):
+        self.post(self.key)
+        response = self.post(self.key)
+        self.assertEqual(response['X-Duplicate-Reading'], 'true')
+        self.assertEqual(self.reading_buffer.add.call_count, 1)
+
+    def test_failure_after_the_claim_releases_it(self):
+        with mock.patch.object(anomalies, 'check', side_effect=RuntimeError('detector failed')):
+            self.assertEqual(self.post(self.key).status_code, 500)
+        self.assertEqual(self.post(self.key).status_code, 201)
+        self.assertEqual(self.reading_buffer.add.call_count, 1)
+
+
+class MetricsRenderTests(SimpleTestCase):
+    def test_labeled_counters_share_one_help_and_type(self):
+        controller = AdmissionController(LocalBucketStore(), device_rate=1.0, device_burst=1,
+                                         global_rate=1.0, global_burst=1)
+        counters = AnomalyDetector().metric_counters() + controller.metric_counters()
+        lines = metrics.render(counters).splitlines()
+
+        types = [line for line in lines if line.startswith('# TYPE ')]
+        self.assertEqual(len(types), len(set(types)))
+        for family in ('soilution_anomalies_total', 'soilution_ingest_shed_total'):
+            self.assertEqual(types.count(f'# TYPE {family} counter'), 1)
+            start = lines.index(f'# TYPE {family} counter')
+            self.assertEqual([line.split('{')[0] for line in lines[start + 1:start + 3]], [family, family])
+
+
+class RollupAggregateTests(SimpleTestCase):
+    def test_buckets_and_stats(self):
+        base = int(datetime(2026, 1, 1, 0, 0, tzinfo=dt_timezone.utc).timestamp())
+        workspace_ids = np.array([1, 1, 1, 2], dtype=np.int64)
+        epochs = np.array([base, base + 60, base + 600, base], dtype=np.int64)
+        values = np.arange(28, dtype=np.float64).reshape(4, 7)
+        crops = np.array(['rice', 'rice', 'maize', 'rice'])
+        readings, crop_counts = rollups.aggregate(workspace_ids, epochs, values, crops, 300)
+
+        self.assertEqual(set(readings), {(1, base), (1, base + 600), (2, base)})
+        count, stats = readings[(1, base)]
+        self.assertEqual(count, 2)
+        np.testing.assert_array_equal(stats[:, 0], values[0])
+        np.testing.assert_array_equal(stats[:, 1], values[1])
+        np.testing.assert_array_equal(stats[:, 2], values[0] + values[1])
+        self.assertEqual(crop_counts, {(1, base, 'rice'): 2, (1, base + 600, 'maize'): 1, (2, base, 'rice'): 1})
+
+    @override_settings(TIME_ZONE='Asia/Manila')
+    def test_daily_buckets_start_at_local_midnight(self):
+        late_evening = datetime(2026, 1, 1, 15, 30, tzinfo=dt_timezone.utc)  # 23:30 in Manila
+        start = rollups.bucket_starts(np.array([int(late_evening.timestamp())]), 86400)[0]
+        self.assertEqual(start, int(datetime(2025, 12, 31, 16, 0, tzinfo=dt_timezone.utc).timestamp()))
+
+    @override_settings(TIME_ZONE='Europe/Berlin')
+    def test_each_reading_uses_its_own_utc_offset(self):
+        # Daylight saving time starts on 2026-03-29 at 01:00 UTC
+        epochs = np.array([int(datetime(2026, 3, d, 12, tzinfo=dt_timezone.utc).timestamp()) for d in (28, 29, 30)])
+        expected = [datetime(2026, 3, 27, 23, tzinfo=dt_timezone.utc),
+                    datetime(2026, 3, 28, 23, tzinfo=dt_timezone.utc),
+                    datetime(2026, 3, 29, 22, tzinfo=dt_timezone.utc)]
+        self.assertEqual(rollups.bucket_starts(epochs, 86400).tolist(), [int(e.timestamp()) for e in expected])
+
+
+class RollupRecordTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        (user,) = make_users('grower')
+        cls.workspace = Workspace.objects.create(name='Field', user=user)
+
+    def reading(self, timestamp, crop, nitrogen):
+        return SensorReading(workspace=self.workspace, timestamp=timestamp, top_crop=crop, top_probability=0.9,
+                             **{field: nitrogen if field == 'nitrogen' else 1.0
+                                for field in ('nitrogen', 'phosphorus', 'potassium', 'temperature',
+                                              'moisture', 'ph', 'conductivity')})
+
+    def test_new_readings_fold_into_existing_buckets(self):
+        timestamp = datetime(2026, 1, 1, 2, 1, tzinfo=dt_timezone.utc)
+        rollups.record([self.reading(timestamp, 'rice', 10.0)])
+        rollups.record([self.reading(timestamp + timedelta(minutes=1), 'rice', 30.0),
+                        self.reading(timestamp + timedelta(minutes=2), 'maize', 20.0)])
+
+        five_minutes = ReadingRollup.objects.get(workspace=self.workspace, resolution='5m')
+        self.assertEqual(five_minutes.count, 3)
+        self.assertEqual((five_minutes.nitrogen_min, five_minutes.nitrogen_max, five_minutes.nitrogen_sum),
+                         (10.0, 30.0, 60.0))
+        self.assertEqual(ReadingRollup.objects.filter(workspace=self.workspace).count(), 3)  # one per resolution
+        self.assertEqual(
+            dict(CropRollup.objects.filter(workspace=self.workspace, resolution='1d').values_list('crop', 'count')),
+            {'rice': 2, 'maize': 1},
+        )
+
+
+class ReadingLogTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        (user,) = make_users('logger')
+        cls.workspace = Workspace.objects.create(name='Logs', user=user)
+        same_time = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+        SensorReading.objects.bulk_create([
+            SensorReading(workspace=cls.workspace, timestamp=same_time + timedelta(seconds=i // 2), top_crop='rice',
+                          top_probability=0.5, nitrogen=i, phosphorus=0, potassium=0, temperature=0, moisture=0,
+                          ph=7, conductivity=0)
+            for i in range(5)
+        ])
+
+    def test_cursor_round_trip(self):
+        timestamp = datetime(2026, 1, 1, 8, 30, 15, 123456, tzinfo=dt_timezone.utc)
+        self.assertEqual(reading_logs.decode_cursor(reading_logs.encode_cursor(timestamp, 42)), (timestamp, 42))
+        with self.assertRaises(reading_logs.CursorError):
+            reading_logs.decode_cursor('not-a-cursor')
+
+    def test_pages_cover_every_row_once_across_equal_timestamps(self):
+        readings = reading_logs.filtered_readings(self.workspace, {})
+        seen, cursor = [], None
+        while True:
+            rows, cursor = reading_logs.log_page(readings, cursor, limit=2)
+            seen += [row[0] for row in rows]
+            if cursor is None:
+                break
+        expected = list(SensorReading.objects.filter(workspace=self.workspace)
+                        .order_by('-timestamp', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_threshold_filters(self):
+        readings = reading_logs.filtered_readings(self.workspace, {'nitrogen_min': '1', 'nitrogen_max': '3'})
+        self.assertEqual(readings.count(), 3)
+        with self.assertRaises(ValueError):
+            reading_logs.filtered_readings(self.workspace, {'nitrogen_min': 'high'})
+
+
+class TimeRangeTests(TestCase):
+    def setUp(self):
+        (user,) = make_users('owner')
+        self.workspace = Workspace.objects.create(name='Field', user=user)
+        self.client.force_login(user)
+
+    def series(self, **params):
+        return self.client.get(reverse('workspace_series_api', args=[self.workspace.pk]), params)
+
+    def test_unparseable_bound_is_rejected_by_name(self):
+        for params, name in (({'start': 'yesterday'}, 'start'), ({'end': '2024-13-01'}, 'end'),
+                             ({'start': '2024-01-01', 'end': 'now'}, 'end')):
+            response = self.series(**params)
+            self.assertEqual(response.status_code, 400)
+            self.assertTrue(response.json()['message'].startswith(f'{name} must be'))
+
+    def test_dates_and_defaults_are_accepted(self):
+        self.assertEqual(self.series().status_code, 200)
+        self.assertEqual(self.series(start='2024-01-01', end='2024-01-02T06:00').status_code, 200)
+
+
+@override_settings(INBOX_CACHE_ALIAS='default')
+class InboxTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice, cls.bob = make_users('alice', 'bob')
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def send(self, sender, receiver, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            return inbox.send(sender, receiver, content)
+
+    def unread(self, user, counterpart):
+        return Conversation.objects.get(user=user, counterpart=counterpart).unread_count
+
+    def test_unread_counts_follow_sends_and_reads(self):
+        version = inbox.inbox_version(self.bob.id)
+        first = self.send(self.alice, self.bob, 'one')
+        self.send(self.alice, self.bob, 'two')
+        self.assertNotEqual(inbox.inbox_version(self.bob.id), version)
+        self.assertEqual(inbox.unread_count(self.bob.id), 2)
+        self.assertEqual(inbox.unread_count(self.alice.id), 0)
+        self.assertEqual(self.unread(self.bob, self.alice), 2)
+        self.assertEqual(self.unread(self.alice, self.bob), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            inbox.mark_message_read(first)
+        self.assertEqual(inbox.unread_count(self.bob.id), 1)
+        self.assertEqual(self.unread(self.bob, self.alice), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(inbox.mark_read(self.bob, self.alice.id), 1)
+        self.assertEqual(inbox.unread_count(self.bob.id), 0)
+        self.assertEqual(self.unread(self.bob, self.alice), 0)
+
+    def test_unread_count_is_cached_per_version(self):
+        self.send(self.alice, self.bob, 'one')
+        self.assertEqual(inbox.unread_count(self.bob.id), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(inbox.unread_count(self.bob.id), 1)
+
+    def test_thread_page_keysets(self):
+        sent = [self.send(*((self.alice, self.bob) if i % 2 else (self.bob, self.alice)), f'm{i}') for i in range(7)]
+        ids = [message.id for message in sent]
+
+        page, has_more = inbox.thread_page(self.alice, self.bob.id, limit=3)
+        self.assertEqual([m.id for m in page], ids[-3:])
+        self.assertTrue(has_more)
+        page, has_more = inbox.thread_page(self.alice, self.bob.id, before=ids[4], limit=3)
+        self.assertEqual([m.id for m in page], ids[1:4])
+        self.assertTrue(has_more)
+        page, has_more = inbox.thread_page(self.alice, self.bob.id, before=ids[1], limit=3)
+        self.assertEqual([m.id for m in page], ids[:1])
+        self.assertFalse(has_more)
+        page, has_more = inbox.thread_page(self.bob, self.alice.id, after=ids[4], limit=3)
+        self.assertEqual([m.id for m in page], ids[5:])
+        self.assertFalse(has_more)
+
+
+class DatabaseChannelLayerTests(TransactionTestCase):
+    """The layer runs its queries on executor threads, so the test data must be committed."""
+
+    def layer(self, **config):
+        return DatabaseChannelLayer(poll_interval=0.01, **config)
+
+    async def test_send_and_receive(self):
+        layer = self.layer()
+        channel = await layer.new_channel()
+        await layer.send(channel, {'type': 'test.message', 'n': 1})
+        await layer.send(channel, {'type': 'test.message', 'n': 2})
+        self.assertEqual((await layer.receive(channel))['n'], 1)
+        self.assertEqual((await layer.receive(channel))['n'], 2)
+        self.assertEqual((layer.sent, layer.received), (2, 2))
+
+    async def test_full_channel_raises(self):
+        layer = self.layer(capacity=2)
+        channel = await layer.new_channel()
+        for n in range(2):
+            await layer.send(channel, {'type': 'test.message', 'n': n})
+        with self.assertRaises(ChannelFull):
+            await layer.send(channel, {'type': 'test.message', 'n': 2})
+
+    async def test_group_send_reaches_members_and_skips_full_ones(self):
+        layer = self.layer(capacity=1)
+        first, second, outsider = [await layer.new_channel() for _ in range(3)]
+        for channel in (first, second):
+            await layer.group_add('test-group', channel)
+        await layer.send(second, {'type': 'test.message', 'n': 0})
+        await layer.group_send('test-group', {'type': 'test.message', 'n': 1})
+        self.assertEqual((await layer.receive(first))['n'], 1)
+        self.assertEqual((await layer.receive(second))['n'], 0)
+        self.assertEqual(layer.dropped, 1)
+
+        await layer.group_discard('test-group', first)
+        await layer.group_send('test-group', {'type': 'test.message', 'n': 2})
+        self.assertEqual((await layer.receive(second))['n'], 2)
+        for channel in (first, outsider):
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(layer.receive(channel), 0.2)
+
+    async def test_expired_messages_and_memberships_are_not_delivered(self):
+        layer = self.layer()
+        channel = await layer.new_channel()
+        past = timezone.now() - timedelta(seconds=1)
+        await ChannelMessage.objects.acreate(channel=channel, payload='{"type": "test.message"}', expires=past)
+        await ChannelGroupMembership.objects.acreate(group='test-group', channel=channel, expires=past)
+        await layer.group_send('test-group', {'type': 'test.message'})
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(layer.receive(channel), 0.2)
+
+    async def test_flush(self):
+        layer = self.layer()
+        channel = await layer.new_channel()
+        await layer.group_add('test-group', channel)
+        await layer.send(channel, {'type': 'test.message'})
+        await layer.flush()
+        self.assertEqual(await ChannelMessage.objects.acount(), 0)
+        self.assertEqual(await ChannelGroupMembership.objects.acount(), 0)
+
+
+class CropHistoryTests(SimpleTestCase):
+    def fold(self, state, ids, epochs, crops):
+        return crop_history.fold(state, np.array(ids, dtype=np.int64), np.array(epochs, dtype=np.int64),
+                                 np.array(crops))
+
+    def test_summary_of_folded_predictions(self):
+        noon = int(timezone.localtime().replace(hour=12, minute=0, second=0, microsecond=0).timestamp())
+        day = crop_history.DAY
+        epochs = [noon - 2 * day, noon - day, noon - day + 60, noon - day + 120, noon]
+        state = self.fold(crop_history.empty_state(), [1, 2, 3, 4, 5], epochs,
+                          ['rice', 'maize', 'rice', 'rice', 'maize'])
+        summary = crop_history.summarize(state)
+
+        self.assertEqual(len(summary['days']), 3)
+        self.assertEqual(summary['days'][-1], timezone.localdate().isoformat())
+        self.assertEqual(summary['crops'], ['rice', 'maize'])
+        self.assertEqual(summary['counts'], {'rice': [1, 2, 0], 'maize': [0, 1, 1]})
+        # The most recommended crop of each day, with that day's total
+        self.assertEqual([(row['crop'], row['count']) for row in summary['history']],
+                         [('rice', 1), ('rice', 3), ('maize', 1)])
+        self.assertEqual((summary['streak']['crop'], summary['streak']['length']), ('maize', 1))
+        self.assertEqual({trend['crop']: trend['share'] for trend in summary['trends']}, {'rice': 0.6, 'maize': 0.4})
+
+    def test_streak_continues_across_folds(self):
+        now = int(time.time())
+        state = self.fold(crop_history.empty_state(), [1, 2], [now - 120, now - 60], ['rice', 'rice'])
+        self.fold(state, [3], [now], ['rice'])
+        self.assertEqual(state['streak'][:2], [state['crops'].index('rice'), 3])
+        self.assertEqual(state['last_id'], 3)
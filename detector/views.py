@@ -1,9 +1,10 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib.auth.models import User 
 from django.contrib.auth import authenticate, login as auth_login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.contrib.auth.tokens import default_token_generator
+from django.core.exceptions import PermissionDenied
 from django.core.mail import send_mail
 from django.template.loader import render_to_string
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
@@ -16,7 +17,7 @@ from detector.models import PasswordReset, Workspace
 from .forms import WorkspaceForm
 from .models import Workspace
 from allauth.socialaccount.models import SocialAccount
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from supabase import create_client, Client
 from .forms import UserProfileForm
 from .models import Profile
@@ -30,7 +31,7 @@ from .forms import UpdateUserForm
 from django.utils.timesince import timesince
 from django.db.models import Max, Count, Q
 from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from asgiref.sync import async_to_sync, sync_to_async
 from django.views.decorators.csrf import csrf_protect
 import time
 from django.contrib.auth.decorators import user_passes_test
@@ -38,11 +39,21 @@ from django.core.mail import EmailMultiAlternatives
 from django.views.decorators.csrf import csrf_exempt
 from django.http import JsonResponse
 import json
-from tensorflow import keras
 import numpy as np
-import os
-import joblib
+from . import inference, metrics
+from . import anomalies, binary_readings, devices, exports, inbox, reading_logs, rollups
+from .channel_layer import DatabaseChannelLayer
+from .consumers import device_metric_counters
+from .crop_history import summary as crop_history_summary
+from .dedup import IN_FLIGHT, reading_id, recent_readings
+from .live_stream import reading_state, stream as live_stream
+from .rate_limit import admission_control, bucket_key, controller as admission_controller, shed_response
+from .reading_buffer import buffer as reading_buffer, make_reading
+from .readings import FEATURES, ReadingError, load_reading_list, parse_readings
 from django.utils.dateformat import DateFormat
+from django.utils.dateparse import parse_datetime
+from django.utils.text import slugify
+from datetime import timedelta
 from django.utils.formats import get_format
 
 
@@ -50,16 +61,6 @@ supabase: Client = create_client(settings.SUPABASE_URL, settings.SUPABASE_SERVIC
 
 channel_layer = get_channel_layer()
 
-APP_DIR = os.path.dirname(__file__)
-MODEL_PATH = os.path.join(APP_DIR, 'ml_models', 'crop_recommendation_model_v3.keras')
-SCALER_PATH = os.path.join(APP_DIR, 'ml_models', 'scaler.pkl')
-crop_model = keras.models.load_model(MODEL_PATH)
-scaler = joblib.load(SCALER_PATH)
-
-crop_labels = ['apple', 'banana', 'blackgram', 'chickpea', 'coconut', 'coffee', 'cotton', 'grapes', 
-               'jute', 'kidneybeans', 'lentil', 'maize', 'mango', 'mothbeans', 'mungbean', 'muskmelon', 
-               'orange', 'papaya', 'pigeonpeas', 'pomegranate', 'rice', 'watermelon', 'wheat']  # Example list
-
 def index(request):
     list(messages.get_messages(request))
     return render(request, 'detector/index.html')
@@ -367,25 +368,14 @@ def reports(request):
         if selected_workspace:
             request.session['selected_workspace_id'] = selected_workspace.id
             
-    crop_history = [
-        {"timestamp": "2024-05-22 10:00", "crop": "Corn"},
-        {"timestamp": "2024-05-27 10:00", "crop": "Rice"},
-        {"timestamp": "2024-05-27 12:00", "crop": "Wheat"},
-        {"timestamp": "2024-05-26 12:00", "crop": "Soybean"},
-        {"timestamp": "2024-05-26 14:00", "crop": "Munggo"},
-        {"timestamp": "2024-04-27 15:00", "crop": "Mais"},
-        {"timestamp": "2025-04-28 16:00", "crop": "Banana"},
-        {"timestamp": "2025-05-28 17:00", "crop": "Apple"},
-        {"timestamp": "2025-05-28 17:00", "crop": "Apple"},
-        {"timestamp": "2025-05-28 19:00", "crop": "Grapes"},
-    ]
+    crop_history = crop_history_summary(selected_workspace.id) if selected_workspace else None
 
     context = {
         'profile_picture_url': profile_picture_url,
         'workspace': user_workspaces,
         'selected_workspace': selected_workspace,
         'user': user,
-        'crop_history_json': json.dumps(crop_history),
+        'crop_history_json': json.dumps(crop_history['history'] if crop_history else []),
     }
 
     return render(request, 'reports.html', context)
@@ -492,25 +482,18 @@ def dashboard(request):
         selected_workspace = user_workspaces.first()
         request.session['selected_workspace_id'] = selected_workspace.id
         
-    crop_history = [
-        {"timestamp": "2024-05-22 10:00", "crop": "Corn"},
-        {"timestamp": "2024-05-27 10:00", "crop": "Rice"},
-        {"timestamp": "2024-05-27 12:00", "crop": "Wheat"},
-        {"timestamp": "2024-05-26 12:00", "crop": "Soybean"},
-        {"timestamp": "2024-05-26 14:00", "crop": "Munggo"},
-        {"timestamp": "2024-04-27 15:00", "crop": "Mais"},
-        {"timestamp": "2025-04-28 16:00", "crop": "Banana"},
-        {"timestamp": "2025-05-28 17:00", "crop": "Apple"},
-        {"timestamp": "2025-05-28 17:00", "crop": "Apple"},
-        {"timestamp": "2025-05-28 19:00", "crop": "Grapes"},
-    ]
+    crop_history = crop_history_summary(selected_workspace.id) if selected_workspace else None
 
     context = {
         'user_profile': profile,
         'workspace': user_workspaces,
         'profile_picture_url': profile_picture_url,
         'selected_workspace': selected_workspace,
-        'crop_history_json': json.dumps(crop_history),
+        'crop_history': crop_history,
+        # The chart only needs the per-day counts
+        'crop_history_json': json.dumps(
+            {key: crop_history[key] for key in ('days', 'crops', 'counts')} if crop_history else None
+        ),
     }
 
     return render(request, 'dashboard.html', context)
@@ -1242,103 +1225,61 @@ def view_message(request, message_id):
 
     # Only mark as read if it's the recipient's message and it's unread
     if message.receiver == request.user and not message.is_read:
-        message.is_read = True
-        message.save()
+        inbox.mark_message_read(message)
 
     return render(request, 'messages/message_details.html', {'message': message})
 
 def get_unread_count_and_messages(request):
-    unread_count = Message.objects.filter(receiver=request.user, is_read=False).count()
-
-    recent_unread = list(
-        Message.objects.filter(receiver=request.user, is_read=False)
-        .select_related('sender__profile')  # Include profile
-        .order_by('-timestamp')[:3]
-    )
-    recent_read = list(
-        Message.objects.filter(receiver=request.user, is_read=True)
-        .select_related('sender__profile')  # Include profile
-        .order_by('-timestamp')[:2]
-    )
-
-    # Merge and limit total to 5
-    recent_messages = recent_unread + recent_read
-    recent_messages = recent_messages[:5]
-
-    messages_data = []
-    for msg in recent_messages:
-        sender_profile = msg.sender.profile
-        profile_image_url = sender_profile.get_profile_image()
-        
-        # Fallback initials if no avatar
-        initials = f"{msg.sender.first_name[:1]}{msg.sender.last_name[:1]}".upper() \
-            if msg.sender.first_name and msg.sender.last_name else msg.sender.username[:2].upper()
-
-        messages_data.append({
-            'id': msg.id,
-            'sender': msg.sender.username,
-            'sender_id': msg.sender.id,
-            'content': msg.content[:50],
-            'timestamp': timesince(msg.timestamp) + " ago",
-            'is_read': msg.is_read,
-            'sender_avatar': profile_image_url if profile_image_url else None,
-            'sender_initials': initials,
-        })
-
-    return JsonResponse({
-        'unread_count': unread_count,
-        'messages': messages_data
-    })
+    # Pages get the same data pushed over ws/inbox/ (InboxConsumer); kept for other clients
+    return JsonResponse(inbox.snapshot(request.user))
 
 # @login_required
 def get_unread_conversations(request):
     user = request.user
 
-    # Get the latest message per sender (Messenger style)
-    latest_ids = (
-        Message.objects
-        .filter(receiver=user)
-        .values('sender')
-        .annotate(latest_id=Max('id'))
-        .values_list('latest_id', flat=True)
-    )
-
-    messages = Message.objects.filter(id__in=latest_ids).select_related('sender__profile').order_by('-timestamp')
-
+    # One query over the per-user conversation summaries (see detector/inbox.py)
     conversations = []
-    for msg in messages:
-        sender = msg.sender
+    for conversation in inbox.conversations(user):
+        sender = conversation.counterpart
         sender_profile = getattr(sender, 'profile', None)
         profile_image_url = sender_profile.get_profile_image() if sender_profile else None
 
         initials = f"{sender.first_name[:1]}{sender.last_name[:1]}".upper() \
             if sender.first_name and sender.last_name else sender.username[:2].upper()
 
-        unread_count = Message.objects.filter(sender=sender, receiver=user, is_read=False).count()
-
         conversations.append({
             'sender_id': sender.id,
             'sender': sender.username,
             'sender_avatar': profile_image_url,
             'sender_initials': initials,
-            'last_message': msg.content[:50],
-            'timestamp': timesince(msg.timestamp) + ' ago',
-            'unread_count': unread_count
+            'last_message': conversation.preview[:50],
+            'last_message_is_mine': conversation.last_sender_id == user.id,
+            'timestamp': timesince(conversation.last_timestamp) + ' ago',
+            'unread_count': conversation.unread_count
         })
 
     return JsonResponse({'conversations': conversations})
 
-# @login_required
-def message_thread(request, user_id):
+def thread_response(request, other_id):
+    """
+    JSON page of the thread with ``other_id``, oldest first.  ``?before=<id>``
+    pages back, ``?after=<id>`` fetches newer messages and ``?limit=`` caps
+    the page (see inbox.thread_page); "before" is the cursor for the next
+    older page, or null at the start of the thread.
+    """
     user = request.user
-    other = get_object_or_404(User, id=user_id)
-    
-    messages = Message.objects.filter(
-        (Q(sender=user, receiver=other) | Q(sender=other, receiver=user))
-    ).order_by('timestamp')
+    other = get_object_or_404(User, id=other_id)
+    try:
+        before = int(request.GET['before']) if request.GET.get('before') else None
+        after = int(request.GET['after']) if request.GET.get('after') else None
+        limit = int(request.GET.get('limit', inbox.THREAD_PAGE_SIZE))
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'before, after and limit must be integers.'}, status=400)
+
+    page, has_more = inbox.thread_page(user, other.id, before=before, after=after, limit=limit)
 
     messages_data = []
-    for msg in messages:
+    for msg in page:
         sender_profile = getattr(msg.sender, 'profile', None)
         sender_avatar = sender_profile.get_profile_image() if sender_profile else None
 
@@ -1346,11 +1287,18 @@ def message_thread(request, user_id):
             'id': msg.id,
             'content': msg.content,
             'timestamp': msg.timestamp.strftime("%b %d, %H:%M"),
-            'is_sender': msg.sender == user,
+            'sender_id': msg.sender_id,
+            'sender': msg.sender.username,
+            'is_sender': msg.sender_id == user.id,
             'sender_avatar': sender_avatar
         })
 
-    return JsonResponse({'messages': messages_data})
+    older = page[0].id if page and has_more and after is None else None
+    return JsonResponse({'messages': messages_data, 'before': older, 'has_more': has_more})
+
+# @login_required
+def message_thread(request, user_id):
+    return thread_response(request, user_id)
 
 @csrf_protect
 @login_required
@@ -1365,11 +1313,8 @@ def send_message(request, receiver_id):
         except User.DoesNotExist:
             return JsonResponse({"status": "error", "error": "User not found"})
 
-        msg = Message.objects.create(
-            sender=request.user,
-            receiver=receiver,
-            content=content
-        )
+        # Creates the message and updates both conversation summaries in one transaction
+        msg = inbox.send(request.user, receiver, content)
 
         # Format timestamp
         timestamp = timesince(msg.timestamp) + " ago"
@@ -1413,34 +1358,10 @@ def send_message(request, receiver_id):
 
 @login_required
 def load_conversation(request, sender_id):
-    current_user = request.user
-    other_user = get_object_or_404(User, id=sender_id)
-
-    # Get messages between current_user and other_user
-    messages = Message.objects.filter(
-        (Q(sender=current_user) & Q(receiver=other_user)) |
-        (Q(sender=other_user) & Q(receiver=current_user))
-    ).order_by('timestamp')
-
-    message_data = []
-    for msg in messages:
-         # Safely get the sender's profile and avatar
-        sender_profile = getattr(msg.sender, 'profile', None)
-        sender_avatar = sender_profile.get_profile_image() if sender_profile else None
-
-        message_data.append({
-            'content': msg.content,
-            'timestamp': msg.timestamp.strftime('%b %d, %H:%M'),
-            'sender_id': msg.sender.id,
-            'sender': msg.sender.username,
-            'is_sender': msg.sender.id == current_user.id,
-            'sender_avatar': sender_avatar
-        })
-
-    return JsonResponse({'messages': message_data})
+    return thread_response(request, sender_id)
 
 def mark_messages_as_read(request, sender_id):
-    Message.objects.filter(receiver=request.user, sender_id=sender_id, is_read=False).update(is_read=True)
+    inbox.mark_read(request.user, sender_id)
     return JsonResponse({'status': 'ok'})
 
 @login_required
@@ -1458,62 +1379,460 @@ def get_admin_users(request):
     
     return JsonResponse({'admins': admin_data})
 
+def reading_origin(request, data, device=None):
+    """
+    ``(workspace_id, device_id)`` of a reading, from its own fields or the
+    request headers.  workspace_id is None when the reading is not to be stored.
+    Only readings of an authenticated ``device`` (see devices) are stored, in
+    its workspace and under its id; naming a workspace without one, or another
+    workspace or device than the key's, raises PermissionDenied.
+    """
+    workspace_id = data.get('workspace_id', request.headers.get('X-Workspace-Id'))
+    device_id = str(data.get('device_id', request.headers.get('X-Device-Id', '')))[:64]
+    if workspace_id in (None, ''):
+        workspace_id = None
+    else:
+        try:
+            workspace_id = int(workspace_id)
+        except (TypeError, ValueError):
+            raise ValueError(f'workspace_id must be an integer, got {workspace_id!r}')
+    if device is None:
+        if workspace_id is not None:
+            raise PermissionDenied(
+                f'Readings are only stored for registered devices; send the device key in {devices.KEY_HEADER}.'
+            )
+        return None, device_id
+    if workspace_id not in (None, device.workspace_id) or device_id not in ('', device.device_id):
+        raise PermissionDenied('The device key belongs to another workspace or device.')
+    return device.workspace_id, device.device_id
+
+def binary_origin_fields(batch):
+    """The device / workspace of a binary body as reading fields, for reading_origin."""
+    fields = {'device_id': batch.device_id} if batch.device_id else {}
+    if batch.workspace_id:
+        fields['workspace_id'] = batch.workspace_id
+    return fields
+
 @csrf_exempt
-def esp32_data_api(request):
+@admission_control
+async def esp32_data_api(request):
     """
     API endpoint to receive JSON data from ESP32.
     Expects a POST request with JSON body containing:
     moisture, temperature, conductivity, pH, nitrogen, phosphorus, potassium
     Returns the received data and the top 5 crop recommendations.
+    Also accepts one binary record (see binary_readings) with
+    Content-Type application/vnd.soilution.readings.
+    Readings sent with a registered device's key (X-Device-Key, see devices)
+    are stored in its workspace through the write-behind reading buffer;
+    without a key they are only scored.  A retry of a keyed device's reading
+    with a seq (or timestamp) replays the first response.
+    Sensors the per-device anomaly detector flags are listed under
+    "anomalies" and alerted to the workspace's dashboards.
     """
     if request.method == 'POST':
+        start = time.perf_counter()
+        if request.content_type == binary_readings.CONTENT_TYPE:
+            try:
+                batch = binary_readings.decode(request.body)
+            except ReadingError as e:
+                return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+            if len(batch.matrix) != 1:
+                return JsonResponse({
+                    'status': 'error',
+                    'message': 'Binary body must hold exactly one record; send more to /api/esp32-data/batch/.'
+                }, status=400)
+            input_data, errors = batch.matrix, batch.errors
+            data = {**dict(zip(FEATURES, input_data[0].tolist())), **binary_origin_fields(batch)}
+            if batch.seq is not None:
+                data['seq'] = int(batch.seq[0])
+        else:
+            try:
+                data = json.loads(request.body.decode('utf-8'))
+            except ValueError as e:
+                return JsonResponse({'status': 'error', 'message': f'Invalid JSON: {e}'}, status=400)
+
+            # Validate into the model's column order:
+            # [N, P, K, temperature, moisture, pH, conductivity]
+            input_data, errors = parse_readings([data])
+        if errors:
+            return JsonResponse({'status': 'error', 'message': errors[0]}, status=400)
         try:
-            data = json.loads(request.body.decode('utf-8'))
-            # Extract fields from the JSON payload
-            moisture = data.get('moisture')
-            temperature = data.get('temperature')
-            conductivity = data.get('conductivity')
-            pH = data.get('pH')
-            nitrogen = data.get('nitrogen')
-            phosphorus = data.get('phosphorus')
-            potassium = data.get('potassium')
-
-            # Prepare input for the model (adjust order as per your model's training)
-            # Example: [N, P, K, temperature, moisture, pH, conductivity]
-            input_data = np.array([[nitrogen, phosphorus, potassium, temperature, moisture, pH, conductivity]], dtype=np.float32)
-
-            # Scale the input if your model expects scaled input
-            input_data_scaled = scaler.transform(input_data)
-
-            # Get prediction probabilities from the model
-            prediction = crop_model.predict(input_data_scaled)
-
-            # Get top 5 predictions
-            top_5_indices = prediction[0].argsort()[-5:][::-1]
-            top_5_crops = [
-                {
-                    "crop_name": crop_labels[i] if i < len(crop_labels) else str(i),
-                    "probability": float(prediction[0][i])
-                }
-                for i in top_5_indices
-            ]
+            device = await devices.aauthenticate(request.headers.get(devices.KEY_HEADER))
+            workspace_id, device_id = reading_origin(request, data, device)
+        except devices.InvalidDeviceKey as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=401)
+        except PermissionDenied as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=403)
+        except ValueError as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+        decoded = time.perf_counter()
+
+        # Retransmissions (same device and seq / client timestamp) get the original response
+        dedup_key = None
+        if recent_readings is not None:
+            dedup_key = recent_readings.key(workspace_id, device_id, reading_id(data), input_data[0])
+        if dedup_key is not None:
+            seen = await recent_readings.aclaim(dedup_key)
+            if seen == IN_FLIGHT:
+                response = JsonResponse({'status': 'error', 'message': 'This reading is already being processed.'},
+                                        status=409)
+                response['Retry-After'] = '1'
+                return response
+            if seen is not None:
+                body, status = seen
+                response = JsonResponse(body, status=status)
+                response['X-Duplicate-Reading'] = 'true'
+                return response
+
+        answered = False
+        try:
+            # Scale + predict + top 5, batched together with other in-flight requests
+            top_5_crops, model_version = await inference.arecommend_one(input_data[0])
+            inferred = time.perf_counter()
+
+            flags = await anomalies.check(workspace_id, device_id, input_data[0])
+            if workspace_id is not None:
+                reading_buffer.add([make_reading(workspace_id, device_id, input_data[0], top_5_crops, model_version,
+                                                 anomalies=anomalies.format_flags(flags))])
+                live_stream.publish(workspace_id, reading_state(input_data[0], top_5_crops, device_id, model_version))
 
             # Respond with success, echo the received data, and add recommendations
-            return JsonResponse({
+            body = {
                 'status': 'success',
                 'received': {
-                    'moisture': moisture,
-                    'temperature': temperature,
-                    'conductivity': conductivity,
-                    'pH': pH,
-                    'nitrogen': nitrogen,
-                    'phosphorus': phosphorus,
-                    'potassium': potassium,
+                    'moisture': data.get('moisture'),
+                    'temperature': data.get('temperature'),
+                    'conductivity': data.get('conductivity'),
+                    'pH': data.get('pH'),
+                    'nitrogen': data.get('nitrogen'),
+                    'phosphorus': data.get('phosphorus'),
+                    'potassium': data.get('potassium'),
                 },
-                'recommendations': top_5_crops
-            }, status=201)
+                'recommendations': top_5_crops,
+                'model_version': model_version,
+            }
+            if flags:
+                body['anomalies'] = [{'sensor': sensor, 'kind': kind} for sensor, kind in flags]
+            response = JsonResponse(body, status=201)
+            if dedup_key is not None:
+                await recent_readings.astore(dedup_key, (body, 201))
+            answered = True
         except Exception as e:
-            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+        finally:
+            # A claim left in flight would answer every retry with 409 until it expired
+            if dedup_key is not None and not answered:
+                await recent_readings.arelease(dedup_key)
+        metrics.record_request('esp32_data_api', input_data.shape, model_version,
+                               start, decoded, inferred, time.perf_counter())
+        return response
     else:
         return JsonResponse({'status': 'error', 'message': 'Only POST requests are allowed.'}, status=405)
-    
+
+@csrf_exempt
+@admission_control
+async def esp32_batch_api(request):
+    """
+    Bulk variant of esp32_data_api for gateways that buffer readings.
+    Accepts a JSON array of readings (or {"readings": [...]}) or, with
+    Content-Type application/x-ndjson, one reading per line.
+    All valid readings are scaled and scored in a single model call; invalid
+    ones are reported per row without failing the rest of the batch.
+    Readings are stored only with a registered device's key (X-Device-Key),
+    in that device's workspace; a reading naming another workspace or
+    device is rejected.  Without a key readings are scored, not stored.
+    Rows of a keyed device already received from it (same seq or timestamp
+    and values), earlier or in the same batch, get the first result marked
+    "duplicate".
+    Rows with sensors flagged by the anomaly detector carry "anomalies".
+    With Content-Type application/vnd.soilution.readings the body is a
+    binary header plus fixed-size records (see binary_readings), decoded
+    without building per-reading objects.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Only POST requests are allowed.'}, status=405)
+
+    start = time.perf_counter()
+    binary = request.content_type == binary_readings.CONTENT_TYPE
+    try:
+        if binary:
+            batch = binary_readings.decode(request.body)
+            count = len(batch.matrix)
+        else:
+            readings, decode_errors = load_reading_list(request.body, request.content_type or '')
+            count = len(readings)
+    except ReadingError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    if not count:
+        return JsonResponse({'status': 'error', 'message': 'No readings in batch.'}, status=400)
+
+    if count > settings.ESP32_BATCH_MAX_READINGS:
+        return JsonResponse({
+            'status': 'error',
+            'message': f'At most {settings.ESP32_BATCH_MAX_READINGS} readings per batch.'
+        }, status=413)
+
+    try:
+        device = await devices.aauthenticate(request.headers.get(devices.KEY_HEADER))
+    except devices.InvalidDeviceKey as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=401)
+
+    # Admission charged one token; larger batches pay for their rows before they are scored
+    if admission_controller is not None:
+        retry_after = await admission_controller.acharge_rows(bucket_key(device, request.META.get('REMOTE_ADDR')),
+                                                              count)
+        if retry_after:
+            return shed_response(retry_after)
+
+    if binary:
+        matrix, errors = batch.matrix, dict(batch.errors)
+        try:
+            origins = [reading_origin(request, binary_origin_fields(batch), device)] * count
+        except PermissionDenied as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=403)
+        except ValueError as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    else:
+        matrix, errors = parse_readings(readings)
+        errors.update(decode_errors)
+
+        origins = [None] * count
+        for i, reading in enumerate(readings):
+            if i in errors:
+                continue
+            try:
+                origins[i] = reading_origin(request, reading, device)
+            except (ValueError, PermissionDenied) as e:
+                errors[i] = str(e)
+
+    valid = np.ones(count, dtype=bool)
+    valid[list(errors)] = False
+    valid_indices = np.flatnonzero(valid)
+
+    # Rows already seen from the same device, earlier or in this batch, are not rescored
+    keys, replayed, repeats = [None] * count, {}, {}
+    if recent_readings is not None:
+        for i in valid_indices.tolist():
+            if binary:
+                row_id = None if batch.seq is None else str(int(batch.seq[i]))
+            else:
+                row_id = reading_id(readings[i])
+            keys[i] = recent_readings.key(*origins[i], row_id, matrix[i])
+        repeats = recent_readings.repeats(keys)
+        replayed = await recent_readings.areplay([None if i in repeats else key for i, key in enumerate(keys)])
+        if replayed or repeats:
+            valid[list(replayed) + list(repeats)] = False
+            valid_indices = np.flatnonzero(valid)
+    decoded = time.perf_counter()
+
+    recommendations, model_version = [], None
+    if len(valid_indices):
+        try:
+            recommendations, model_version = await sync_to_async(
+                inference.recommend, thread_sensitive=False
+            )(matrix[valid_indices])
+        except Exception as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+
+    inferred = time.perf_counter()
+
+    # Anomaly state is folded per device, each device's rows in one call off the event loop
+    by_origin = {}
+    for i in valid_indices.tolist():
+        by_origin.setdefault(origins[i], []).append(i)
+    flagged = {}
+    for (workspace_id, device_id), rows in by_origin.items():
+        for i, flags in zip(rows, await anomalies.check_many(workspace_id, device_id, matrix[rows])):
+            if flags:
+                flagged[i] = flags
+
+    stored, latest, counts = [], {}, {}
+    for i, top_5_crops in zip(valid_indices.tolist(), recommendations):
+        workspace_id, device_id = origins[i]
+        if workspace_id is not None:
+            stored.append(make_reading(workspace_id, device_id, matrix[i], top_5_crops, model_version,
+                                       anomalies=anomalies.format_flags(flagged.get(i, ()))))
+            latest[workspace_id] = (i, top_5_crops, device_id)
+            counts[workspace_id] = counts.get(workspace_id, 0) + 1
+    if stored:
+        reading_buffer.add(stored)
+    # Dashboards only need the newest reading of each workspace in the batch
+    for workspace_id, (i, top_5_crops, device_id) in latest.items():
+        live_stream.publish(workspace_id, reading_state(matrix[i], top_5_crops, device_id, model_version),
+                            readings=counts[workspace_id])
+
+    results = [None] * count
+    for i, top_5_crops in zip(valid_indices.tolist(), recommendations):
+        results[i] = {'index': i, 'status': 'success', 'recommendations': top_5_crops}
+        if i in flagged:
+            results[i]['anomalies'] = [{'sensor': sensor, 'kind': kind} for sensor, kind in flagged[i]]
+    for i, message in errors.items():
+        results[i] = {'index': i, 'status': 'error', 'message': message}
+    for i, result in replayed.items():
+        results[i] = {**result, 'index': i, 'duplicate': True}
+    for i, first in repeats.items():
+        results[i] = {**results[first], 'index': i, 'duplicate': True}
+    if recent_readings is not None:
+        await recent_readings.aremember({keys[i]: results[i] for i in valid_indices.tolist() if keys[i]})
+
+    answered = len(valid_indices) + len(replayed) + len(repeats)
+    response = JsonResponse({
+        'status': 'success' if not errors else ('partial' if answered else 'error'),
+        'accepted': len(valid_indices),
+        'duplicates': len(replayed) + len(repeats),
+        'rejected': len(errors),
+        'model_version': model_version,
+        'results': results,
+    }, status=201 if answered else 400)
+    metrics.record_request('esp32_batch_api', matrix.shape, model_version,
+                           start, decoded, inferred, time.perf_counter())
+    return response
+
+def metrics_view(request):
+    """
+    Inference metrics in Prometheus text exposition format.
+    Requires "Authorization: Bearer <METRICS_TOKEN>" when METRICS_TOKEN is set;
+    without a token only scrapers on this host are answered.
+    """
+    token = settings.METRICS_TOKEN
+    if token:
+        if request.headers.get('Authorization') != f'Bearer {token}':
+            return HttpResponse(status=403)
+    # Requests relayed by a local reverse proxy carry X-Forwarded-For and are not local
+    elif request.META.get('REMOTE_ADDR') not in ('127.0.0.1', '::1') or 'X-Forwarded-For' in request.headers:
+        return HttpResponse(status=403)
+    counters = (inference.metric_counters() + reading_buffer.metric_counters() + device_metric_counters()
+                + live_stream.metric_counters())
+    if recent_readings is not None:
+        counters += recent_readings.metric_counters()
+    if admission_controller is not None:
+        counters += admission_controller.metric_counters()
+    if anomalies.detector is not None:
+        counters += anomalies.detector.metric_counters() + anomalies.alerts.metric_counters()
+    channel_layer = get_channel_layer()
+    if isinstance(channel_layer, DatabaseChannelLayer):
+        counters += channel_layer.metric_counters()
+    return HttpResponse(metrics.render(counters),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def parse_time_range(request, default_days):
+    """
+    Aware ``(start, end)`` from the start / end GET parameters (ISO 8601 dates
+    or datetimes, local time when naive); end defaults to now and start to
+    ``default_days`` before end.  Raises ValueError naming a parameter
+    that is given but cannot be parsed.
+    """
+    given = {}
+    for name in ('start', 'end'):
+        if request.GET.get(name):
+            try:
+                value = parse_datetime(request.GET[name])
+            except ValueError:
+                value = None
+            if value is None:
+                raise ValueError(f'{name} must be an ISO 8601 date or datetime.')
+            given[name] = timezone.make_aware(value) if timezone.is_naive(value) else value
+    end = given.get('end') or timezone.now()
+    start = given.get('start') or end - timedelta(days=default_days)
+    if start >= end:
+        raise ValueError('start must be before end.')
+    return start, end
+
+@login_required
+def workspace_series_api(request, workspace_id):
+    """
+    Chart data for a workspace from the reading rollups.
+    Optional GET parameters: start / end (ISO 8601, default the last 7 days)
+    and points (most buckets to return, default 500).  The response names
+    the resolution that was picked for the range.
+    """
+    workspace = get_object_or_404(Workspace, id=workspace_id, user=request.user)
+
+    try:
+        start, end = parse_time_range(request, default_days=7)
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    try:
+        max_points = min(max(int(request.GET.get('points', 500)), 1), 5000)
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'points must be an integer.'}, status=400)
+
+    resolution, sensors = rollups.sensor_series(workspace, start, end, max_points)
+    _, crops = rollups.crop_series(workspace, start, end, max_points)
+    return JsonResponse({
+        'status': 'success',
+        'resolution': resolution,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'sensors': sensors,
+        'crops': crops,
+    })
+
+@login_required
+async def export_readings(request, workspace_id):
+    """
+    Stream a workspace's stored readings for a date range as a download.
+    GET parameters: start / end (default the last 30 days), format=csv
+    (default) or parquet, and gzip=1 to compress CSV on the fly.
+    Async, so that ASGI streams the body instead of buffering it.
+    """
+    workspace = await aget_object_or_404(Workspace, id=workspace_id, user=await request.auser())
+    try:
+        start, end = parse_time_range(request, default_days=30)
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    export_format = request.GET.get('format', 'csv')
+    filename = f"{slugify(workspace.name) or 'workspace'}-{start:%Y%m%d}-{end:%Y%m%d}"
+    chunks = exports.reading_rows(workspace, start, end)
+
+    if export_format == 'parquet':
+        try:
+            import pyarrow  # noqa: F401  (optional dependency)
+        except ImportError:
+            return JsonResponse({'status': 'error', 'message': 'Parquet export requires pyarrow.'}, status=501)
+        # Parquet pages are already compressed, so gzip is not applied on top
+        response = StreamingHttpResponse(exports.parquet_chunks(chunks), content_type='application/vnd.apache.parquet')
+        filename += '.parquet'
+    elif export_format == 'csv':
+        body = exports.csv_chunks(chunks)
+        filename += '.csv'
+        if request.GET.get('gzip') in ('1', 'true'):
+            body = exports.gzip_chunks(body)
+            filename += '.gz'
+            response = StreamingHttpResponse(body, content_type='application/gzip')
+        else:
+            response = StreamingHttpResponse(body, content_type='text/csv; charset=utf-8')
+    else:
+        return JsonResponse({'status': 'error', 'message': 'format must be csv or parquet.'}, status=400)
+
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+@login_required
+def reading_logs_api(request, workspace_id):
+    """
+    Newest-first reading log of a workspace for infinite scroll.
+    GET parameters: cursor (the "next" value of the previous page), limit,
+    device, crop, start / end and <field>_min / <field>_max thresholds.
+    Rows are arrays in the order given by "columns".
+    """
+    workspace = get_object_or_404(Workspace, id=workspace_id, user=request.user)
+
+    params = request.GET.dict()
+    try:
+        for name in ('start', 'end'):
+            if params.get(name):
+                value = parse_datetime(params[name])
+                if value is None:
+                    raise ValueError(f'{name} must be an ISO 8601 date or datetime.')
+                params[name] = timezone.make_aware(value) if timezone.is_naive(value) else value
+        readings = reading_logs.filtered_readings(workspace, params)
+        limit = int(params.get('limit', reading_logs.DEFAULT_LIMIT))
+        rows, next_cursor = reading_logs.log_page(readings, params.get('cursor'), limit)
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    return JsonResponse({'columns': reading_logs.COLUMNS, 'rows': rows, 'next': next_cursor})
@@ -101,8 +101,10 @@ ASGI_APPLICATION = 'soilution.asgi.application'
 
 database_url = os.environ.get('DATABASE_URL')
 
+# Seconds a connection is reused (0 closes it after every request, and after every
+# database channel layer call on its worker threads)
 DATABASES = {
-    'default': dj_database_url.parse(database_url)
+    'default': dj_database_url.parse(database_url, conn_max_age=int(os.environ.get('DATABASE_CONN_MAX_AGE', 0)))
 }
 
 # Session engine (default is database-backed)
@@ -168,11 +170,178 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer",
+# The in-memory layer only reaches sockets held by the same process.  Set
+# CHANNEL_LAYER=database to share channels and groups between worker processes
+# through the database (detector.channel_layer; Postgres LISTEN/NOTIFY, polling
+# elsewhere) and run several workers without Redis.
+CHANNEL_LAYER = os.environ.get('CHANNEL_LAYER', 'memory')
+if CHANNEL_LAYER == 'database':
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "detector.channel_layer.DatabaseChannelLayer",
+            "CONFIG": {
+                "capacity": int(os.environ.get('CHANNEL_LAYER_CAPACITY', 100)),  # messages per channel
+                "expiry": int(os.environ.get('CHANNEL_LAYER_EXPIRY', 60)),  # seconds
+                "group_expiry": 86400,  # seconds
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
+        },
+    }
+
+# 'default' is per process.  Several workers sharing the database channel layer also
+# need a cache they all see for the inbox versions (INBOX_CACHE_ALIAS), so 'shared' is
+# a table in the same database: create it with `python manage.py createcachetable`.
+# A system check refuses a per-process inbox cache with CHANNEL_LAYER=database.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     },
 }
+if CHANNEL_LAYER == 'database':
+    CACHES['shared'] = {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'soilution_cache',
+    }
+
+# Crop model inference.  INFERENCE_BACKEND is 'keras' or 'numpy'; the NumPy engine
+# needs `python manage.py export_numpy_model` to have written the .npz weights.
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'keras')
+
+# Concurrent ESP32 readings are gathered for up to
+# INFERENCE_MAX_WAIT_MS (or INFERENCE_MAX_BATCH_SIZE rows) and scored in one call
+INFERENCE_BATCHING = os.environ.get('INFERENCE_BATCHING', 'true').lower() == 'true'
+INFERENCE_MAX_BATCH_SIZE = int(os.environ.get('INFERENCE_MAX_BATCH_SIZE', 64))
+INFERENCE_MAX_WAIT_MS = float(os.environ.get('INFERENCE_MAX_WAIT_MS', 5))
+
+# Versioned model bundles live in detector/ml_models/<version>/ (model.keras or
+# model.npz, scaler.pkl, labels.json).  MODEL_VERSION pins one; otherwise the
+# newest is used.  With a poll interval > 0 each worker checks for new bundles in
+# the background and swaps them in without a restart.
+MODEL_VERSION = os.environ.get('MODEL_VERSION')
+MODEL_REGISTRY_POLL_INTERVAL = float(os.environ.get('MODEL_REGISTRY_POLL_INTERVAL', 30))  # seconds, 0 = off
+
+# Shared inference service (python manage.py run_inference_server).  When set, web
+# workers send readings to this Unix socket instead of loading the model; after a
+# timeout or error they score in process and retry the service after
+# INFERENCE_SERVICE_RETRY_INTERVAL seconds.
+INFERENCE_SERVICE_SOCKET = os.environ.get('INFERENCE_SERVICE_SOCKET')
+INFERENCE_SERVICE_TIMEOUT = float(os.environ.get('INFERENCE_SERVICE_TIMEOUT', 0.5))  # seconds
+INFERENCE_SERVICE_RETRY_INTERVAL = float(os.environ.get('INFERENCE_SERVICE_RETRY_INTERVAL', 5))
+
+# Cache of top-5 recommendations keyed by the reading quantized to sensor resolution.
+# PREDICTION_CACHE_BACKEND: 'local' (per process), 'django' (shared through
+# CACHES[PREDICTION_CACHE_ALIAS] across workers) or 'off'.
+PREDICTION_CACHE_BACKEND = os.environ.get('PREDICTION_CACHE_BACKEND', 'local')
+PREDICTION_CACHE_ALIAS = 'default'
+PREDICTION_CACHE_MAX_ENTRIES = int(os.environ.get('PREDICTION_CACHE_MAX_ENTRIES', 10000))
+PREDICTION_CACHE_TTL = int(os.environ.get('PREDICTION_CACHE_TTL', 300))  # seconds
+# Per-sensor quantization step overrides, e.g. {'pH': 0.1}
+PREDICTION_CACHE_RESOLUTION = {}
+
+# Precomputed top-5 over a quantized sensor grid (python manage.py build_lookup_table).
+# Readings outside the grid, or in cells whose measured probability error exceeds
+# LOOKUP_TABLE_MAX_ERROR, fall back to live inference.
+LOOKUP_TABLE_ENABLED = os.environ.get('LOOKUP_TABLE_ENABLED', 'false').lower() == 'true'
+LOOKUP_TABLE_DIR = BASE_DIR / 'detector' / 'ml_models' / 'lookup'
+LOOKUP_TABLE_MAX_ERROR = float(os.environ.get('LOOKUP_TABLE_MAX_ERROR', 0.05))
+# Grid overrides per sensor as (min, max, step), e.g. {'pH': (4, 9, 0.25)}
+LOOKUP_TABLE_GRID = {}
+
+# /metrics/ (Prometheus text format).  When METRICS_TOKEN is set, scrapers must send
+# "Authorization: Bearer <token>"; without one, only direct requests from localhost
+# are answered (not ones relayed by a proxy with X-Forwarded-For).  A METRICS_SLOW_REQUEST_SAMPLE_RATE fraction of
+# ESP32 requests slower than METRICS_SLOW_REQUEST_SECONDS is logged to
+# the 'detector.slow_requests' logger with its stage timings.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+METRICS_SLOW_REQUEST_SECONDS = float(os.environ.get('METRICS_SLOW_REQUEST_SECONDS', 0.25))
+METRICS_SLOW_REQUEST_SAMPLE_RATE = float(os.environ.get('METRICS_SLOW_REQUEST_SAMPLE_RATE', 0.1))
+
+# Device WebSocket (ws/device/<device_id>/): frames wait in a per-connection queue of
+# DEVICE_WS_QUEUE_SIZE; when it is full DEVICE_WS_OVERFLOW is 'drop-oldest' or 'reject'.
+DEVICE_WS_QUEUE_SIZE = int(os.environ.get('DEVICE_WS_QUEUE_SIZE', 32))
+DEVICE_WS_OVERFLOW = os.environ.get('DEVICE_WS_OVERFLOW', 'drop-oldest')
+
+# Live dashboard stream (ws/workspace/<id>/): readings are coalesced into at most
+# LIVE_UPDATES_PER_SECOND updates per workspace and worker, sent as deltas with a
+# full keyframe every LIVE_KEYFRAME_INTERVAL seconds.
+LIVE_UPDATES_PER_SECOND = float(os.environ.get('LIVE_UPDATES_PER_SECOND', 2))
+LIVE_KEYFRAME_INTERVAL = float(os.environ.get('LIVE_KEYFRAME_INTERVAL', 30))  # seconds
+
+# Retransmitted readings (same device id and seq, or client timestamp) replay the
+# first response instead of being scored and stored again.  READING_DEDUP_BACKEND:
+# 'local' (per process), 'django' (CACHES[READING_DEDUP_ALIAS], shared by workers) or 'off'.
+READING_DEDUP_BACKEND = os.environ.get('READING_DEDUP_BACKEND', 'local')
+READING_DEDUP_ALIAS = 'default'
+READING_DEDUP_MAX_ENTRIES = int(os.environ.get('READING_DEDUP_MAX_ENTRIES', 50000))
+READING_DEDUP_TTL = int(os.environ.get('READING_DEDUP_TTL', 600))  # seconds
+
+# Token-bucket admission control on the ESP32 endpoints, checked before the body is
+# parsed.  Each device (its authenticated device key, else client address) may burst
+# RATE_LIMIT_DEVICE_BURST requests and then RATE_LIMIT_DEVICE_RATE per second; all
+# devices together share the global bucket (rate 0 disables it).  A batch (or device
+# WebSocket frame) costs one token per RATE_LIMIT_ROWS_PER_TOKEN readings, at least one.
+# RATE_LIMIT_STORE: 'local' (per process), 'django' (CACHES[RATE_LIMIT_CACHE_ALIAS],
+# shared) or 'off'.
+RATE_LIMIT_STORE = os.environ.get('RATE_LIMIT_STORE', 'local')
+RATE_LIMIT_CACHE_ALIAS = 'default'
+RATE_LIMIT_DEVICE_RATE = float(os.environ.get('RATE_LIMIT_DEVICE_RATE', 5))  # requests/second
+RATE_LIMIT_DEVICE_BURST = int(os.environ.get('RATE_LIMIT_DEVICE_BURST', 20))
+RATE_LIMIT_GLOBAL_RATE = float(os.environ.get('RATE_LIMIT_GLOBAL_RATE', 500))
+RATE_LIMIT_GLOBAL_BURST = int(os.environ.get('RATE_LIMIT_GLOBAL_BURST', 1000))
+RATE_LIMIT_ROWS_PER_TOKEN = int(os.environ.get('RATE_LIMIT_ROWS_PER_TOKEN', 100))
+
+# Per-device anomaly detection on ingested readings (see detector/anomalies.py): a
+# sensor is a spike when it is more than ANOMALY_Z_THRESHOLD EWMA standard deviations
+# off, and stuck after ANOMALY_STUCK_READINGS identical values.  Alerts to a dashboard
+# are sent at most every ANOMALY_ALERT_INTERVAL seconds per device and sensor.  Each
+# process checkpoints its state next to ANOMALY_STATE_PATH (anomaly_state.<pid>.npz)
+# every ANOMALY_CHECKPOINT_INTERVAL seconds ('' to keep it in memory only).
+ANOMALY_DETECTION = os.environ.get('ANOMALY_DETECTION', 'on') != 'off'
+ANOMALY_EWMA_ALPHA = float(os.environ.get('ANOMALY_EWMA_ALPHA', 0.05))
+ANOMALY_Z_THRESHOLD = float(os.environ.get('ANOMALY_Z_THRESHOLD', 4))
+ANOMALY_MIN_SAMPLES = int(os.environ.get('ANOMALY_MIN_SAMPLES', 30))
+ANOMALY_STUCK_READINGS = int(os.environ.get('ANOMALY_STUCK_READINGS', 20))
+ANOMALY_MAX_DEVICES = int(os.environ.get('ANOMALY_MAX_DEVICES', 10000))  # least recently seen evicted
+ANOMALY_ALERT_INTERVAL = float(os.environ.get('ANOMALY_ALERT_INTERVAL', 60))  # seconds
+ANOMALY_STATE_PATH = os.environ.get('ANOMALY_STATE_PATH', str(BASE_DIR / 'var' / 'anomaly_state.npz'))
+ANOMALY_CHECKPOINT_INTERVAL = float(os.environ.get('ANOMALY_CHECKPOINT_INTERVAL', 60))  # seconds
+
+# Crop recommendation history on the dashboard and reports (detector/crop_history.py):
+# the last CROP_HISTORY_DAYS days, cached per workspace in CACHES[CROP_HISTORY_CACHE_ALIAS]
+# and updated as readings are stored; rebuilt from scratch when the entry expires.
+CROP_HISTORY_DAYS = int(os.environ.get('CROP_HISTORY_DAYS', 90))
+CROP_HISTORY_CACHE_ALIAS = 'default'
+CROP_HISTORY_CACHE_TTL = int(os.environ.get('CROP_HISTORY_CACHE_TTL', 3600))  # seconds
+
+# Per-user inbox data (recent_messages context and unread totals) is cached in
+# CACHES[INBOX_CACHE_ALIAS] under a per-user version that sending or reading a message
+# replaces; unread totals are pushed over ws/inbox/.  Must be shared by all workers
+# when there are several (CHANNEL_LAYER=database).
+INBOX_CACHE_ALIAS = 'shared' if CHANNEL_LAYER == 'database' else 'default'
+RECENT_MESSAGES_CACHE_TTL = int(os.environ.get('RECENT_MESSAGES_CACHE_TTL', 300))  # seconds, 0 = no cache
+INBOX_UNREAD_CACHE_TTL = int(os.environ.get('INBOX_UNREAD_CACHE_TTL', 300))  # seconds
+
+# Ingested readings are stored only for registered devices (manage.py register_device)
+# that send their key; key lookups are cached per process for DEVICE_KEY_CACHE_TTL
+# seconds, which bounds how long a revoked key keeps working.
+DEVICE_KEY_CACHE_TTL = int(os.environ.get('DEVICE_KEY_CACHE_TTL', 60))  # seconds
+
+# Upper bound on readings accepted by /api/esp32-data/batch/ in one request
+ESP32_BATCH_MAX_READINGS = int(os.environ.get('ESP32_BATCH_MAX_READINGS', 10000))
+
+# Readings from registered devices are stored as SensorReading rows through a
+# write-behind buffer: one bulk_create once READING_BUFFER_MAX_ROWS are pending or
+# READING_BUFFER_MAX_DELAY seconds have passed, plus a flush at shutdown.  A crash
+# loses at most MAX_DELAY seconds of readings; at most READING_BUFFER_MAX_PENDING
+# rows are held while the database is unreachable (the oldest are dropped first).
+READING_BUFFER_MAX_ROWS = int(os.environ.get('READING_BUFFER_MAX_ROWS', 500))
+READING_BUFFER_MAX_DELAY = float(os.environ.get('READING_BUFFER_MAX_DELAY', 2))  # seconds
+READING_BUFFER_MAX_PENDING = int(os.environ.get('READING_BUFFER_MAX_PENDING', 20000))
 
 # AUTH_USER_MODEL = 'detector.CustomUser' 
 
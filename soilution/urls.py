@@ -49,7 +49,7 @@ urlpatterns = [
     path('messages/<int:message_id>/', views.view_message, name='view_message'),
     # path('ajax/unread-count/', views.get_unread_count, name='get_unread_count'),
     path('ajax/messages-status/', views.get_unread_count_and_messages, name='ajax_messages_status'),
-    path('ajax/messages-status/', views.get_unread_conversations, name='get_unread_conversations'),
+    path('ajax/conversations/', views.get_unread_conversations, name='get_unread_conversations'),
     path('messages/thread/<int:sender_id>/', views.load_conversation, name='load_conversation'),
     path('messages/thread/<int:user_id>/', views.message_thread, name='message_thread'),
     # path('messages/send/<int:user_id>/', views.send_message, name='send_message'),
@@ -70,6 +70,11 @@ urlpatterns = [
     # path('users/<int:user_id>/deactivate/', views.deactivate_user, name='deactivate_user'),
     # path('users/<int:user_id>/activate/', views.activate_user, name='activate_user'),
     path('api/esp32-data/', views.esp32_data_api, name='esp32_data_api'),
+    path('api/esp32-data/batch/', views.esp32_batch_api, name='esp32_batch_api'),
+    path('metrics/', views.metrics_view, name='metrics'),
+    path('api/workspaces/<int:workspace_id>/series/', views.workspace_series_api, name='workspace_series_api'),
+    path('api/workspaces/<int:workspace_id>/export/', views.export_readings, name='export_readings'),
+    path('api/workspaces/<int:workspace_id>/logs/', views.reading_logs_api, name='reading_logs_api'),
 ]
 
 if settings.DEBUG:
@@ -0,0 +1,80 @@
+// Live inbox state for the message dropdown, kept current over ws/inbox/
+// instead of polling ajax/messages-status/.  The server sends a snapshot on
+// every (re)connect and inbox_update deltas afterwards; inboxLive.state has
+// the shape of the old AJAX response: {unread_count, messages}.
+(function () {
+  const MAX_MESSAGES = 20;
+
+  const inboxLive = {
+    state: { unread_count: 0, messages: [] },
+    onchange: null, // called with the state after every snapshot or delta
+  };
+
+  function apply(data) {
+    const state = inboxLive.state;
+    if (data.type === "snapshot") {
+      state.unread_count = data.unread_count;
+      state.messages = data.messages;
+    } else if (data.type === "inbox_update") {
+      state.unread_count = data.unread_count;
+      if (data.message) {
+        state.messages = [data.message]
+          .concat(state.messages.filter((msg) => msg.id !== data.message.id))
+          .slice(0, MAX_MESSAGES);
+      }
+      state.messages.forEach((msg) => {
+        if (msg.sender_id === data.read_sender_id || msg.id === data.read_message_id) {
+          msg.is_read = true;
+        }
+      });
+    } else {
+      return false;
+    }
+    return true;
+  }
+
+  // Returns a handle whose onmessage / onopen / onclose survive reconnects;
+  // snapshot and inbox_update messages are consumed here, the rest passed on.
+  inboxLive.connect = function () {
+    const handle = {
+      onmessage: null,
+      onopen: null,
+      onclose: null,
+      socket: null,
+      send: function (data) {
+        if (handle.socket && handle.socket.readyState === WebSocket.OPEN) {
+          handle.socket.send(data);
+        }
+      },
+    };
+    let delay = 1000;
+
+    function open() {
+      const scheme = window.location.protocol === "https:" ? "wss://" : "ws://";
+      const socket = new WebSocket(scheme + window.location.host + "/ws/inbox/");
+      handle.socket = socket;
+      socket.onopen = function (e) {
+        delay = 1000;
+        if (handle.onopen) handle.onopen(e);
+      };
+      socket.onmessage = function (e) {
+        if (apply(JSON.parse(e.data))) {
+          if (inboxLive.onchange) inboxLive.onchange(inboxLive.state);
+        } else if (handle.onmessage) {
+          handle.onmessage(e);
+        }
+      };
+      socket.onclose = function (e) {
+        if (handle.onclose) handle.onclose(e);
+        // The snapshot sent on reconnect resyncs whatever was missed
+        setTimeout(open, delay);
+        delay = Math.min(delay * 2, 30000);
+      };
+    }
+
+    open();
+    return handle;
+  };
+
+  window.inboxLive = inboxLive;
+})();
@@ -0,0 +1,73 @@
+// Lazy loading of older messages in the inbox chat thread (#chat-thread).
+// loadConversation() renders the newest page and calls
+// threadHistory.track(senderId, data.before); scrolling near the top then
+// fetches /messages/thread/<id>/?before=<cursor> and prepends older pages
+// while keeping the visible messages in place.
+(function () {
+  let current = null;
+
+  function escapeHtml(text) {
+    const div = document.createElement("div");
+    div.textContent = text;
+    return div.innerHTML;
+  }
+
+  function render(msg) {
+    const row = document.createElement("div");
+    const body = `<span style="overflow-wrap:anywhere; white-space:pre-wrap; display:block; width:100%;">${escapeHtml(msg.content)}</span>
+      <div class="text-xs text-right opacity-70 mt-1">${escapeHtml(msg.timestamp)}</div>`;
+    if (msg.is_sender) {
+      row.className = "flex justify-end";
+      row.innerHTML = `<div class="max-w-[70%] rounded-lg px-4 py-2 my-1 bg-green-500 text-white" style="word-wrap: break-word; overflow-wrap: break-word;">${body}</div>`;
+    } else {
+      const avatar = msg.sender_avatar
+        ? `<img src="${escapeHtml(msg.sender_avatar)}" alt="Avatar" class="w-full h-full object-cover">`
+        : `<div class="bg-gray-400 text-white w-full h-full flex items-center justify-center text-xs font-semibold rounded-full">👤</div>`;
+      row.className = "flex items-start space-x-2 my-2";
+      row.innerHTML = `<div class="w-8 h-8 rounded-full overflow-hidden flex-shrink-0 border border-gray-300">${avatar}</div>
+        <div class="bg-gray-200 text-black max-w-[70%] px-4 py-2 rounded-lg" style="word-wrap: break-word; overflow-wrap: break-word;">${body}</div>`;
+    }
+    return row;
+  }
+
+  function loadOlder() {
+    const state = current;
+    if (!state || state.loading || !state.before) {
+      return;
+    }
+    state.loading = true;
+    fetch(`/messages/thread/${state.senderId}/?before=${state.before}`, { credentials: "same-origin" })
+      .then((response) => response.json())
+      .then((data) => {
+        if (state !== current) {
+          return; // Another thread was opened meanwhile
+        }
+        const thread = document.getElementById("chat-thread");
+        const previousHeight = thread.scrollHeight;
+        const older = document.createDocumentFragment();
+        data.messages.forEach((msg) => older.appendChild(render(msg)));
+        thread.insertBefore(older, thread.firstChild);
+        thread.scrollTop += thread.scrollHeight - previousHeight;
+        state.before = data.before;
+      })
+      .catch((err) => console.error("Failed to load older messages", err))
+      .finally(() => {
+        state.loading = false;
+      });
+  }
+
+  window.threadHistory = {
+    track: function (senderId, before) {
+      current = { senderId: senderId, before: before, loading: false };
+      const thread = document.getElementById("chat-thread");
+      if (thread && !thread.dataset.historyBound) {
+        thread.dataset.historyBound = "1";
+        thread.addEventListener("scroll", function () {
+          if (thread.scrollTop < 40) {
+            loadOlder();
+          }
+        });
+      }
+    },
+  };
+})();